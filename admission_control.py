@@ -0,0 +1,186 @@
+import asyncio
+import random
+import time
+
+# Per-user and per-channel limits, as a burst plus a steady refill rate
+USER_BURST = 3
+USER_MESSAGES_PER_MINUTE = 6
+CHANNEL_BURST = 6
+CHANNEL_MESSAGES_PER_MINUTE = 20
+
+MAX_QUEUE_DEPTH = 20  # Requests waiting on or being answered by the model before new ones are turned away
+DEFER_ESTIMATED_WAIT = 20.0  # Seconds of estimated wait before new requests are held back until things calm down
+MAX_ESTIMATED_WAIT = 60.0  # Seconds of estimated wait before new requests are turned away
+DEFER_TIMEOUT = 30.0  # Longest a request is held back before it is turned away after all
+DEFAULT_SERVICE_TIME = 5.0  # Guess at how long a reply takes, until some have been timed
+SERVICE_TIME_SMOOTHING = 0.2  # Weight of the newest reply time in the running average
+IDLE_BUCKET_SECONDS = 600  # Buckets untouched this long are full again, so they are dropped
+
+RATE_LIMITED_MESSAGES = [
+    "Slow down, {user}! I only have so many paws. Ask me again in {wait} seconds.",
+    "{user}, one question at a time, I'm a cat, not a search engine. Try again in {wait} seconds.",
+    "*swats at {user}* Too many questions! Give me {wait} seconds.",
+]
+
+CHANNEL_LIMITED_MESSAGES = [
+    "Everyone here is talking at once! Give me {wait} seconds to catch up, {user}.",
+    "This channel is too noisy for a cat, {user}. Try again in {wait} seconds.",
+]
+
+BUSY_MESSAGES = [
+    "I'm swamped right now, {user}. Try again in a little while.",
+    "Too many people want my attention, {user}! Ask me again later.",
+    "*hides under the couch* Too busy, {user}. Come back in a bit.",
+]
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, per_minute: float):
+        """
+        Allows bursts of up to capacity, refilling at per_minute tokens a minute.
+        """
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_wait(self) -> float:
+        """
+        Seconds until a token is available, 0 if one is available now.
+        """
+        self.refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.refill()
+        self.tokens -= 1
+
+
+class RateLimiter:
+    def __init__(self, capacity: float, per_minute: float):
+        """
+        A token bucket per key, like a user or channel.
+        """
+        self.capacity = capacity
+        self.per_minute = per_minute
+        self.buckets = {}
+
+    def get_bucket(self, key) -> TokenBucket:
+        if key not in self.buckets:
+            self.prune()
+            self.buckets[key] = TokenBucket(self.capacity, self.per_minute)
+        return self.buckets[key]
+
+    def prune(self):
+        now = time.monotonic()
+        for key in [key for key, bucket in self.buckets.items() if now - bucket.updated > IDLE_BUCKET_SECONDS]:
+            del self.buckets[key]
+
+
+class Admission:
+    def __init__(self, admitted: bool, message: str | None = None):
+        """
+        Whether a request may go ahead, and if not, the reply to send instead (None to stay quiet).
+        """
+        self.admitted = admitted
+        self.message = message
+        self.started = time.monotonic()
+
+
+class AdmissionController:
+    def __init__(self, concurrency: int = 1):
+        """
+        Decides whether a request goes to the model. Users and channels over their rate limit are turned away, and
+        when the model is backed up, new requests are held back for a while or turned away altogether.
+        - concurrency: How many requests the model answers at once, like the number of worker processes.
+        """
+        self.concurrency = concurrency
+        self.user_limiter = RateLimiter(USER_BURST, USER_MESSAGES_PER_MINUTE)
+        self.channel_limiter = RateLimiter(CHANNEL_BURST, CHANNEL_MESSAGES_PER_MINUTE)
+        self.in_flight = 0
+        self.service_time = DEFAULT_SERVICE_TIME
+        self.finished = asyncio.Condition()
+        self.warned = {}  # User -> time their last rejection reply can be repeated, so spammers get just one
+        self.stats = {"admitted": 0, "deferred": 0, "rejected_user": 0, "rejected_channel": 0,
+                      "rejected_busy": 0, "quiet_rejections": 0}
+
+    def get_estimated_wait(self) -> float:
+        return self.in_flight * self.service_time / self.concurrency
+
+    def is_busy(self, estimated_wait_limit: float) -> bool:
+        return self.in_flight >= MAX_QUEUE_DEPTH or self.get_estimated_wait() > estimated_wait_limit
+
+    def check_rate_limits(self, user: str, channel_id: int) -> Admission | None:
+        """
+        Returns the rejection if the user or channel is over its rate limit, otherwise None.
+        """
+        user_wait = self.user_limiter.get_bucket(user).get_wait()
+        if user_wait:
+            return self.reject(user, "rejected_user", RATE_LIMITED_MESSAGES, user_wait)
+        channel_wait = self.channel_limiter.get_bucket(channel_id).get_wait()
+        if channel_wait:
+            return self.reject(user, "rejected_channel", CHANNEL_LIMITED_MESSAGES, channel_wait)
+        return None
+
+    async def admit(self, user: str, channel_id: int) -> Admission:
+        """
+        Checks a request against the limits, waiting if it is deferred. Call finish once an admitted request is done.
+        """
+        rejection = self.check_rate_limits(user, channel_id)
+        if rejection is not None:
+            return rejection
+
+        if self.is_busy(DEFER_ESTIMATED_WAIT):
+            self.stats["deferred"] += 1
+            print(f"Deferring {user}, estimated wait is {self.get_estimated_wait():.0f}s.")
+            try:
+                async with self.finished:
+                    await asyncio.wait_for(self.finished.wait_for(lambda: not self.is_busy(DEFER_ESTIMATED_WAIT)),
+                                           DEFER_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            if self.is_busy(MAX_ESTIMATED_WAIT):
+                return self.reject(user, "rejected_busy", BUSY_MESSAGES, DEFER_TIMEOUT)
+            # Requests admitted while this one waited may have used up the user's or channel's tokens
+            rejection = self.check_rate_limits(user, channel_id)
+            if rejection is not None:
+                return rejection
+
+        # Only admitted requests use up tokens, so being turned away for load doesn't count against anyone
+        self.user_limiter.get_bucket(user).take()
+        self.channel_limiter.get_bucket(channel_id).take()
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+        return Admission(True)
+
+    async def finish(self, admission: Admission):
+        """
+        Marks an admitted request as done, updating the reply time estimate and letting deferred requests through.
+        """
+        elapsed = time.monotonic() - admission.started
+        self.service_time += SERVICE_TIME_SMOOTHING * (elapsed - self.service_time)
+        self.in_flight -= 1
+        async with self.finished:
+            self.finished.notify_all()
+
+    def reject(self, user: str, reason: str, messages: list[str], wait: float) -> Admission:
+        self.stats[reason] += 1
+        now = time.monotonic()
+        if now < self.warned.get(user, 0):
+            self.stats["quiet_rejections"] += 1
+            return Admission(False)
+        # Warnings that can be repeated already don't need remembering, so the dict doesn't grow with every user
+        self.warned = {warned_user: until for warned_user, until in self.warned.items() if until > now}
+        self.warned[user] = now + wait
+        print(f"Turned away {user}: {reason}.")
+        return Admission(False, random.choice(messages).format(user=user, wait=max(1, round(wait))))
+
+    def get_stats(self) -> str:
+        stats = ", ".join(f"{value} {name.replace('_', ' ')}" for name, value in self.stats.items())
+        return (f"{stats}. {self.in_flight} in flight, {self.get_estimated_wait():.0f}s estimated wait "
+                f"({self.service_time:.1f}s per reply).")
@@ -1,12 +1,16 @@
 import re
 import asyncio
-import subprocess
-import tempfile
-import os
+import atexit
 from agents import Agent, Runner, OpenAIChatCompletionsModel
 from openai import AsyncOpenAI
 from pydantic import BaseModel
 
+from artifact_cache import ArtifactCache
+from sandbox_pool import SandboxPool
+
+NUM_CANDIDATES = 3  # Code generations tried in parallel, the best one is kept
+CODE_PROMPT = "Create a calculator object in Python with methods to add and subtract 2 numbers."
+
 # Initialize models
 model = OpenAIChatCompletionsModel(
     model="llama3.2",
@@ -114,64 +118,117 @@ def clean_code(code: str) -> str:
     return code.strip()
 
 
-# Function to run Python code safely in a sandbox
-def run_code_safely(code: str):
-    cleaned_code = clean_code(code)
+sandbox_pool = None
 
-    if not cleaned_code.strip():
-        return "Error: No valid Python code extracted."
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".py") as temp_file:
-        temp_file.write(cleaned_code.encode())
-        temp_file.close()
-        try:
-            result = subprocess.run(
-                ["python", temp_file.name],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            return result.stdout or result.stderr
-        except Exception as e:
-            return str(e)
-        finally:
-            os.remove(temp_file.name)
+def get_sandbox_pool() -> SandboxPool:
+    """Starts the warm sandboxes the first time code is run."""
+    global sandbox_pool
+    if sandbox_pool is None:
+        sandbox_pool = SandboxPool(size=NUM_CANDIDATES)  # One warm sandbox per candidate
+        atexit.register(sandbox_pool.close)
+    return sandbox_pool
 
 
-async def main():
-    # Step 1: Generate code
-    print("🔄 Generating Python code...")
-    result = await Runner.run(triage_agent, input="Create a calculator object in Python with methods to add and subtract 2 numbers.")
-    summary = result.final_output_as(BasicSummary)
+artifact_cache = ArtifactCache()
 
-    cleaned_code = clean_code(summary.code)
-    if not cleaned_code:
-        print("❌ Error: No valid Python code extracted.")
-        return
 
-    print(f"✅ Cleaned Code:\n{cleaned_code}")
+async def generate_code(prompt: str, candidate: int) -> str:
+    """Generates and cleans one candidate, reusing it if this prompt was seen before."""
+    cached = artifact_cache.get("code", prompt, str(candidate))
+    if cached is not None:
+        return cached
+    result = await Runner.run(triage_agent, input=prompt)
+    cleaned_code = clean_code(result.final_output_as(BasicSummary).code)
+    if cleaned_code:
+        artifact_cache.put("code", cleaned_code, prompt, str(candidate))
+    return cleaned_code
 
-    # Step 2: Run the cleaned code
-    print("🚀 Running the generated code...")
-    execution_output = run_code_safely(cleaned_code)
-    print(f"🖥️ Execution Output:\n{execution_output}")
 
-    # Step 3: Generate unit tests
-    print("🔄 Generating unit tests...")
-    test_result = await Runner.run(testing_agent, input=f"Write unit tests for this code:\n{cleaned_code}")
-    test_summary = test_result.final_output_as(TestSummary)
+async def generate_tests(code: str) -> str:
+    """Generates and cleans unit tests for the code, reusing them if this code was seen before."""
+    cached = artifact_cache.get("tests", code)
+    if cached is not None:
+        return cached
+    result = await Runner.run(testing_agent, input=f"Write unit tests for this code:\n{code}")
+    cleaned_tests = clean_code(result.final_output_as(TestSummary).test_results)
+    if cleaned_tests:
+        artifact_cache.put("tests", cleaned_tests, code)
+    return cleaned_tests
+
+
+async def run_code_cached(code: str) -> str:
+    """Runs cleaned code in a sandbox without blocking the other candidates, reusing the output of identical code."""
+    cached = artifact_cache.get("run", code)
+    if cached is not None:
+        return cached
+    result = await asyncio.to_thread(get_sandbox_pool().run, code)
+    if result.error is None:  # Timeouts and crashes might not happen again, so they aren't kept
+        artifact_cache.put("run", result.get_all_output(), code)
+    return result.get_all_output()
 
-    cleaned_tests = clean_code(test_summary.test_results)
-    if not cleaned_tests:
-        print("❌ Error: No valid test code extracted.")
-        return
 
-    print(f"✅ Cleaned Tests:\n{cleaned_tests}")
+def tests_passed(test_output: str | None) -> bool:
+    """unittest's summary is the last line, "OK" or "OK (skipped=1)" when nothing failed."""
+    lines = (test_output or "").strip().splitlines()
+    return bool(lines) and re.match(r"^OK\b", lines[-1].strip()) is not None
 
-    # Step 4: Run the unit tests
-    print("🧪 Running the unit tests...")
-    test_execution_output = run_code_safely(cleaned_tests)
-    print(f"📊 Test Results:\n{test_execution_output}")
+
+async def run_candidate(prompt: str, candidate: int) -> dict | None:
+    """Generates code, then runs it while its tests are generated, then runs the tests."""
+    print(f"🔄 Candidate {candidate + 1}: generating Python code...")
+    cleaned_code = await generate_code(prompt, candidate)
+    if not cleaned_code:
+        print(f"❌ Candidate {candidate + 1}: no valid Python code extracted.")
+        return None
+
+    print(f"🚀 Candidate {candidate + 1}: running the code while generating unit tests...")
+    execution_output, cleaned_tests = await asyncio.gather(run_code_cached(cleaned_code),
+                                                           generate_tests(cleaned_code))
+    test_output = None
+    if cleaned_tests:
+        print(f"🧪 Candidate {candidate + 1}: running the unit tests...")
+        test_output = await run_code_cached(cleaned_tests)
+    return {
+        "candidate": candidate,
+        "code": cleaned_code,
+        "execution_output": execution_output,
+        "tests": cleaned_tests,
+        "test_output": test_output,
+    }
+
+
+def pick_best_candidate(candidates: list[dict]) -> dict:
+    """Prefers candidates whose tests pass, then ones whose code ran without a traceback."""
+    return max(candidates, key=lambda candidate: (tests_passed(candidate["test_output"]),
+                                                  "Traceback" not in candidate["execution_output"]))
+
+
+async def main():
+    # Start the sandboxes now, so they are warm by the time there is code to run
+    get_sandbox_pool()
+
+    results = await asyncio.gather(*(run_candidate(CODE_PROMPT, candidate) for candidate in range(NUM_CANDIDATES)),
+                                   return_exceptions=True)
+    for candidate, result in enumerate(results):
+        if isinstance(result, Exception):  # One failed model call or sandbox shouldn't sink the other candidates
+            print(f"❌ Candidate {candidate + 1}: failed with {type(result).__name__}: {result}")
+    candidates = [result for result in results if isinstance(result, dict)]
+    if not candidates:
+        print("❌ Error: No valid Python code extracted.")
+        return
+
+    best = pick_best_candidate(candidates)
+    print(f"🏆 Picked candidate {best['candidate'] + 1} of {NUM_CANDIDATES}")
+    print(f"✅ Cleaned Code:\n{best['code']}")
+    print(f"🖥️ Execution Output:\n{best['execution_output']}")
+    if not best["tests"]:
+        print("❌ Error: No valid test code extracted.")
+        return
+    print(f"✅ Cleaned Tests:\n{best['tests']}")
+    print(f"📊 Test Results:\n{best['test_output']}")
+    print(f"⏱️ Sandbox: {get_sandbox_pool().get_stats()}")
+    print(f"📦 Cache: {artifact_cache.get_stats()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+CACHE_DIR = "./artifact_cache"
+
+
+def get_cache_key(kind: str, *parts: str) -> str:
+    """
+    Hashes what an artifact was made from, so the same inputs always find the same artifact.
+    """
+    return hashlib.sha256(json.dumps([kind, *parts]).encode("utf-8")).hexdigest()
+
+
+class ArtifactCache:
+    def __init__(self, cache_dir: str = CACHE_DIR):
+        """
+        Caches generated code, generated tests and execution results on disk, one JSON file per artifact named by
+        the hash of its inputs.
+        """
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, kind: str, *parts: str):
+        """
+        Returns the cached artifact made from these inputs, or None.
+        """
+        path = self.get_path(get_cache_key(kind, *parts))
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                value = json.load(file)["value"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            value = None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, kind: str, value, *parts: str):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+            json.dump({"kind": kind, "value": value}, file)
+        os.replace(temp_path, self.get_path(get_cache_key(kind, *parts)))  # Readers never see half an artifact
+
+    def get_stats(self) -> str:
+        with self.lock:
+            lookups = self.hits + self.misses
+            hit_ratio = self.hits / lookups if lookups else 0.0
+            return f"{self.hits} hits, {self.misses} misses ({hit_ratio:.0%} hit ratio)"
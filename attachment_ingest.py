@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+from PIL import Image
+
+from sqlite_store import SQLiteStore
+
+INPUT_DIR = "./input"
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff"]
+MAX_ATTACHMENT_BYTES = 8 * 1024 * 1024  # Anything bigger is skipped without downloading it
+MAX_IMAGE_DIMENSION = 1568  # Longest side images are downscaled to before anything else sees them
+MAX_CONCURRENT_DOWNLOADS = 4
+
+download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+
+def get_content_hash(data: bytes) -> str:
+    """
+    Generate a hexadecimal hash of the attachment content, used as its blob name.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def downscale_image(data: bytes) -> bytes:
+    """
+    Shrinks an image so its longest side is at most MAX_IMAGE_DIMENSION, keeping the format.
+    Animated GIFs are left alone since resizing would drop all but the first frame, and so are images PIL can't read,
+    which are kept as they were sent.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= MAX_IMAGE_DIMENSION or getattr(image, "is_animated", False):
+                return data
+            image_format = image.format
+            image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+            output = io.BytesIO()
+            image.save(output, format=image_format)
+            return output.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Couldn't downscale image, keeping it as it is: {e}")
+        return data
+
+
+def store_blob(data: bytes, extension: str) -> tuple[str, str]:
+    """
+    Stores attachment content under the hash of the original bytes, returning (content_hash, path).
+    Content that was already stored is not written again, so re-posted images are kept once.
+    """
+    content_hash = get_content_hash(data)
+    path = os.path.join(INPUT_DIR, f"{content_hash}{extension}")
+    if os.path.exists(path):
+        print(f"Attachment already stored: {path}")
+        return content_hash, path
+
+    os.makedirs(INPUT_DIR, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=INPUT_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as file:
+            file.write(downscale_image(data))
+        os.replace(temp_path, path)  # Only complete blobs ever show up under their hash
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    print(f"Attachment stored: {path}")
+    return content_hash, path
+
+
+async def ingest_attachment(attachment, allowed_extensions: list[str]) -> dict | None:
+    """
+    Downloads and stores a single attachment, returning its index entry or None if it was skipped.
+    """
+    extension = os.path.splitext(attachment.filename)[1].lower()
+    if extension not in allowed_extensions:
+        print(f"Skipping {attachment.filename}, not an image.")
+        return None
+    if attachment.size > MAX_ATTACHMENT_BYTES:
+        print(f"Skipping {attachment.filename}, it is {attachment.size} bytes.")
+        return None
+
+    try:
+        async with download_semaphore:
+            data = await attachment.read()
+        # Hashing, resizing and writing are blocking, so keep them off the event loop
+        content_hash, path = await asyncio.to_thread(store_blob, data, extension)
+    except Exception as e:
+        # One bad attachment shouldn't cost the user their reply, or the other attachments
+        print(f"Skipping {attachment.filename}, it couldn't be stored: {type(e).__name__}: {e}")
+        return None
+    return {"content_hash": content_hash, "path": path, "filename": attachment.filename}
+
+
+async def ingest_attachments(message, store: SQLiteStore, allowed_extensions: list[str]) -> list[dict]:
+    """
+    Downloads all of a message's attachments concurrently and indexes them by message id.
+    """
+    results = await asyncio.gather(*(ingest_attachment(attachment, allowed_extensions)
+                                     for attachment in message.attachments))
+    entries = [entry for entry in results if entry is not None]
+    if entries:
+        namespace_str = "/".join((str(message.id), "attachments"))
+        await store.amset([(namespace_str, entry["content_hash"], json.dumps(entry)) for entry in entries])
+    return entries
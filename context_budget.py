@@ -0,0 +1,116 @@
+import threading
+
+from langchain_core.messages import BaseMessage
+
+CHARS_PER_TOKEN = 4  # Rough average for English text across the models we run
+MESSAGE_OVERHEAD_TOKENS = 4  # Role markers and separators added around every message
+TOKEN_COUNT_KEY = "fritters_token_count"  # Where a message's token count is cached
+
+# Context sizes, from the num_ctx in ./modelfiles
+DEFAULT_CONTEXT_TOKENS = 32768
+MODEL_CONTEXT_TOKENS = {
+    "llama3.2": 32768,
+    "mistral": 32768,
+    "codellama": 32768,
+    "mistral-openorca": 32768,
+    "hermes3": 32768,
+    "qwen2.5-coder": 32768,
+}
+
+HISTORY_BUDGET_FRACTION = 0.25  # Summarize once the history takes up this much of the model's context
+RESERVED_OUTPUT_TOKENS = 2048  # Room left for the model's reply when trimming a prompt
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)  # Round up
+
+
+def count_message_tokens(message: BaseMessage) -> int:
+    """
+    Returns the number of tokens in a message, caching it on the message.
+    Uses the model's own count for replies that have usage metadata, otherwise an estimate.
+    """
+    cached = message.response_metadata.get(TOKEN_COUNT_KEY)
+    if cached is not None:
+        return cached
+
+    usage = getattr(message, "usage_metadata", None)
+    if usage and usage.get("output_tokens"):
+        tokens = usage["output_tokens"]
+    else:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        tokens = estimate_tokens(content)
+    tokens += MESSAGE_OVERHEAD_TOKENS
+    message.response_metadata[TOKEN_COUNT_KEY] = tokens
+    return tokens
+
+
+def count_tokens(messages: list[BaseMessage]) -> int:
+    return sum(count_message_tokens(message) for message in messages)
+
+
+def get_context_tokens(model: str) -> int:
+    return MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS)
+
+
+def get_history_budget(model: str) -> int:
+    """
+    How many tokens of conversation history are kept before it gets summarized.
+    """
+    return int(get_context_tokens(model) * HISTORY_BUDGET_FRACTION)
+
+
+def get_prompt_budget(model: str) -> int:
+    """
+    How many tokens a prompt can use while leaving room for the reply.
+    """
+    return get_context_tokens(model) - RESERVED_OUTPUT_TOKENS
+
+
+def should_summarize(messages: list[BaseMessage], model: str) -> bool:
+    """
+    Summarize when the history is over the model's budget, no matter how many messages that takes.
+    """
+    return len(messages) > 1 and count_tokens(messages) > get_history_budget(model)
+
+
+def trim_to_budget(messages: list[BaseMessage], budget: int) -> list[BaseMessage]:
+    """
+    Drops the oldest messages until the rest fit in the budget. The newest message is always kept.
+    """
+    kept = []
+    total = 0
+    for message in reversed(messages):
+        tokens = count_message_tokens(message)
+        if kept and total + tokens > budget:
+            break
+        kept.append(message)
+        total += tokens
+    if len(kept) < len(messages):
+        print(f"Trimmed {len(messages) - len(kept)} old messages to fit in {budget} tokens.")
+    return list(reversed(kept))
+
+
+class ContextStats:
+    def __init__(self):
+        """
+        Running totals of how many prompt tokens summarizing has saved.
+        """
+        self.lock = threading.Lock()
+        self.summaries = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def record_summary(self, tokens_before: int, tokens_after: int):
+        with self.lock:
+            self.summaries += 1
+            self.tokens_before += tokens_before
+            self.tokens_after += tokens_after
+        print(f"Summarized {tokens_before} tokens of history down to {tokens_after} "
+              f"(saved {tokens_before - tokens_after}, {self.get_tokens_saved()} total over {self.summaries} summaries).")
+
+    def get_tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+context_stats = ContextStats()
@@ -0,0 +1,191 @@
+import asyncio
+import re
+import time
+from collections import deque
+
+DISCORD_MESSAGE_LIMIT = 2000
+FENCE = "```"
+
+# Discord allows 5 messages per 5 seconds in a channel, sending faster than that gets a 429 and a retry-after stall
+CHANNEL_MESSAGE_LIMIT = 5
+CHANNEL_LIMIT_PERIOD = 5.0
+
+# Where a chunk may be cut, from most to least preferred
+SEPARATORS = [
+    r"(?<=\n\n)",  # Paragraphs
+    r"(?<=\n)",  # Lines
+    r"(?<=[.!?] )",  # Sentences
+    r"(?<= )",  # Words
+]
+
+
+def is_fence(line: str) -> bool:
+    return line.lstrip().startswith(FENCE)
+
+
+def split_code_blocks(text: str) -> list[str]:
+    """
+    Splits text into alternating prose and fenced code block segments, so blocks are only cut when they have to be.
+    """
+    segments = []
+    current = []
+    in_fence = False
+    for line in text.splitlines(keepends=True):
+        fence = is_fence(line)
+        if fence and not in_fence and current:
+            segments.append("".join(current))
+            current = []
+        current.append(line)
+        if fence:
+            in_fence = not in_fence
+            if not in_fence:
+                segments.append("".join(current))
+                current = []
+    if current:
+        segments.append("".join(current))
+    return segments
+
+
+def get_open_fence(text: str, open_fence: str | None = None) -> str | None:
+    """
+    Returns the fence line of the code block left open at the end of the text, or None if every block is closed.
+    - open_fence: Fence line of the block already open where the text starts.
+    """
+    for line in text.splitlines():
+        if is_fence(line):
+            open_fence = line.strip() if open_fence is None else None
+    return open_fence
+
+
+def _split_text(text: str, limit: int, separators: list[str]) -> list[str]:
+    """
+    Cuts text into parts of at most limit characters, only cutting at a less preferred separator inside the pieces
+    that are still too big.
+    """
+    if len(text) <= limit:
+        return [text]
+    if not separators:
+        return [text[i:i + limit] for i in range(0, len(text), limit)]
+    parts = []
+    for part in re.split(separators[0], text):
+        if part:
+            parts.extend(_split_text(part, limit, separators[1:]))
+    return parts
+
+
+def _attach_fences(parts: list[str]) -> list[str]:
+    """
+    Joins parts that are nothing but a fence line to the code they open or close, so no chunk ends on an opening
+    fence or starts on a closing one.
+    """
+    attached = []
+    opening = ""  # Opening fence waiting for the part after it
+    open_fence = None
+    for part in parts:
+        was_open = open_fence
+        open_fence = get_open_fence(part, open_fence)
+        if part.strip() and all(is_fence(line) for line in part.strip().splitlines()):
+            if was_open is None or opening:
+                opening += part
+                continue
+            if attached:
+                attached[-1] += part
+                continue
+        attached.append(opening + part)
+        opening = ""
+    if opening:
+        attached.append(opening)
+    return attached
+
+
+def _render_chunk(body: str, open_fence: str | None) -> tuple[str, str | None]:
+    """
+    Returns the message for a chunk of the reply, with the code block it starts inside reopened and the one it ends
+    inside closed, and the fence line of the block left open for the next chunk.
+    """
+    next_open_fence = get_open_fence(body, open_fence)
+    chunk = body.strip("\n")
+    if open_fence is not None:
+        chunk = f"{open_fence}\n{chunk}"
+    if next_open_fence is not None:
+        chunk = f"{chunk.rstrip()}\n{FENCE}"
+    return chunk, next_open_fence
+
+
+def _pack_parts(parts: list[str], limit: int) -> list[str]:
+    """
+    Greedily packs parts into messages of at most limit characters, counting the fences each message needs to close
+    and reopen a code block it cuts through.
+    """
+    chunks = []
+    body = ""
+    open_fence = None  # Fence line of the code block the current chunk starts inside
+    for part in parts:
+        if body and len(_render_chunk(body + part, open_fence)[0]) > limit:
+            chunk, open_fence = _render_chunk(body, open_fence)
+            chunks.append(chunk)
+            body = ""
+        body += part
+    if body:
+        chunks.append(_render_chunk(body, open_fence)[0])
+    # Chunks with nothing but fences or whitespace in them would just be noise in the channel
+    return [chunk for chunk in chunks if not all(is_fence(line) for line in chunk.splitlines() if line.strip())]
+
+
+def split_reply(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> list[str]:
+    """
+    Splits a reply into messages that fit Discord's limit, cutting at code block, paragraph and sentence boundaries
+    before resorting to words or characters. Code blocks that still have to be cut are closed and reopened.
+    """
+    if len(text) <= limit:
+        return [text]
+
+    # Parts are kept small enough that any one of them still fits once a fence is reopened before it, a fence line is
+    # attached to it and the block is closed after it
+    fence_length = max((len(line.strip()) for line in text.splitlines() if is_fence(line)), default=0)
+    part_limit = max(1, limit - 3 * (fence_length + 1))
+    parts = [part for segment in split_code_blocks(text) for part in _split_text(segment, part_limit, SEPARATORS)]
+    chunks = _pack_parts(_attach_fences(parts), limit)
+    # The parts are sized so this never happens, but a chunk Discord refuses would cost the user the whole reply
+    return [chunk[i:i + limit] for chunk in chunks for i in range(0, len(chunk), limit)]
+
+
+class ChannelPacer:
+    def __init__(self, limit: int = CHANNEL_MESSAGE_LIMIT, period: float = CHANNEL_LIMIT_PERIOD):
+        """
+        Mirrors Discord's per-channel message bucket locally, so multi-chunk replies are paced to stay under it
+        instead of running into a 429 and waiting out the retry-after.
+        - limit: Messages allowed per period.
+        - period: Length of the bucket window in seconds.
+        """
+        self.limit = limit
+        self.period = period
+        self.sent = {}  # Channel id -> deque of recent send times
+        self.locks = {}  # Channel id -> lock keeping chunks of concurrent replies from interleaving
+
+    def get_lock(self, channel_id: int) -> asyncio.Lock:
+        if channel_id not in self.locks:
+            self.locks[channel_id] = asyncio.Lock()
+        return self.locks[channel_id]
+
+    async def wait_for_slot(self, channel_id: int):
+        """
+        Waits until the channel's bucket has room for another message and records the send.
+        """
+        sent_times = self.sent.setdefault(channel_id, deque())
+        now = time.monotonic()
+        while sent_times and now - sent_times[0] >= self.period:
+            sent_times.popleft()
+        if len(sent_times) >= self.limit:
+            await asyncio.sleep(self.period - (now - sent_times[0]))
+            sent_times.popleft()
+        sent_times.append(time.monotonic())
+
+    async def send(self, channel, text: str):
+        """
+        Sends a reply to the channel, split into as many messages as needed and paced to the channel's bucket.
+        """
+        async with self.get_lock(channel.id):
+            for chunk in split_reply(text):
+                await self.wait_for_slot(channel.id)
+                await channel.send(chunk)
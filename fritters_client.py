@@ -0,0 +1,129 @@
+import http.client
+import json
+import os
+import socket
+
+import fritters_utils
+from message_source import MessageSource
+
+DEFAULT_SOCKET_PATH = "fritters.sock"
+DEFAULT_HOST = "127.0.0.1"  # The server never listens beyond this machine
+DEFAULT_PORT = 8765  # Only used where there are no Unix sockets, anywhere else the port has to be configured
+TOKEN_HEADER = "X-Fritters-Token"  # Carries server_token, which the HTTP port requires
+HEALTH_CHECK_TIMEOUT = 1.0  # How long to wait when checking if a server is running
+
+
+def get_socket_path() -> str:
+    return fritters_utils.get_key_from_json_config_file(fritters_utils.SERVER_SOCKET_KEY) or DEFAULT_SOCKET_PATH
+
+
+def get_port() -> int | None:
+    """
+    Returns the server's HTTP port, or None if it only listens on its Unix socket. The port is opt-in, since anything
+    on the machine can connect to it, unlike the socket only this user can open.
+    """
+    port = fritters_utils.get_key_from_json_config_file(fritters_utils.SERVER_PORT_KEY)
+    if port:
+        return int(port)
+    return None if hasattr(socket, "AF_UNIX") else DEFAULT_PORT
+
+
+def get_token() -> str | None:
+    return fritters_utils.get_key_from_json_config_file(fritters_utils.SERVER_TOKEN_KEY) or None
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float | None = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class FrittersClient:
+    def __init__(self, socket_path: str = None, port: int = None):
+        """
+        Talks to a running fritters_server, over its Unix socket if there is one, otherwise its local HTTP port if
+        one is configured, sending server_token along.
+        Has the same ask functions as miss_fritters, so frontends can use either.
+        """
+        self.socket_path = socket_path or get_socket_path()
+        self.port = port or get_port()
+        self.token = get_token()
+
+    def get_connection(self, timeout: float | None = None) -> http.client.HTTPConnection:
+        if hasattr(socket, "AF_UNIX") and os.path.exists(self.socket_path):
+            return UnixHTTPConnection(self.socket_path, timeout)
+        if self.port is None:
+            raise ConnectionRefusedError(f"No server socket at {self.socket_path} and no server_port configured.")
+        return http.client.HTTPConnection(DEFAULT_HOST, self.port, timeout=timeout)
+
+    def get_headers(self) -> dict:
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers[TOKEN_HEADER] = self.token
+        return headers
+
+    def request(self, method: str, path: str, body: dict = None, timeout: float | None = None) -> dict:
+        connection = self.get_connection(timeout)
+        try:
+            connection.request(method, path, body=None if body is None else json.dumps(body),
+                               headers=self.get_headers())
+            response = connection.getresponse()
+            value = json.loads(response.read())
+            if response.status != 200:
+                raise RuntimeError(f"Server error: {value.get('error')}")
+            return value
+        finally:
+            connection.close()
+
+    def ask_stuff(self, prompt: str, source: MessageSource, user_id: str) -> str:
+        return self.request("POST", "/ask", {"prompt": prompt, "source": source.name, "user_id": user_id})["response"]
+
+    def ask_stuff_stream(self, prompt: str, source: MessageSource, user_id: str):
+        """
+        Yields the reply in pieces as the server generates them. Stopping early hangs up, which stops the server too.
+        """
+        connection = self.get_connection()
+        try:
+            connection.request("POST", "/ask/stream",
+                               body=json.dumps({"prompt": prompt, "source": source.name, "user_id": user_id}),
+                               headers=self.get_headers())
+            response = connection.getresponse()
+            if response.status != 200:
+                raise RuntimeError(f"Server error: {json.loads(response.read()).get('error')}")
+            for line in response:
+                message = json.loads(line)
+                if "error" in message:
+                    raise RuntimeError(f"Server error: {message['error']}")
+                if message.get("done"):
+                    break
+                yield message["text"]
+        finally:
+            connection.close()
+
+    def health(self) -> dict:
+        return self.request("GET", "/health", timeout=HEALTH_CHECK_TIMEOUT)
+
+    def metrics(self) -> dict:
+        return self.request("GET", "/metrics")
+
+    def is_available(self) -> bool:
+        try:
+            return self.health().get("status") == "ok"
+        except (OSError, RuntimeError, ValueError):
+            return False
+
+
+def get_server_client() -> FrittersClient | None:
+    """
+    Returns a client for the resident server if one is running, otherwise None.
+    """
+    client = FrittersClient()
+    if client.is_available():
+        print("Using the running Miss Fritters server.")
+        return client
+    return None
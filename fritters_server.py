@@ -0,0 +1,271 @@
+"""
+Resident Miss Fritters server. Loads the agent stack once and serves every frontend from it, over a Unix socket only
+this user can open, and a local-only HTTP port if server_port is configured, so they share one warm process, one
+database connection and one set of caches. The HTTP port needs server_token too, since anything on the machine can
+connect to it, and every request to it has to send the token in the X-Fritters-Token header.
+
+Usage: python fritters_server.py
+
+Endpoints:
+- POST /ask          {"prompt": ..., "source": "LOCAL", "user_id": ...} -> {"response": ...}
+- POST /ask/stream   Same body, the response is streamed as JSON lines: {"text": ...} pieces, then {"done": true}
+- GET  /health       Whether the server is up and how long it has been running
+- GET  /metrics      Request counts, latencies and cache stats
+
+POST bodies have to be sent as application/json, and requests from web pages (with an Origin header) are refused, so a
+browser can't be tricked into asking on someone's behalf.
+"""
+import hmac
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import context_budget
+import lazy_modules
+from fritters_client import DEFAULT_HOST, TOKEN_HEADER, get_port, get_socket_path, get_token
+from message_source import MessageSource
+
+LATENCY_WINDOW = 1000  # Most recent requests the latency percentiles are computed over
+
+miss_fritters = lazy_modules.lazy_module("miss_fritters")
+
+
+class ServerMetrics:
+    def __init__(self):
+        """
+        Running request counts and latencies for /metrics.
+        """
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def start_request(self):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+
+    def finish_request(self, seconds: float, failed: bool):
+        with self.lock:
+            self.in_flight -= 1
+            self.latencies.append(seconds)
+            if failed:
+                self.errors += 1
+
+    def get_uptime(self) -> float:
+        return time.time() - self.started_at
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            latencies = list(self.latencies)
+            snapshot = {
+                "uptime_seconds": round(self.get_uptime(), 1),
+                "requests": self.requests,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+            }
+        if latencies:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            snapshot["latency_seconds"] = {"p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3)}
+        snapshot["summaries"] = context_budget.context_stats.summaries
+        snapshot["summary_tokens_saved"] = context_budget.context_stats.get_tokens_saved()
+        snapshot["module_load_seconds"] = lazy_modules.get_load_times()
+        snapshot["store"] = miss_fritters.store.get_stats()
+        return snapshot
+
+
+metrics = ServerMetrics()
+user_locks = {}  # User id -> lock, so a user's requests run one at a time on their conversation thread
+user_locks_lock = threading.Lock()
+
+
+def get_user_lock(user_id: str) -> threading.Lock:
+    with user_locks_lock:
+        if user_id not in user_locks:
+            user_locks[user_id] = threading.Lock()
+        return user_locks[user_id]
+
+
+class FrittersRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def check_request(self) -> bool:
+        """
+        Refuses requests without the server's token, if it has one, and requests made by web pages. Returns whether
+        the request can go ahead.
+        """
+        token = getattr(self.server, "token", None)
+        if token is not None and not hmac.compare_digest(self.headers.get(TOKEN_HEADER, "").encode("utf-8"),
+                                                         token.encode("utf-8")):
+            self.refuse(401, f"Missing or wrong {TOKEN_HEADER} header")
+            return False
+        if self.headers.get("Origin") is not None:  # Only browsers send it, and no frontend is a web page
+            self.refuse(403, "Requests from web pages aren't allowed")
+            return False
+        return True
+
+    def refuse(self, status: int, error: str):
+        print(f"Refused {self.command} {self.path} from {self.address_string()}: {error}")
+        self.close_connection = True  # The body wasn't read, so the connection can't be reused
+        self.send_json({"error": error}, status)
+
+    def do_GET(self):
+        if not self.check_request():
+            return
+        if self.path == "/health":
+            self.send_json({"status": "ok", "uptime_seconds": round(metrics.get_uptime(), 1)})
+        elif self.path == "/metrics":
+            self.send_json(metrics.snapshot())
+        else:
+            self.send_json({"error": f"Unknown path {self.path}"}, 404)
+
+    def do_POST(self):
+        if not self.check_request():
+            return
+        if self.path not in ("/ask", "/ask/stream"):
+            self.send_json({"error": f"Unknown path {self.path}"}, 404)
+            return
+        if self.headers.get_content_type() != "application/json":
+            self.refuse(415, "The body has to be sent as application/json")
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            args = (body["prompt"], MessageSource[body.get("source", MessageSource.LOCAL.name)], body["user_id"])
+        except (ValueError, KeyError) as e:
+            self.send_json({"error": f"Bad request: {e}"}, 400)
+            return
+
+        metrics.start_request()
+        start = time.perf_counter()
+        failed = True
+        try:
+            # Requests for the same user would otherwise run the graph on the same conversation thread at once
+            with get_user_lock(args[2]):
+                if self.path == "/ask":
+                    self.send_json({"response": miss_fritters.ask_stuff(*args)})
+                else:
+                    self.stream_json_lines(miss_fritters.ask_stuff_stream(*args))
+            failed = False
+        except (BrokenPipeError, ConnectionResetError):
+            print("Client went away before the reply was finished.")
+        except Exception as e:
+            print(f"Error answering {self.path}: {e}")
+            if not self.headers_sent:
+                self.send_json({"error": f"{type(e).__name__}: {e}"}, 500)
+        finally:
+            metrics.finish_request(time.perf_counter() - start, failed)
+
+    def send_json(self, value: dict, status: int = 200):
+        data = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.headers_sent = True
+        self.wfile.write(data)
+
+    def stream_json_lines(self, pieces):
+        """
+        Sends each piece as soon as it is generated, as a chunked stream of JSON lines.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.headers_sent = True
+        try:
+            for piece in pieces:
+                self.write_chunk({"text": piece})
+        except (BrokenPipeError, ConnectionResetError):
+            raise
+        except Exception as e:
+            self.write_chunk({"error": f"{type(e).__name__}: {e}"})
+            raise
+        else:
+            self.write_chunk({"done": True})
+        finally:
+            self.wfile.write(b"0\r\n\r\n")  # End of the chunked stream
+
+    def write_chunk(self, value: dict):
+        data = (json.dumps(value) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def setup(self):
+        super().setup()
+        self.headers_sent = False
+
+    def address_string(self):
+        # Unix socket clients don't have an address
+        return self.client_address[0] if self.client_address else "unix socket"
+
+
+class TokenHTTPServer(ThreadingHTTPServer):
+    def __init__(self, server_address, handler_class, token: str):
+        """
+        HTTP server that only answers requests carrying its token.
+        """
+        self.token = token
+        super().__init__(server_address, handler_class)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)  # Left behind by a server that didn't shut down cleanly
+        super().server_bind()
+        os.chmod(self.server_address, 0o600)  # Only this user can talk to the server
+
+
+def serve(socket_path: str = None, port: int = None):
+    """
+    Loads the agent stack, then serves requests until interrupted.
+    """
+    socket_path = socket_path or get_socket_path()
+    port = port or get_port()
+    token = get_token()
+    listen_on_socket = hasattr(socket, "AF_UNIX")
+    listen_on_port = port is not None and bool(token)
+    if port is not None and not token:
+        print(f"Not listening on port {port}, set server_token in config.json to use it.")
+    if not listen_on_socket and not listen_on_port:
+        raise RuntimeError("Nothing to listen on, there are no Unix sockets here and no server_token is configured.")
+    lazy_modules.load_now(miss_fritters)
+
+    servers = []
+    addresses = []
+    if listen_on_socket:
+        servers.append(UnixHTTPServer(socket_path, FrittersRequestHandler))
+        addresses.append(socket_path)
+    if listen_on_port:
+        servers.append(TokenHTTPServer((DEFAULT_HOST, port), FrittersRequestHandler, token))
+        addresses.append(f"http://{DEFAULT_HOST}:{port}")
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Miss Fritters is listening on {' and '.join(addresses)}")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print("Shutting down.")
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        if listen_on_socket and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    serve()
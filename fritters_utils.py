@@ -4,6 +4,16 @@ DISCORD_KEY = "discord_bot_token"
 ROOT_USER_ID_KEY = "root_user_id"
 KASA_USER_KEY = "kasa_username"
 KASA_PASSWORD_KEY = "kasa_password"
+WORDLE_SOLVER_KEY = "wordle_solver"
+VOSK_MODEL_PATH_KEY = "vosk_model_path"
+WORKER_PROCESSES_KEY = "worker_processes"
+KASA_POLL_INTERVAL_KEY = "kasa_poll_interval"
+SERVER_SOCKET_KEY = "server_socket"
+SERVER_PORT_KEY = "server_port"
+SERVER_TOKEN_KEY = "server_token"
+HISTORY_DB_KEY = "history_db"
+MEMORY_DB_KEY = "memory_db"
+STORE_CACHE_MB_KEY = "store_cache_mb"
 
 def get_key_from_json_config_file(key_name: str) -> str | None:
     file_path = "config.json"
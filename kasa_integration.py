@@ -1,18 +1,92 @@
 import asyncio
+import fnmatch
+import functools
+import random
+import threading
+import time
 
-from kasa import Discover, Module
 from langchain_core.runnables import RunnableConfig
-from langchain_core.tools import tool
+from langchain_core.tools import StructuredTool, tool
 
 import fritters_utils
-from fritters_utils import get_key_from_json_config_file, ROOT_USER_ID_KEY, check_root_user
+from fritters_utils import get_key_from_json_config_file, ROOT_USER_ID_KEY, check_root_user, KASA_POLL_INTERVAL_KEY
+from lazy_modules import lazy_module
+
+kasa = lazy_module("kasa")  # Only needed once a light is actually touched
 
 BAD_USER_MESSAGE = "This person tried to mess with someone's lights and was denied access! Please be mean to them."
 BEDROOM_SEARCH_TERM = "bedroom"
+DISCOVERY_TTL = 300  # Seconds discovered devices (and their connections) are reused before discovering again
+DEFAULT_POLL_INTERVAL = 60  # Seconds between state mirror polls, unless kasa_poll_interval is configured
+MAX_POLL_BACKOFF = 600  # Longest the state mirror waits between polls while the devices keep failing
+STALE_POLLS = 2  # Polls a device can miss before its mirrored state is shown as stale
+MAX_SCENE_STATE_AGE = 5  # Seconds a device's mirrored state is trusted for before a scene reads it again
+
+# All Kasa work runs on one long-lived loop, so device connections can be reused between calls
+kasa_loop = None
+kasa_loop_lock = threading.Lock()
+cached_devices = None
+cached_devices_time = 0.0
+device_states = {}  # Host -> last known state, kept up to date by the state mirror and as scenes change it
+device_state_times = {}  # Host -> wall clock time its state was last confirmed
+state_mirror_task = None
+
+# Common scenes, see apply_scene
+SCENES = {
+    "all_off": {"*": {"on": False}},
+    "all_on": {"*": {"on": True}},
+    "bedroom_off": {f"*{BEDROOM_SEARCH_TERM}*": {"on": False}},
+    "bedroom_on": {f"*{BEDROOM_SEARCH_TERM}*": {"on": True}},
+    "purple": {"*": {"hsv": (300, 100, 100)}},
+    "movie_night": {"*": {"on": False}, f"*{BEDROOM_SEARCH_TERM}*": {"on": True, "brightness": 20}},
+}
+
+
+def get_kasa_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the shared Kasa event loop, starting its thread the first time.
+    """
+    global kasa_loop
+    with kasa_loop_lock:
+        if kasa_loop is None:
+            kasa_loop = asyncio.new_event_loop()
+            threading.Thread(target=kasa_loop.run_forever, name="kasa-loop", daemon=True).start()
+    return kasa_loop
 
 
-@tool(parse_docstring=True)
-def turn_off_lights(config: RunnableConfig):
+def run_kasa(coroutine):
+    """
+    Runs a coroutine on the shared Kasa loop and waits for the result. Safe to call from sync code on any thread.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_kasa_loop()).result()
+
+
+async def run_kasa_async(coroutine):
+    """
+    Runs a coroutine on the shared Kasa loop from another event loop, like the Discord bot's, without blocking it.
+    """
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, get_kasa_loop()))
+
+
+def kasa_tool(coroutine_function):
+    """
+    Turns an async Kasa action into a LangChain tool that works from both sync and async agents.
+    Either way the action runs on the shared Kasa loop, the same as the Discord buttons.
+    """
+
+    @functools.wraps(coroutine_function)
+    def sync_function(*args, **kwargs):
+        return run_kasa(coroutine_function(*args, **kwargs))
+
+    @functools.wraps(coroutine_function)
+    async def async_function(*args, **kwargs):
+        return await run_kasa_async(coroutine_function(*args, **kwargs))
+
+    return StructuredTool.from_function(func=sync_function, coroutine=async_function, parse_docstring=True)
+
+
+@kasa_tool
+async def turn_off_lights(config: RunnableConfig):
     """
     Turns off the lights.
 
@@ -25,12 +99,12 @@ def turn_off_lights(config: RunnableConfig):
         print(BAD_USER_MESSAGE)
         return BAD_USER_MESSAGE
     print("Turning off lights...")
-    asyncio.run(turn_off_lights_internal())
+    await turn_off_lights_internal()
     return "The lights have been turned off."
 
 
-@tool(parse_docstring=True)
-def turn_off_bedroom_lights(config: RunnableConfig):
+@kasa_tool
+async def turn_off_bedroom_lights(config: RunnableConfig):
     """
     Turns off the lights.
 
@@ -43,12 +117,12 @@ def turn_off_bedroom_lights(config: RunnableConfig):
         print(BAD_USER_MESSAGE)
         return BAD_USER_MESSAGE
     print("Turning off lights...")
-    asyncio.run(turn_off_specific_lights_internal(BEDROOM_SEARCH_TERM))
+    await turn_off_specific_lights_internal(BEDROOM_SEARCH_TERM)
     return "The bedroom lights have been turned off."
 
 
-@tool(parse_docstring=True)
-def turn_on_lights(config: RunnableConfig):
+@kasa_tool
+async def turn_on_lights(config: RunnableConfig):
     """
     Turns on the lights.
 
@@ -60,12 +134,12 @@ def turn_on_lights(config: RunnableConfig):
         print(BAD_USER_MESSAGE)
         return BAD_USER_MESSAGE
     print("Turning on lights...")
-    asyncio.run(turn_on_lights_internal())
+    await turn_on_lights_internal()
     return "The lights have been turned on."
 
 
-@tool(parse_docstring=True)
-def turn_on_bedroom_lights(config: RunnableConfig):
+@kasa_tool
+async def turn_on_bedroom_lights(config: RunnableConfig):
     """
     Turns on the lights.
 
@@ -77,12 +151,12 @@ def turn_on_bedroom_lights(config: RunnableConfig):
         print(BAD_USER_MESSAGE)
         return BAD_USER_MESSAGE
     print("Turning on lights...")
-    asyncio.run(turn_on_specific_lights_internal(BEDROOM_SEARCH_TERM))
+    await turn_on_specific_lights_internal(BEDROOM_SEARCH_TERM)
     return "The bedroom lights have been turned on."
 
 
-@tool(parse_docstring=True)
-def change_light_color(color_hue: int, config: RunnableConfig):
+@kasa_tool
+async def change_light_color(color_hue: int, config: RunnableConfig):
     """
     Changes the lights in the user's house to a certain color in degrees.
 
@@ -95,60 +169,278 @@ def change_light_color(color_hue: int, config: RunnableConfig):
         print(BAD_USER_MESSAGE)
         return BAD_USER_MESSAGE
     print(f"Changing Light Color to: {color_hue}")
-    asyncio.run(change_light_color_internal(color_hue))
+    await change_light_color_internal(color_hue)
     return f"All lights have been changed to the color: {color_hue}"
 
 
+@kasa_tool
+async def set_light_scene(scene_name: str, config: RunnableConfig):
+    """
+    Sets the lights to a named scene.
+
+    Args:
+        scene_name: One of all_off, all_on, bedroom_off, bedroom_on, purple or movie_night.
+        config: The RunnableConfig.
+    """
+    user_id = config.get("metadata").get("user_id")
+    if not check_root_user(user_id):
+        print(BAD_USER_MESSAGE)
+        return BAD_USER_MESSAGE
+    if scene_name not in SCENES:
+        return f"There is no scene called {scene_name}. Try one of: {', '.join(SCENES)}"
+    print(f"Setting scene: {scene_name}")
+    results = await apply_scene(SCENES[scene_name])
+    return f"Scene {scene_name} set. " + " ".join(f"{alias} {result}." for alias, result in results.items())
+
+
+@tool(parse_docstring=True)
+def get_light_status(config: RunnableConfig):
+    """
+    Tells which lights are on, their color and brightness, from the last time they were checked.
+
+    Args:
+        config: The RunnableConfig.
+    """
+    user_id = config.get("metadata").get("user_id")
+    if not check_root_user(user_id):
+        print(BAD_USER_MESSAGE)
+        return BAD_USER_MESSAGE
+    return format_light_status()
+
+
 async def turn_off_specific_lights_internal(search_term: str):
-    found_devices = await get_devices()
-    for device in found_devices.values():
-        if search_term.lower() in device.alias.lower():
-            await device.turn_off()
-            await device.update()
-            print(f"{device.alias} turned off.")
+    return await apply_scene({f"*{search_term}*": {"on": False}})
 
 
 async def turn_off_lights_internal():
-    found_devices = await get_devices()
-    for device in found_devices.values():
-        await device.turn_off()
-        await device.update()
-        print(f"{device.alias} turned off.")
+    return await apply_scene(SCENES["all_off"])
 
 
 async def turn_on_specific_lights_internal(search_term: str):
-    found_devices = await get_devices()
-    for device in found_devices.values():
-        if search_term.lower() in device.alias.lower():
-            await device.turn_on()
-            await device.update()
-            print(f"{device.alias} turned on.")
+    return await apply_scene({f"*{search_term}*": {"on": True}})
 
 
 async def turn_on_lights_internal():
-    found_devices = await get_devices()
-    for device in found_devices.values():
-        await device.turn_on()
-        await device.update()
-        print(f"{device.alias} turned on.")
+    return await apply_scene(SCENES["all_on"])
 
 
 async def change_light_color_internal(color_hue: int):
-    found_devices = await get_devices()
-    for device in found_devices.values():
+    return await apply_scene({"*": {"hsv": (color_hue, 100, 100)}})
+
+
+def read_device_state(device) -> dict:
+    """
+    Reads a device's on/off state, and its color and brightness if it has them, from its last update.
+    """
+    state = {"on": device.is_on}
+    light = device.modules.get(kasa.Module.Light)
+    if light is not None:
+        if getattr(light, "is_color", False):
+            state["hsv"] = tuple(light.hsv)[:3]
+        if getattr(light, "is_dimmable", False):
+            state["brightness"] = light.brightness
+    return state
+
+
+def resolve_scene(scene: dict, alias: str) -> dict:
+    """
+    Merges every entry of the scene whose alias pattern matches the device, later entries winning.
+    """
+    desired = {}
+    for pattern, state in scene.items():
+        if fnmatch.fnmatch(alias.lower(), pattern.lower()):
+            desired.update(state)
+    return desired
+
+
+async def apply_device_state(device, desired: dict) -> str:
+    """
+    Sends only the commands needed to get the device from its cached state to the desired one. A state older than
+    MAX_SCENE_STATE_AGE is read from the device first, since someone may have flipped it from the app or the wall.
+    """
+    updated = device_state_times.get(device.host)
+    if device.host not in device_states or updated is None or time.time() - updated > MAX_SCENE_STATE_AGE:
         await device.update()
-        if device.is_on:
-            light = device.modules[Module.Light]
-            await light.set_hsv(color_hue, 100, 100)
-            await device.update()
-            print(f"{device.alias} color changed to {color_hue}.")
+        device_states[device.host] = read_device_state(device)
+        device_state_times[device.host] = time.time()
+    current = device_states[device.host]
+    light = device.modules.get(kasa.Module.Light)
+    changes = []
+
+    if desired.get("on") is False:
+        if current["on"]:
+            await device.turn_off()
+            current["on"] = False
+            device_state_times[device.host] = time.time()
+            changes.append("turned off")
+        return ", ".join(changes) or "already off"
+
+    if desired.get("on") is True and not current["on"]:
+        await device.turn_on()
+        current["on"] = True
+        changes.append("turned on")
+    if not current["on"]:
+        # Same as before scenes existed, colors are only changed on lights that are on
+        return "is off, not changing it"
+
+    if "hsv" in desired and "hsv" in current and tuple(desired["hsv"]) != current["hsv"]:
+        await light.set_hsv(*desired["hsv"])
+        current["hsv"] = tuple(desired["hsv"])
+        changes.append(f"color changed to {desired['hsv'][0]}")
+    if "brightness" in desired and "brightness" in current and desired["brightness"] != current["brightness"]:
+        await light.set_brightness(desired["brightness"])
+        current["brightness"] = desired["brightness"]
+        changes.append(f"brightness changed to {desired['brightness']}")
+    if changes:
+        device_state_times[device.host] = time.time()
+    return ", ".join(changes) or "unchanged"
+
+
+async def apply_scene(scene: dict) -> dict:
+    """
+    Applies a scene, a mapping of alias patterns ("*", "*bedroom*") to desired states such as
+    {"on": True, "hsv": (300, 100, 100), "brightness": 50}.
+    Devices are compared against their recent state and only those that differ get commands, all in parallel.
+    Returns a result per device alias.
+    """
+    found_devices = await get_devices()
+    targets = [(device, resolve_scene(scene, device.alias)) for device in found_devices.values()]
+    targets = [(device, desired) for device, desired in targets if desired]
+    results = await asyncio.gather(*(apply_device_state(device, desired) for device, desired in targets),
+                                   return_exceptions=True)
+
+    scene_results = {}
+    for (device, _), result in zip(targets, results):
+        if isinstance(result, Exception):
+            device_states.pop(device.host, None)  # Unknown now, read it again next time
+            result = f"failed: {result}"
+        print(f"{device.alias} {result}.")
+        scene_results[device.alias] = result
+    return scene_results
+
+
+def get_poll_interval() -> float:
+    poll_interval = get_key_from_json_config_file(KASA_POLL_INTERVAL_KEY)
+    return DEFAULT_POLL_INTERVAL if poll_interval is None else float(poll_interval)
+
+
+def start_state_mirror():
+    """
+    Starts polling the devices in the background so status questions can be answered without touching the network.
+    Does nothing if it is already running or kasa_poll_interval is 0.
+    """
+    poll_interval = get_poll_interval()
+    if poll_interval <= 0:
+        return
+
+    def start():
+        global state_mirror_task
+        if state_mirror_task is None or state_mirror_task.done():
+            state_mirror_task = asyncio.ensure_future(poll_device_states(poll_interval))
+
+    get_kasa_loop().call_soon_threadsafe(start)
+
+
+async def poll_device_states(poll_interval: float):
+    """
+    Keeps device_states in sync with the devices. Each failed poll doubles the wait, up to MAX_POLL_BACKOFF,
+    with jitter so the devices aren't hit in lockstep after an outage.
+    """
+    print(f"Mirroring light states every {poll_interval} seconds.")
+    failures = 0
+    while True:
+        try:
+            failed = await refresh_device_states()
+            failures = failures + 1 if failed else 0
+        except Exception as e:
+            print(f"Error polling lights: {e}")
+            failures += 1
+        delay = min(poll_interval * 2 ** failures, MAX_POLL_BACKOFF)
+        await asyncio.sleep(delay * random.uniform(0.75, 1.25) if failures else delay)
+
+
+async def refresh_device_states() -> int:
+    """
+    Updates every device and records its state. Returns how many devices failed to update.
+    """
+    found_devices = await get_devices()
+    devices = list(found_devices.values())
+    results = await asyncio.gather(*(device.update() for device in devices), return_exceptions=True)
+    failed = 0
+    for device, result in zip(devices, results):
+        if isinstance(result, Exception):
+            print(f"Error updating {device.alias}: {result}")
+            failed += 1
         else:
-            print(f"{device.alias} is off, not changing it.")
+            device_states[device.host] = read_device_state(device)
+            device_state_times[device.host] = time.time()
+    return failed
+
+
+def read_light_status() -> list[dict]:
+    """
+    Returns the mirrored state of every known device, and how many seconds old it is. Never touches the network.
+    """
+    now = time.time()
+    stale_after = get_poll_interval() * STALE_POLLS
+    status = []
+    for device in (cached_devices or {}).values():
+        state = device_states.get(device.host)
+        updated = device_state_times.get(device.host)
+        age = None if updated is None else now - updated
+        status.append({
+            "alias": device.alias,
+            "state": state,
+            "age": age,
+            "stale": state is None or age is None or age > stale_after,
+        })
+    return status
+
+
+def format_light_status() -> str:
+    start_state_mirror()
+    status = read_light_status()
+    if not status:
+        return "I haven't checked on the lights yet. Ask again in a few seconds."
+    lines = []
+    for light in status:
+        state = light["state"]
+        if state is None or light["age"] is None:
+            lines.append(f"{light['alias']}: unknown")
+            continue
+        line = f"{light['alias']}: {'on' if state['on'] else 'off'}"
+        if state["on"] and "hsv" in state:
+            line += f", hue {state['hsv'][0]}"
+        if state["on"] and "brightness" in state:
+            line += f", brightness {state['brightness']}"
+        line += f" (checked {round(light['age'])}s ago{', stale' if light['stale'] else ''})"
+        lines.append(line)
+    return "\n".join(lines)
 
 
 async def get_devices():
-    return await Discover.discover(username=get_key_from_json_config_file("kasa_username"),
-                                   password=get_key_from_json_config_file("kasa_password"))
+    """
+    Returns the discovered devices, reusing them (and their open connections) for DISCOVERY_TTL seconds.
+    Must run on the Kasa loop, since the connections belong to it.
+    """
+    global cached_devices, cached_devices_time
+    if cached_devices is None or time.monotonic() - cached_devices_time > DISCOVERY_TTL:
+        if cached_devices is not None:
+            await disconnect_devices(cached_devices)
+        cached_devices = await kasa.Discover.discover(username=get_key_from_json_config_file("kasa_username"),
+                                                 password=get_key_from_json_config_file("kasa_password"))
+        cached_devices_time = time.monotonic()
+        device_states.clear()  # Discovery updates every device, so read fresh states from them
+        device_state_times.clear()
+    return cached_devices
+
+
+async def disconnect_devices(devices):
+    for device in devices.values():
+        try:
+            await device.disconnect()
+        except Exception as e:
+            print(f"Error disconnecting {device.host}: {e}")
 
 
 async def get_device_info():
@@ -162,5 +454,5 @@ async def get_device_info():
         print(device.features)
         print(device.modules)
 
-# asyncio.run(get_device_info())
-# asyncio.run(change_light_color_internal(300))
+# run_kasa(get_device_info())
+# run_kasa(change_light_color_internal(300))
@@ -0,0 +1,65 @@
+import importlib
+import threading
+import time
+
+lazy_modules = {}  # Module name -> LazyModule, every module registered to be loaded on first use
+
+
+class LazyModule:
+    def __init__(self, module_name: str):
+        """
+        Stands in for a module that is slow to import, importing it the first time one of its attributes is used.
+        Safe to use from several threads, they all wait for the one import.
+        """
+        self._module_name = module_name
+        self._module = None
+        self._load_seconds = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._module_name)
+                    self._load_seconds = time.perf_counter() - start
+                    self._module = module
+                    print(f"Loaded {self._module_name} in {self._load_seconds:.2f}s")
+        return self._module
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        return f"<lazy module {self._module_name} ({'loaded' if self._module else 'not loaded'})>"
+
+
+def lazy_module(module_name: str) -> LazyModule:
+    """
+    Registers a module to be imported the first time it is used, returning the stand-in to use in its place.
+    """
+    if module_name not in lazy_modules:
+        lazy_modules[module_name] = LazyModule(module_name)
+    return lazy_modules[module_name]
+
+
+def load_now(*modules: LazyModule):
+    """
+    Imports modules right away, for when being ready matters more than starting fast.
+    """
+    for module in modules:
+        module._load()
+
+
+def preload_in_background(*modules: LazyModule):
+    """
+    Starts importing modules on a background thread, so they are likely ready by the time they are used.
+    """
+    threading.Thread(target=load_now, args=modules, daemon=True).start()
+
+
+def get_load_times() -> dict[str, float | None]:
+    """
+    Returns how long each registered module took to import, or None if it hasn't been used yet.
+    """
+    return {module_name: module._load_seconds for module_name, module in lazy_modules.items()}
@@ -0,0 +1,305 @@
+"""
+Offline load test for main_discord. Feeds synthetic DMs, mentions, $ask commands and attachments through
+main_discord.on_message with fake Discord objects and a stub chat model, so nothing touches Discord or Ollama.
+
+Usage: python load_test_discord.py [--users 1 10 100] [--messages 5] [--latency 0.5] [--sharded]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import re
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+import attachment_ingest
+import discord_replies
+import main_discord
+from admission_control import AdmissionController
+from sqlite_store import SQLiteStore
+
+DEFAULT_USER_COUNTS = [1, 10, 100]
+LOOP_LAG_INTERVAL = 0.05  # How often the event loop lag monitor wakes up
+MESSAGE_ID_PATTERN = re.compile(r"#(\d+)$")
+
+# Kind of message -> how often users send it
+MESSAGE_KINDS = {
+    "dm": 0.4,
+    "mention": 0.3,
+    "ask": 0.2,
+    "attachment": 0.1,
+}
+
+
+class StubChatModel:
+    def __init__(self, latency: float, jitter: float, reply_length: int):
+        """
+        Stands in for ask_stuff. Blocks for the configured latency like the real model call does, and records when
+        each request got to the model so queue waits can be measured.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.reply_length = reply_length
+        self.started = {}  # Message id -> time the model started on it
+
+    def get_delay(self) -> float:
+        return max(0.0, random.gauss(self.latency, self.jitter))
+
+    def record_start(self, prompt: str):
+        match = MESSAGE_ID_PATTERN.search(prompt)
+        if match:
+            self.started[int(match.group(1))] = time.perf_counter()
+
+    def get_reply(self, prompt: str) -> str:
+        return f"Fritters says: {prompt} " + "meow " * (self.reply_length // 5)
+
+    def ask_stuff(self, prompt: str, source, user_id: str) -> str:
+        self.record_start(prompt)
+        time.sleep(self.get_delay())
+        return self.get_reply(prompt)
+
+    async def ask_stuff_async(self, prompt: str, source, user_id: str) -> str:
+        """
+        Same as ask_stuff, but waits without blocking the loop, like the worker pool does.
+        """
+        self.record_start(prompt)
+        await asyncio.sleep(self.get_delay())
+        return self.get_reply(prompt)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.name = name
+        self.mention = f"<@{user_id}>"
+
+    def mentioned_in(self, message) -> bool:
+        return self in message.mentions
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.sent = []  # (time, content) of every message sent to the channel
+
+    async def send(self, content: str = None, **kwargs):
+        self.sent.append((time.perf_counter(), content))
+
+
+class FakeDMChannel(FakeChannel, main_discord.discord.DMChannel):
+    def __init__(self, channel_id: int):
+        # The real DMChannel is never initialized, it is only here so isinstance checks see a DM
+        FakeChannel.__init__(self, channel_id)
+
+
+class FakeAttachment:
+    def __init__(self, filename: str, data: bytes):
+        self.filename = filename
+        self.size = len(data)
+        self.data = data
+
+    async def read(self) -> bytes:
+        return self.data
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, author: FakeUser, channel: FakeChannel, content: str,
+                 mentions: list[FakeUser] = (), attachments: list[FakeAttachment] = ()):
+        self.id = message_id
+        self.author = author
+        self.channel = channel
+        self.content = content
+        self.clean_content = content
+        self.mentions = list(mentions)
+        self.attachments = list(attachments)
+
+
+class FakeVoiceClient:
+    def play(self, source):
+        pass
+
+
+class FakeAudioSource:
+    def __init__(self, source: str):
+        self.source = source
+
+
+class FakeSayer:
+    def say_stuff_simple(self, message: str) -> str:
+        return "output/load_test.wav"
+
+
+class FakeContext:
+    def __init__(self, message: FakeMessage):
+        self.message = message
+        self.author = message.author
+        self.channel = message.channel
+        self.voice_client = FakeVoiceClient()
+
+    async def send(self, content: str = None, **kwargs):
+        await self.channel.send(content, **kwargs)
+
+
+async def process_commands(message: FakeMessage):
+    """
+    Stands in for the bot's command parsing, calling the command's callback with a fake context.
+    """
+    name, _, rest = message.content[len(main_discord.command_prefix):].partition(" ")
+    command = main_discord.client.get_command(name)
+    await command.callback(FakeContext(message), message=rest)
+
+
+def make_image(seed: int) -> bytes:
+    """
+    A photo-sized PNG, so attachments get downscaled like real ones.
+    """
+    color = tuple(random.Random(seed).randrange(256) for _ in range(3))
+    output = io.BytesIO()
+    Image.new("RGB", (2048, 1536), color).save(output, format="PNG")
+    return output.getvalue()
+
+
+class LoadTest:
+    def __init__(self, model: StubChatModel, bot_user: FakeUser, num_channels: int, messages_per_user: int,
+                 think_time: float):
+        self.model = model
+        self.bot_user = bot_user
+        self.channels = [FakeChannel(1000 + i) for i in range(num_channels)]
+        self.messages_per_user = messages_per_user
+        self.think_time = think_time
+        self.message_ids = iter(range(1, 10 ** 9))
+        self.results = []  # (message id, kind, dispatched, finished, error)
+
+    def make_message(self, user: FakeUser, dm_channel: FakeDMChannel, kind: str) -> FakeMessage:
+        message_id = next(self.message_ids)
+        text = f"How are you doing today? #{message_id}"
+        channel = random.choice(self.channels)
+        if kind == "dm":
+            return FakeMessage(message_id, user, dm_channel, text)
+        if kind == "mention":
+            return FakeMessage(message_id, user, channel, f"{self.bot_user.mention} {text}", [self.bot_user])
+        if kind == "ask":
+            return FakeMessage(message_id, user, channel, f"{main_discord.command_prefix}ask {text}")
+        attachment = FakeAttachment(f"photo_{message_id}.png", make_image(message_id))
+        return FakeMessage(message_id, user, channel, f"{self.bot_user.mention} {text}", [self.bot_user],
+                           [attachment])
+
+    async def handle(self, message: FakeMessage, kind: str):
+        dispatched = time.perf_counter()
+        error = None
+        try:
+            await main_discord.on_message(message)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        self.results.append((message.id, kind, dispatched, time.perf_counter(), error))
+
+    async def run_user(self, user_index: int):
+        user = FakeUser(10 ** 6 + user_index, f"load_test_user_{user_index}")
+        dm_channel = FakeDMChannel(10 ** 7 + user_index)
+        kinds, weights = zip(*MESSAGE_KINDS.items())
+        tasks = []
+        for _ in range(self.messages_per_user):
+            kind = random.choices(kinds, weights)[0]
+            # Each event gets its own task, the same as the Discord client dispatching it, so the user's next message
+            # arrives after the think time whether or not the last one has been answered
+            tasks.append(asyncio.create_task(self.handle(self.make_message(user, dm_channel, kind), kind)))
+            await asyncio.sleep(random.uniform(0, self.think_time))
+        await asyncio.gather(*tasks)
+
+
+async def monitor_loop_lag(lags: list[float], stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lags.append(time.perf_counter() - start - LOOP_LAG_INTERVAL)
+
+
+def format_percentiles(values: list[float]) -> str:
+    if not values:
+        return "n/a"
+    p50, p90, p99 = np.percentile(values, [50, 90, 99]) * 1000
+    return f"p50 {p50:.0f}ms, p90 {p90:.0f}ms, p99 {p99:.0f}ms, max {max(values) * 1000:.0f}ms"
+
+
+async def run_level(num_users: int, args, model: StubChatModel, bot_user: FakeUser) -> LoadTest:
+    load_test = LoadTest(model, bot_user, args.channels, args.messages, args.think)
+    main_discord.admission_controller = AdmissionController()  # Every level starts with full buckets
+    lags = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(lags, stop))
+    start = time.perf_counter()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output) if not args.verbose else contextlib.nullcontext():
+        await asyncio.gather(*(load_test.run_user(i) for i in range(num_users)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+
+    replies = [finished - dispatched for _, _, dispatched, finished, error in load_test.results if error is None]
+    waits = [model.started[message_id] - dispatched for message_id, _, dispatched, _, _ in load_test.results
+             if message_id in model.started]
+    errors = [(kind, error) for _, kind, _, _, error in load_test.results if error is not None]
+
+    print(f"\n{num_users} concurrent user(s), {len(load_test.results)} messages in {elapsed:.1f}s")
+    print(f"  Throughput:    {len(replies) / elapsed:.2f} replies/s")
+    print(f"  Reply latency: {format_percentiles(replies)}")
+    print(f"  Queue wait:    {format_percentiles(waits)}")
+    print(f"  Loop lag:      {format_percentiles(lags)}")
+    print(f"  Admission:     {main_discord.admission_controller.get_stats()}")
+    if errors:
+        print(f"  Errors:        {len(errors)}, first: {errors[0][0]} {errors[0][1]}")
+    return load_test
+
+
+async def run_load_test(args):
+    model = StubChatModel(args.latency, args.jitter, args.reply_length)
+    bot_user = FakeUser(1, "Miss Fritters")
+    main_discord.client._connection.user = bot_user  # What client.user returns
+    main_discord.client.process_commands = process_commands
+    main_discord.ask_stuff = model.ask_stuff
+    main_discord.worker_pool = model if args.sharded else None
+    main_discord.sayer = FakeSayer()
+    main_discord.discord.FFmpegPCMAudio = FakeAudioSource
+    # A fresh pacer, so its locks belong to this event loop
+    main_discord.reply_pacer = discord_replies.ChannelPacer()
+
+    print(f"Stub model latency {args.latency}s (+/- {args.jitter}s), "
+          f"{'sharded (non-blocking)' if args.sharded else 'in-process (blocking)'}")
+    for num_users in args.users:
+        await run_level(num_users, args, model, bot_user)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the Discord frontend.")
+    parser.add_argument("--users", type=int, nargs="+", default=DEFAULT_USER_COUNTS,
+                        help="Concurrent user counts to test, one after the other.")
+    parser.add_argument("--messages", type=int, default=5, help="Messages each user sends.")
+    parser.add_argument("--think", type=float, default=1.0, help="Longest pause between a user's messages.")
+    parser.add_argument("--channels", type=int, default=5, help="Shared server channels users post in.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Average stub model latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Standard deviation of the stub model latency.")
+    parser.add_argument("--reply-length", type=int, default=500, help="Length of the stub model's replies.")
+    parser.add_argument("--sharded", action="store_true",
+                        help="Answer through the worker pool path, which doesn't block the event loop.")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own output.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    # Keep the attachments and their index out of the real input folder and database
+    temp_dir = tempfile.mkdtemp(prefix="fritters_load_test_")
+    attachment_ingest.INPUT_DIR = temp_dir
+    main_discord.store = SQLiteStore(f"{temp_dir}/load_test.db")
+    try:
+        asyncio.run(run_load_test(args))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
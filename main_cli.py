@@ -1,10 +1,19 @@
+from fritters_client import get_server_client
+from lazy_modules import lazy_module, preload_in_background
 from message_source import MessageSource
-from miss_fritters import ask_stuff
 
+FIRST_PROMPT = "What would you like to ask Miss Fritters?"
+
+miss_fritters = lazy_module("miss_fritters")
 user_id = "Terrence"
 
 if __name__ == '__main__':
-    thing_to_ask = input("What would you like to ask Miss Fritters?\r\n")
+    # Use the resident server if one is running, otherwise load the models while the first question is being typed
+    fritters = get_server_client()
+    if fritters is None:
+        fritters = miss_fritters
+        preload_in_background(miss_fritters)
+    thing_to_ask = input(FIRST_PROMPT + "\r\n")
     while True:
-        response = ask_stuff(thing_to_ask, MessageSource.LOCAL, user_id)
+        response = fritters.ask_stuff(thing_to_ask, MessageSource.LOCAL, user_id)
         thing_to_ask = input("\r\n\r\n\r\nRESPONSE FROM MODEL: " + response + "\r\n")
\ No newline at end of file
@@ -1,12 +1,20 @@
+import asyncio
+
 import discord
 from discord.ext import commands
 
+import attachment_ingest
+import discord_replies
 import fritters_utils
 import kasa_integration
+import lazy_modules
+import store_cache
+from admission_control import AdmissionController
+from fritters_client import get_server_client
 from fritters_utils import get_key_from_json_config_file
 from message_source import MessageSource
-from miss_fritters import ask_stuff, IMAGE_EXTENSIONS
-from tts import StuffSayer
+from sqlite_store import get_memory_db_path
+from worker_pool import WorkerPool
 
 command_prefix = "$"
 intents = discord.Intents.default()
@@ -14,12 +22,55 @@ intents.message_content = True
 client = commands.Bot(command_prefix=command_prefix, intents=intents)
 
 connection = None
-sayer = StuffSayer()
+sayer = None  # Loaded the first time a voice reply is needed, it takes a while
+reply_pacer = discord_replies.ChannelPacer()
+worker_pool = None  # Set at startup if worker_processes is configured
+server_client = None  # Set at startup if the resident server is running
+admission_controller = AdmissionController()
+store = None  # Where attachments are indexed, opened the first time one comes in
+
+# Only loaded when the bot answers in this process, workers and the resident server load their own
+miss_fritters = lazy_modules.lazy_module("miss_fritters")
+
+
+def get_store():
+    global store
+    if store is None:
+        if worker_pool is None and server_client is None:
+            store = miss_fritters.store  # Share the agent's store, since it is loaded anyway
+        else:
+            store = store_cache.get_store(get_memory_db_path())
+    return store
+
+
+def ask_stuff(prompt: str, source: MessageSource, user_id: str) -> str:
+    return miss_fritters.ask_stuff(prompt, source, user_id)
+
+
+def get_sayer():
+    global sayer
+    if sayer is None:
+        from tts import StuffSayer
+        sayer = StuffSayer()
+    return sayer
+
+
+async def ask_miss_fritters(prompt: str, source: MessageSource, user_id: str) -> str:
+    """
+    Asks Miss Fritters on the user's worker process when running sharded, on the resident server if there is one,
+    or otherwise in this process.
+    """
+    if worker_pool is not None:
+        return await worker_pool.ask_stuff_async(prompt, source, user_id)
+    if server_client is not None:
+        return await asyncio.to_thread(server_client.ask_stuff, prompt, source, user_id)
+    return ask_stuff(prompt, source, user_id)
 
 
 @client.event
 async def on_ready():
     print(f'We have logged in as {client.user}')
+    kasa_integration.start_state_mirror()
 
 
 @client.command()
@@ -44,9 +95,17 @@ async def emote(ctx):
 @client.command()
 async def ask(ctx, *, message):
     author = ctx.author.name
-    original_response = ask_stuff(message, MessageSource.DISCORD_VOICE, author)
-    output_file = sayer.say_stuff_simple(original_response)
-    await ctx.voice_client.play(discord.FFmpegPCMAudio(source=output_file))
+    admission = await admission_controller.admit(author, ctx.channel.id)
+    if not admission.admitted:
+        if admission.message:
+            await ctx.send(admission.message)
+        return
+    try:
+        original_response = await ask_miss_fritters(message, MessageSource.DISCORD_VOICE, author)
+    finally:
+        await admission_controller.finish(admission)
+    output_file = get_sayer().say_stuff_simple(original_response)
+    ctx.voice_client.play(discord.FFmpegPCMAudio(source=output_file))
 
 
 @client.command()
@@ -59,31 +118,69 @@ async def lights(ctx):
         await ctx.send("Press a button!", view=MyView())
 
 
+@client.command()
+async def lightstatus(ctx):
+    author = ctx.author.name
+    if not fritters_utils.check_root_user(author):
+        await ctx.send(
+            f"<:Bartender:1344864904561037382> Nice try, {author}. You are not the root user! <:Bartender:1344864904561037382>")
+    else:
+        await ctx.send(kasa_integration.format_light_status(), view=LightStatusView())
+
+
+class LightStatusView(discord.ui.View):
+    @discord.ui.button(label="Refresh", style=discord.ButtonStyle.secondary)
+    async def refresh_button_callback(self, interaction, button):
+        # Answered from the state mirror, so this is instant even while the lights are slow to respond
+        await interaction.response.edit_message(content=kasa_integration.format_light_status(), view=self)
+
+
 class MyView(discord.ui.View):
+    @discord.ui.button(label="Light status", row=0, style=discord.ButtonStyle.secondary)
+    async def status_button_callback(self, interaction, button):
+        await interaction.response.send_message(kasa_integration.format_light_status(), view=LightStatusView())
+
     @discord.ui.button(label="Turn on lights", row=0, style=discord.ButtonStyle.primary)
     async def first_button_callback(self, interaction, button):
         await interaction.response.send_message("Lights turning on!")
-        await kasa_integration.turn_on_lights_internal()
+        await kasa_integration.run_kasa_async(kasa_integration.turn_on_lights_internal())
 
     @discord.ui.button(label="Turn off lights", row=1, style=discord.ButtonStyle.primary)
     async def second_button_callback(self, interaction, button):
         await interaction.response.send_message("Lights turning off!")
-        await kasa_integration.turn_off_lights_internal()
+        await kasa_integration.run_kasa_async(kasa_integration.turn_off_lights_internal())
 
     @discord.ui.button(label="Turn lights purple", row=1, style=discord.ButtonStyle.primary)
     async def third_button_callback(self, interaction, button):
         await interaction.response.send_message("Color changing to purple!")
-        await kasa_integration.change_light_color_internal(300)
+        await kasa_integration.run_kasa_async(kasa_integration.change_light_color_internal(300))
 
     @discord.ui.button(label="Turn bedroom lights on", row=1, style=discord.ButtonStyle.primary)
     async def fourth_button_callback(self, interaction, button):
         await interaction.response.send_message("Bedroom lights turning on!")
-        await kasa_integration.turn_on_specific_lights_internal(kasa_integration.BEDROOM_SEARCH_TERM)
+        await kasa_integration.run_kasa_async(
+            kasa_integration.turn_on_specific_lights_internal(kasa_integration.BEDROOM_SEARCH_TERM))
 
     @discord.ui.button(label="Turn bedroom lights off", row=1, style=discord.ButtonStyle.primary)
     async def fifth_button_callback(self, interaction, button):
         await interaction.response.send_message("Bedroom lights turning off!")
-        await kasa_integration.turn_off_specific_lights_internal(kasa_integration.BEDROOM_SEARCH_TERM)
+        await kasa_integration.run_kasa_async(
+            kasa_integration.turn_off_specific_lights_internal(kasa_integration.BEDROOM_SEARCH_TERM))
+
+
+@client.command()
+async def workers(ctx):
+    if worker_pool is None:
+        await ctx.send("Not running with worker processes.")
+        return
+    lines = [f"Worker {w['worker']} (pid {w['pid']}): {'healthy' if w['healthy'] else 'unhealthy'}, "
+             f"{w['pending']} pending, {w['restarts']} restarts" for w in worker_pool.health()]
+    await ctx.send("\n".join(lines))
+
+
+@client.command()
+async def limits(ctx):
+    await ctx.send(f"Rate limits: {admission_controller.get_stats()}")
 
 
 @client.command()
@@ -108,41 +205,48 @@ async def on_message(message):
         print("Not a DM or mention, not responding :)")
         return
 
-    if message.attachments:
-        print("Attachment found!")
-        split_v1 = str(message.attachments).split("filename='")[1]
-        filename = str(split_v1).split("' ")[0]
-        filepath = "./input/{}".format(filename)
-        if filename.endswith(tuple(IMAGE_EXTENSIONS)):
-            await message.attachments[0].save(fp=filepath)  # saves the file
-            print("File saved!")
+    admission = await admission_controller.admit(author, message.channel.id)
+    if not admission.admitted:
+        if admission.message:
+            await reply_pacer.send(message.channel, admission.message)
+        return
 
-    else:
-        print("There is no attachment")
+    try:
+        if message.attachments:
+            print("Attachment found!")
+            entries = await attachment_ingest.ingest_attachments(message, get_store(),
+                                                                 attachment_ingest.IMAGE_EXTENSIONS)
+            print(f"{len(entries)} file(s) saved!")
+        else:
+            print("There is no attachment")
 
-    print("Incoming message: {} \r\n from: {}".format(message.clean_content, author))
+        print("Incoming message: {} \r\n from: {}".format(message.clean_content, author))
 
-    original_response = ask_stuff(message.clean_content, MessageSource.DISCORD_TEXT, author)
-    print("Final response: {}".format(original_response))
+        original_response = await ask_miss_fritters(message.clean_content, MessageSource.DISCORD_TEXT, author)
+        print("Final response: {}".format(original_response))
+    finally:
+        await admission_controller.finish(admission)
 
     if not original_response:
         original_response = "The bot got sad and doesn't want to talk to you at the moment :("
 
     resp_len = len(original_response)
-    if resp_len > 2000:
-        response = "The answer was over 2000 ({}), so you're getting multiple messages {} \r\n".format(resp_len,
-                                                                                                       author) + original_response
-        responses = split_into_chunks(response)
-        for i, response in enumerate(responses):
-            await message.channel.send(response)
-    else:
-        await message.channel.send(original_response)
-
-
-def split_into_chunks(s, chunk_size=2000):
-    return [s[i:i + chunk_size] for i in range(0, len(s), chunk_size)]
+    if resp_len > discord_replies.DISCORD_MESSAGE_LIMIT:
+        original_response = "The answer was over 2000 ({}), so you're getting multiple messages {} \r\n".format(
+            resp_len, author) + original_response
+    await reply_pacer.send(message.channel, original_response)
 
 
 if __name__ == '__main__':
     discord_secret = get_key_from_json_config_file(fritters_utils.DISCORD_KEY)
-    client.run(discord_secret)
+    num_workers = get_key_from_json_config_file(fritters_utils.WORKER_PROCESSES_KEY)
+    if num_workers:
+        worker_pool = WorkerPool(int(num_workers))
+        admission_controller.concurrency = int(num_workers)
+    else:
+        server_client = get_server_client()
+    try:
+        client.run(discord_secret)
+    finally:
+        if worker_pool is not None:
+            worker_pool.close()
@@ -1,10 +1,16 @@
+import queue
+import re
+import threading
+import time
+
 import numpy as np
 import pygame
 import pyaudio
 import wave
 
+from fritters_client import get_server_client
+from lazy_modules import lazy_module
 from message_source import MessageSource
-from miss_fritters import ask_stuff
 from stt import StuffHearer
 from tts import StuffSayer
 
@@ -22,6 +28,9 @@ clock = pygame.time.Clock()
 
 user_id = "local"
 
+# Share the resident server's warm agent stack if one is running, otherwise load our own
+fritters = get_server_client() or lazy_module("miss_fritters")
+
 
 # Load Audio File
 def load_audio(filename):
@@ -35,59 +44,211 @@ sayer = StuffSayer()
 stuff_hearer = StuffHearer()
 
 
-def visualize_audio(thing_to_say):
-    wf = load_audio(sayer.say_stuff_simple(thing_to_say))
-    stream = p.open(format=p.get_format_from_width(wf.getsampwidth()),
-                    channels=wf.getnchannels(),
-                    rate=wf.getframerate(),
-                    output=True)
-    running = True
-
-    while running:
-        screen.fill((0, 0, 0))
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-        data = wf.readframes(CHUNK)
-        if len(data) == 0:
-            break  # Stop when audio file ends
-
-        stream.write(data)
-
-        # Convert audio data to waveform points
-        audio_data = np.frombuffer(data, dtype=np.int16)
-        points = [(x, HEIGHT // 2 + int(audio_data[x % len(audio_data)] * HEIGHT / 65536)) for x in range(WIDTH)]
-        pygame.draw.lines(screen, (0, 255, 0), False, points, 2)
-
-        pygame.display.flip()
-        clock.tick(60)
-
-    stream.stop_stream()
-    stream.close()
-    # Wait for user input with a still sine wave
-    running = True
-    while running:
-        screen.fill((0, 0, 0))
-        points = [(x, HEIGHT // 2 + int(50 * np.sin(2 * np.pi * x / 100))) for x in range(WIDTH)]
-        pygame.draw.lines(screen, (0, 0, 255), False, points, 2)
-        pygame.display.flip()
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
+# Waveform drawing buffers, reused every frame
+WAVE_X = np.arange(WIDTH)
+wave_points = np.empty((WIDTH, 2), dtype=np.int32)
+wave_points[:, 0] = WAVE_X
+
+# The idle sine wave never changes, so it is computed once
+IDLE_POINTS = np.stack([WAVE_X, HEIGHT // 2 + (50 * np.sin(2 * np.pi * WAVE_X / 100)).astype(np.int32)], axis=1)
+
+
+class AudioPlayer:
+    def __init__(self, wf):
+        """
+        Plays a wave file on PyAudio's own callback thread, keeping the latest chunk around for drawing.
+        The render loop only ever reads latest_chunk, so playback never waits on rendering.
+        """
+        self.wf = wf
+        self.stopped = False
+        self.latest_chunk = np.zeros(CHUNK, dtype=np.int16)
+        self.stream = p.open(format=p.get_format_from_width(wf.getsampwidth()),
+                             channels=wf.getnchannels(),
+                             rate=wf.getframerate(),
+                             output=True,
+                             frames_per_buffer=CHUNK,
+                             stream_callback=self._callback)
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        if self.stopped:
+            return b"", pyaudio.paComplete
+        data = self.wf.readframes(frame_count)
+        if data:
+            self.latest_chunk = np.frombuffer(data, dtype=np.int16)
+        flag = pyaudio.paContinue if len(data) == frame_count * self.wf.getsampwidth() * self.wf.getnchannels() \
+            else pyaudio.paComplete
+        return data, flag
+
+    def stop(self):
+        """
+        Stops playback at the next callback. Safe to call from any thread.
+        """
+        self.stopped = True
+
+    def is_playing(self) -> bool:
+        return self.stream.is_active()
+
+    def close(self):
+        self.stream.stop_stream()
+        self.stream.close()
+        self.wf.close()
+
+
+def get_wave_points(audio_data):
+    """
+    Converts the latest audio chunk to waveform points, written into the reusable buffer.
+    """
+    y = wave_points[:, 1]
+    if len(audio_data) >= WIDTH:
+        np.multiply(audio_data[:WIDTH], HEIGHT, out=y, dtype=np.int32)
+    elif len(audio_data) > 0:
+        # Short final chunk, wrap around it like a full one would
+        np.multiply(audio_data[WAVE_X % len(audio_data)], HEIGHT, out=y, dtype=np.int32)
+    else:
+        y.fill(0)
+    y //= 65536
+    y += HEIGHT // 2
+    return wave_points
+
+
+class VoiceTurn:
+    def __init__(self, prompt: str, speech_end: float | None):
+        """
+        A single exchange with the user, cancelled as a whole when they talk over it.
+        - prompt: What the user said.
+        - speech_end: When the user stopped talking (time.perf_counter), used to report latency.
+        """
+        self.prompt = prompt
+        self.speech_end = speech_end
+        self.cancelled = threading.Event()
+        self.first_audio = None
+
+
+def split_sentences(text: str):
+    """
+    Splits text into complete sentences, returning (sentences, remainder).
+    """
+    *sentences, remainder = re.split(r"(?<=[.!?])\s+", text)
+    return [sentence for sentence in sentences if sentence.strip()], remainder
+
+
+class VoiceLoop:
+    """
+    Runs listening, generation, synthesis and playback as a pipeline instead of one after the other:
+    - The microphone stays open during playback, and speech cancels the current reply (barge-in).
+    - Sentences are synthesized while the LLM is still generating the rest of the reply.
+    - Latency from the end of the user's speech to the first audio of the reply is printed per turn.
+    Works best with headphones, otherwise the reply itself can be loud enough to count as an interruption.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation_lock = threading.Lock()  # One conversation thread, so one generation at a time
+        self.current_turn = None
+        self.player = None
+        self.sentences = queue.Queue()  # (turn, sentence) waiting to be synthesized
+        self.audio_files = queue.Queue()  # (turn, audio file) waiting to be played
+
+    def start(self, greeting: str):
+        for target in (self._listen, self._synthesize, self._play):
+            threading.Thread(target=target, daemon=True).start()
+        self.sentences.put((VoiceTurn(greeting, None), greeting))
+
+    def interrupt(self):
+        """
+        Called as soon as the user starts talking. Cancels the current generation and stops playback.
+        """
+        with self.lock:
+            turn, player = self.current_turn, self.player
+        if turn is not None and not turn.cancelled.is_set():
+            print("Interrupted!")
+            turn.cancelled.set()
+        if player is not None:
+            player.stop()
+
+    def _listen(self):
+        for prompt in stuff_hearer.hear_stuff_continuously(on_speech_start=self.interrupt):
+            turn = VoiceTurn(prompt, stuff_hearer.last_speech_end)
+            with self.lock:
+                self.current_turn = turn
+            threading.Thread(target=self._generate, args=(turn,), daemon=True).start()
+
+    def _generate(self, turn: VoiceTurn):
+        with self.generation_lock:
+            if turn.cancelled.is_set():
                 return
-            prompt = None
-            while prompt is None:
-                prompt = stuff_hearer.hear_stuff()  # Wait for a valid prompt
-            response = ask_stuff(prompt, MessageSource.LOCAL, user_id)
-            visualize_audio(response)
-
-    pygame.quit()
-    p.terminate()
-
-
-# Run the visualizer with an audio file
+            stream = fritters.ask_stuff_stream(turn.prompt, MessageSource.LOCAL, user_id)
+            remainder = ""
+            try:
+                for piece in stream:
+                    if turn.cancelled.is_set():
+                        print("Generation cancelled.")
+                        return
+                    sentences, remainder = split_sentences(remainder + piece)
+                    for sentence in sentences:
+                        self.sentences.put((turn, sentence))
+            finally:
+                stream.close()
+            if remainder.strip():
+                self.sentences.put((turn, remainder))
+
+    def _synthesize(self):
+        while True:
+            turn, sentence = self.sentences.get()
+            if not turn.cancelled.is_set():
+                self.audio_files.put((turn, sayer.say_stuff_simple(sentence)))
+
+    def _play(self):
+        while True:
+            turn, audio_file = self.audio_files.get()
+            if turn.cancelled.is_set():
+                continue
+            player = AudioPlayer(load_audio(audio_file))
+            with self.lock:
+                self.player = player
+            if turn.cancelled.is_set():
+                player.stop()  # Interrupted while the stream was opening
+            elif turn.first_audio is None:
+                turn.first_audio = time.perf_counter()
+                if turn.speech_end is not None:
+                    print(f"Turn latency (end of speech to first audio): "
+                          f"{(turn.first_audio - turn.speech_end) * 1000:.0f} ms")
+
+            while player.is_playing():
+                time.sleep(0.01)
+            with self.lock:
+                self.player = None
+            player.close()
+
+    def run(self):
+        """
+        Renders the waveform on the main thread until the window is closed.
+        """
+        running = True
+        while running:
+            screen.fill((0, 0, 0))
+
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+
+            player = self.player
+            if player is not None:
+                # Convert audio data to waveform points
+                pygame.draw.lines(screen, (0, 255, 0), False, get_wave_points(player.latest_chunk), 2)
+            else:
+                # Wait for user input with a still sine wave
+                pygame.draw.lines(screen, (0, 0, 255), False, IDLE_POINTS, 2)
+
+            pygame.display.flip()
+            clock.tick(60)
+
+        pygame.quit()
+        p.terminate()
+
+
+# Run the voice loop with a greeting
 if __name__ == "__main__":
-    visualize_audio("Hello, my name is Miss Fritters. How can I help you today?")
+    voice_loop = VoiceLoop()
+    voice_loop.start("Hello, my name is Miss Fritters. How can I help you today?")
+    voice_loop.run()
@@ -0,0 +1,243 @@
+"""
+Merges old conversation summaries into weekly and monthly digests, so long-lived users don't end up with hundreds of
+overlapping summaries. Summaries from the last few weeks are kept as they are, older ones are merged into one digest per
+week, and weekly digests older than a few months are merged into one digest per month. Merged rows are deleted.
+Memories users asked to be stored are never touched.
+
+Usage: python memory_consolidation.py [--user USER_ID] [--every HOURS]
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import context_budget
+from memory_writer import (MEMORY_SEARCH_LIMIT, MONTHLY_PATTERN, SUMMARY_PATTERN, WEEKLY_PATTERN, format_memories,
+                           get_memory_namespace)
+from sqlite_store import SQLiteStore, get_memory_db_path
+
+DIGEST_MODEL = "llama3.2"
+KEEP_SUMMARIES_DAYS = 14  # Summaries newer than this are kept at full detail
+KEEP_WEEKLY_DAYS = 90  # Weekly digests newer than this are kept, older ones are merged by month
+
+DIGEST_PROMPT = """
+You are merging Miss Fritters' memories of conversations with one user into a single memory.
+Keep everything about the user that could matter later: their name, preferences, plans, people and pets they mentioned,
+and anything they asked to be remembered. Drop small talk and anything repeated. Write it as a short summary.
+"""
+
+
+class Memory:
+    def __init__(self, store_key: str, memory_key: str, text: str, kind: str, period: date):
+        """
+        One memory row that can be merged.
+        - kind: "summary", "weekly" or "monthly"
+        - period: When it was made for a summary, the first day of the week or month for a digest.
+        """
+        self.store_key = store_key
+        self.memory_key = memory_key
+        self.text = text
+        self.kind = kind
+        self.period = period
+        self.replaces = [store_key]  # Store keys of the rows this memory stands in for
+
+
+class MemoryReport:
+    def __init__(self, rows: int, size: int, tool_tokens: int):
+        """
+        How much room a user's memories take up, on disk and in the search_memories tool's reply.
+        """
+        self.rows = rows
+        self.size = size
+        self.tool_tokens = tool_tokens
+
+    def __str__(self):
+        return f"{self.rows} rows, {self.size / 1024:.1f}KB, {self.tool_tokens} tool tokens"
+
+
+def parse_memory(store_key: str, memory_dict: dict) -> Memory | None:
+    """
+    Returns the row as a Memory if it is a summary or digest, None if it is something else, like a memory the user
+    asked to be stored.
+    """
+    if len(memory_dict) != 1:
+        return None
+    memory_key, text = next(iter(memory_dict.items()))
+    if match := SUMMARY_PATTERN.match(text):
+        try:
+            return Memory(store_key, memory_key, text, "summary", datetime.fromisoformat(match.group(1)).date())
+        except ValueError:
+            return None
+    if match := WEEKLY_PATTERN.match(text):
+        return Memory(store_key, memory_key, text, "weekly", date.fromisoformat(match.group(1)))
+    if match := MONTHLY_PATTERN.match(text):
+        return Memory(store_key, memory_key, text, "monthly", date.fromisoformat(match.group(1) + "-01"))
+    return None
+
+
+def get_week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def get_month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def strip_header(text: str) -> str:
+    return text.split("\n", 1)[1].strip() if "\n" in text else text
+
+
+def summarize_text(summarize, texts: list[str], budget: int) -> str:
+    """
+    Merges texts with the model. When they don't fit in one prompt, they are merged in chunks that fit, and then the
+    chunks are merged, until everything fits.
+    """
+    chunks = [[]]
+    chunk_tokens = 0
+    for text in texts:
+        text = text[:budget * context_budget.CHARS_PER_TOKEN]  # A single huge memory still has to fit
+        tokens = context_budget.estimate_tokens(text)
+        if chunks[-1] and chunk_tokens + tokens > budget:
+            chunks.append([])
+            chunk_tokens = 0
+        chunks[-1].append(text)
+        chunk_tokens += tokens
+    merged = [summarize("\n\n".join(chunk)) for chunk in chunks]
+    return merged[0] if len(merged) == 1 else summarize_text(summarize, merged, budget)
+
+
+def merge_memories(memories: list[Memory], kind: str, period: date, summarize, budget: int) -> Memory:
+    """
+    Merges summaries into a weekly digest or weekly digests into a monthly one, folding in any digest already made for
+    the same period.
+    """
+    memories = sorted(memories, key=lambda memory: memory.period)
+    if kind == "weekly":
+        header = f"Weekly digest for the week of {period.isoformat()}"
+        memory_key = f"weekly_digest_{period.isoformat()}"
+    else:
+        header = f"Monthly digest for {period.strftime('%Y-%m')}"
+        memory_key = f"monthly_digest_{period.strftime('%Y-%m')}"
+    if len(memories) == 1:
+        body = strip_header(memories[0].text)  # Nothing to merge it with, so it is just relabeled
+    else:
+        body = summarize_text(summarize, [memory.text for memory in memories], budget)
+    digest = Memory(str(uuid.uuid4()), memory_key, f"{header} \r\n {body}", kind, period)
+    digest.replaces = [store_key for memory in memories for store_key in memory.replaces]
+    return digest
+
+
+def group_by(memories: list[Memory], get_period) -> dict[date, list[Memory]]:
+    groups = {}
+    for memory in memories:
+        groups.setdefault(get_period(memory.period), []).append(memory)
+    return groups
+
+
+def plan_digests(memories: list[Memory], summarize, today: date, budget: int) -> list[Memory]:
+    """
+    Returns the digests that replace the old summaries and weekly digests. Digests made and then merged again in the
+    same pass are never written.
+    """
+    summary_cutoff = today - timedelta(days=KEEP_SUMMARIES_DAYS)
+    weekly_cutoff = today - timedelta(days=KEEP_WEEKLY_DAYS)
+
+    # Old summaries become weekly digests. Weeks that are partly recent wait until they are over.
+    weekly = [memory for memory in memories if memory.kind == "weekly"]
+    old_summaries = [memory for memory in memories if memory.kind == "summary"
+                     and get_week_start(memory.period) + timedelta(days=7) <= summary_cutoff]
+    digests = []
+    for week_start, week_summaries in group_by(old_summaries, get_week_start).items():
+        existing = [memory for memory in weekly if memory.period == week_start]
+        digest = merge_memories(existing + week_summaries, "weekly", week_start, summarize, budget)
+        weekly = [memory for memory in weekly if memory.period != week_start] + [digest]
+        digests.append(digest)
+
+    # Old weekly digests become monthly ones, the same way
+    monthly = [memory for memory in memories if memory.kind == "monthly"]
+    old_weekly = [memory for memory in weekly if get_month_start(memory.period) < get_month_start(weekly_cutoff)]
+    for month_start, month_weekly in group_by(old_weekly, get_month_start).items():
+        existing = [memory for memory in monthly if memory.period == month_start]
+        digest = merge_memories(existing + month_weekly, "monthly", month_start, summarize, budget)
+        digests = [memory for memory in digests if memory not in month_weekly] + [digest]
+    return digests
+
+
+def measure(store: SQLiteStore, user_id: str) -> MemoryReport:
+    namespace = get_memory_namespace(user_id)
+    rows, size = store.get_namespace_size(namespace)
+    tool_reply = format_memories(store.search(namespace, MEMORY_SEARCH_LIMIT))
+    return MemoryReport(rows, size, context_budget.estimate_tokens(tool_reply))
+
+
+def consolidate_user(store: SQLiteStore, user_id: str, summarize, today: date = None,
+                     budget: int = None) -> tuple[MemoryReport, MemoryReport]:
+    """
+    Consolidates one user's memories, returning reports from before and after.
+    - summarize: Function from the text of several memories to a single merged memory.
+    """
+    today = today or datetime.now(timezone.utc).date()
+    budget = budget or context_budget.get_prompt_budget(DIGEST_MODEL) - context_budget.estimate_tokens(DIGEST_PROMPT)
+    before = measure(store, user_id)
+    namespace = get_memory_namespace(user_id)
+    memories = [memory for store_key, memory_dict in store.yield_values(namespace)
+                if (memory := parse_memory(store_key, memory_dict))]
+
+    digests = plan_digests(memories, summarize, today, budget)
+    if digests:
+        # The digests are written before the rows they replace are deleted, so a crash can't lose memories
+        store.mset([("/".join(namespace), digest.store_key, json.dumps({digest.memory_key: digest.text}))
+                    for digest in digests])
+        store.mdelete([store_key for digest in digests for store_key in digest.replaces])
+    return before, measure(store, user_id)
+
+
+def get_memory_users(store: SQLiteStore) -> list[str]:
+    suffix = "/" + get_memory_namespace("")[1]
+    return [namespace[:-len(suffix)] for namespace in store.list_namespaces(suffix)]
+
+
+def consolidate(store: SQLiteStore, summarize, user_ids: list[str] = None):
+    """
+    Consolidates every user's memories, or just the given users', printing how much smaller they got.
+    """
+    for user_id in user_ids or get_memory_users(store):
+        start = time.perf_counter()
+        try:
+            before, after = consolidate_user(store, user_id, summarize)
+        except Exception as e:
+            print(f"Error consolidating memories for {user_id}: {e}")
+            continue
+        if before.rows != after.rows:
+            print(f"Consolidated memories for {user_id} in {time.perf_counter() - start:.1f}s: {before} -> {after}")
+
+
+def get_model_summarizer():
+    from langchain_ollama import ChatOllama
+    model = ChatOllama(model=DIGEST_MODEL)
+
+    def summarize(text: str) -> str:
+        return model.invoke([("system", DIGEST_PROMPT), ("user", text)]).content
+
+    return summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge old memory summaries into weekly and monthly digests.")
+    parser.add_argument("--db", default=get_memory_db_path(), help="Database the memories are stored in.")
+    parser.add_argument("--user", action="append", help="Only consolidate this user's memories. Can be repeated.")
+    parser.add_argument("--every", type=float, help="Keep running, consolidating every this many hours.")
+    args = parser.parse_args()
+
+    store = SQLiteStore(args.db)
+    summarize = get_model_summarizer()
+    while True:
+        consolidate(store, summarize, args.user)
+        if not args.every:
+            break
+        time.sleep(args.every * 3600)
+
+
+if __name__ == "__main__":
+    main()
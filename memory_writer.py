@@ -0,0 +1,182 @@
+import difflib
+import json
+import queue
+import re
+import threading
+import time
+import uuid
+
+from sqlite_store import SQLiteStore
+
+FLUSH_INTERVAL = 1.0  # Seconds to wait for more writes before committing a batch
+MAX_BATCH_SIZE = 100  # Most memories committed in a single transaction
+MAX_WRITE_ATTEMPTS = 3  # Times a batch is tried before its memories are given up on
+WRITE_RETRY_DELAY = 1.0  # Seconds before the first retry, doubling after each failed attempt
+SIMILARITY_THRESHOLD = 0.9  # How alike two memory keys have to be to count as the same memory
+MEMORY_SEARCH_LIMIT = 30  # Most memory rows the search_memories tool returns
+
+# Memories written by the bot itself rather than asked for by the user
+SUMMARY_PATTERN = re.compile(r"^Summary made at (\S+)")
+WEEKLY_PATTERN = re.compile(r"^Weekly digest for the week of (\d{4}-\d{2}-\d{2})")
+MONTHLY_PATTERN = re.compile(r"^Monthly digest for (\d{4}-\d{2})")
+
+_FLUSH = object()  # Queue marker asking the writer to commit what it has right away
+_STOP = object()  # Queue marker asking the writer to commit what it has and exit
+
+
+def normalize_memory_key(memory_key: str) -> str:
+    """
+    Lowercases a memory key and collapses anything that isn't a letter or number, so "Memory of pie." and
+    "memory_of_pie" compare equal.
+    """
+    return re.sub(r"[^a-z0-9]+", "_", memory_key.lower()).strip("_")
+
+
+def is_generated_memory(memory: str) -> bool:
+    """
+    Whether a memory is a conversation summary or digest rather than something the user asked to be stored.
+    """
+    return any(pattern.match(memory) for pattern in (SUMMARY_PATTERN, WEEKLY_PATTERN, MONTHLY_PATTERN))
+
+
+def get_memory_namespace(user_id: str) -> tuple[str, str]:
+    return user_id, "memories"
+
+
+def format_memories(search_result: list[tuple[str, dict]]) -> str:
+    """
+    Merges memory rows into the JSON payload the search_memories tool returns.
+    """
+    memories = {}
+    for _, memory_dict in search_result:
+        for memory_key, memory in memory_dict.items():
+            memories[memory_key] = memory
+    return json.dumps(memories)
+
+
+class MemoryWriter:
+    def __init__(self, store: SQLiteStore, flush_interval: float = FLUSH_INTERVAL,
+                 max_batch_size: int = MAX_BATCH_SIZE):
+        """
+        Write-behind queue for memories. Writes are batched into single transactions on a background thread,
+        and a memory whose key matches one the user already has replaces it instead of being appended. Memories the
+        user asked for also replace ones with a near-identical key. Summaries only replace summaries with the exact
+        same key, since their keys are made up by the model and a near match can be about something else entirely.
+        """
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.queue = queue.Queue()
+        self.key_index = {}  # user_id -> {(whether it is generated, normalized memory key): store key}
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, user_id: str, memory_key: str, memory_to_store: str):
+        """
+        Queues a memory to be stored. Returns right away.
+        """
+        self.queue.put((user_id, memory_key, memory_to_store))
+
+    def flush(self):
+        """
+        Blocks until every queued memory has been committed.
+        """
+        if not self.closed:
+            self.queue.put(_FLUSH)
+            self.queue.join()
+
+    def close(self):
+        """
+        Commits every queued memory and stops the writer thread.
+        """
+        if not self.closed:
+            self.closed = True
+            self.queue.put(_STOP)
+            self.thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not _FLUSH and batch[-1] is not _STOP and len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            running = _STOP not in batch
+            writes = [item for item in batch if item is not _FLUSH and item is not _STOP]
+            try:
+                if writes:
+                    self._write_with_retries(writes)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write_with_retries(self, writes):
+        """
+        Writes a batch, trying again a few times if it fails, since errors like a locked database usually pass.
+        Memories that still can't be written are printed, so they aren't lost without a trace.
+        """
+        delay = WRITE_RETRY_DELAY
+        for attempt in range(1, MAX_WRITE_ATTEMPTS + 1):
+            try:
+                self._write(writes)
+                return
+            except Exception as e:
+                if attempt == MAX_WRITE_ATTEMPTS:
+                    print(f"Error writing memories, giving up on {len(writes)} after {attempt} attempts: {e}")
+                    for user_id, memory_key, memory_to_store in writes:
+                        print(f"Lost memory for {user_id}: {memory_key}: {memory_to_store}")
+                    return
+                print(f"Error writing memories (attempt {attempt} of {MAX_WRITE_ATTEMPTS}), "
+                      f"trying again in {delay:g}s: {e}")
+                time.sleep(delay)
+                delay *= 2
+
+    def _write(self, writes):
+        """
+        Commits a batch of memories in one transaction, upserting over duplicates.
+        """
+        rows = {}  # (namespace, store key) -> memory dict, so duplicates within the batch collapse too
+        for user_id, memory_key, memory_to_store in writes:
+            store_key = self._find_store_key(user_id, memory_key, is_generated_memory(memory_to_store))
+            rows[("/".join(get_memory_namespace(user_id)), store_key)] = {memory_key: memory_to_store}
+
+        self.store.mset([(namespace, key, json.dumps(value)) for (namespace, key), value in rows.items()])
+        print(f"Stored {len(writes)} memories in {len(rows)} rows.")
+
+    def _find_store_key(self, user_id: str, memory_key: str, generated: bool) -> str:
+        """
+        Returns the store key of the user's memory of the same kind with the same key, or for memories the user asked
+        for, a near-identical key. Otherwise returns a new key.
+        """
+        key_index = self._get_key_index(user_id)
+        index_key = (generated, normalize_memory_key(memory_key))
+        if index_key not in key_index:
+            matches = [] if generated else difflib.get_close_matches(
+                index_key[1], [key for is_generated, key in key_index if not is_generated], n=1,
+                cutoff=SIMILARITY_THRESHOLD)
+            if matches:
+                print(f"Memory {memory_key} is a near-duplicate of {matches[0]}, replacing it.")
+                key_index[index_key] = key_index[(False, matches[0])]
+            else:
+                key_index[index_key] = str(uuid.uuid4())
+        return key_index[index_key]
+
+    def _get_key_index(self, user_id: str) -> dict:
+        """
+        Loads the user's existing memory keys the first time they are needed.
+        """
+        if user_id not in self.key_index:
+            key_index = {}
+            for store_key, memory_dict in self.store.yield_values(get_memory_namespace(user_id)):
+                for memory_key, memory in memory_dict.items():
+                    key_index[(is_generated_memory(str(memory)), normalize_memory_key(memory_key))] = store_key
+            self.key_index[user_id] = key_index
+        return self.key_index[user_id]
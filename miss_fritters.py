@@ -1,16 +1,14 @@
 # ===== IMPORTS =====
-import json
+import atexit
 import random
 import re
-import uuid
-from contextlib import ExitStack
+from contextlib import ExitStack, closing
 from datetime import datetime
 from typing import Literal
 from zoneinfo import ZoneInfo
 
 import pytz
-from duckduckgo_search import DDGS
-from langchain_core.messages import HumanMessage, RemoveMessage
+from langchain_core.messages import HumanMessage, RemoveMessage, AIMessageChunk
 from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool, BaseTool
 from langchain_ollama import ChatOllama
@@ -19,19 +17,24 @@ from langgraph.constants import START, END
 from langgraph.graph import StateGraph, MessagesState
 from langgraph.prebuilt import create_react_agent
 
+import context_budget
 import deck_of_cards_integration
 import fritters_utils
+from lazy_modules import lazy_module
 from kasa_integration import turn_off_lights, turn_on_lights, change_light_color, turn_off_bedroom_lights, \
-    turn_on_bedroom_lights
+    turn_on_bedroom_lights, set_light_scene, get_light_status
 # ===== LOCAL MODULES =====
+from memory_writer import MemoryWriter, MEMORY_SEARCH_LIMIT, format_memories, get_memory_namespace
 from message_source import MessageSource
-from sqlite_store import SQLiteStore
-from wordle_integration import play_wordle_internal
+from sqlite_store import connect, get_history_db_path, get_memory_db_path
+from store_cache import get_store
+
+# Tool modules that are slow to import, loaded the first time their tool is called
+wordle_integration = lazy_module("wordle_integration")  # torch, scikit-learn and the word list
+duckduckgo_search = lazy_module("duckduckgo_search")
 
 # ===== CONFIGURATION =====
 LLAMA_MODEL = "llama3.2"
-IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff"]
-DB_NAME = "chat_history.db"
 
 # Constants for the routing decisions
 CONVERSATION_NODE = "conversation"
@@ -40,6 +43,9 @@ STORY_NODE = "tell_a_story"
 HOME_NODE = "home_management"
 SUMMARIZE_CONVERSATION_NODE = "summarize_conversation"
 
+# Nodes whose output is the reply to the user, as opposed to routing or summarizing
+RESPONSE_NODES = [CONVERSATION_NODE, CODING_NODE, STORY_NODE, HOME_NODE]
+
 
 def get_conversation_tools_description():
     """
@@ -53,7 +59,9 @@ def get_conversation_tools_description():
         "deck_draw_cards": (deck_draw_cards, "Draw cards from a deck."),
         "deck_cards_left": (deck_cards_left, "Check remaining cards in a deck."),
         "deck_reload": (deck_reload, "Shuffle or reload the current deck."),
-        "search_memories": (search_memories, "Returns a JSON payload of stored memories you have had with a user."),
+        "search_memories": (search_memories, "Returns a JSON payload of stored memories you have had with a user, "
+                                             "or just the ones matching a query."),
+        "add_memory": (add_memory, "Stores something the user asked you to remember."),
         "play_wordle": (play_wordle, "Takes in a word and game number and tries to solve the Wordle.")
     }
     return conversation_tool_dict
@@ -68,7 +76,9 @@ def get_home_management_tools_description():
         "turn_on_lights": (turn_on_lights, "Turns on the lights."),
         "turn_off_bedroom_lights": (turn_off_bedroom_lights, "Turns off the bedroom lights."),
         "turn_on_bedroom_lights": (turn_on_bedroom_lights, "Turns on the bedroom lights."),
-        "change_light_color": (change_light_color, "Changes light color. Accepts a valid hue in degrees.")
+        "change_light_color": (change_light_color, "Changes light color. Accepts a valid hue in degrees."),
+        "set_light_scene": (set_light_scene, "Sets the lights to a named scene, like all_off or movie_night."),
+        "get_light_status": (get_light_status, "Tells which lights are on and their colors, without changing them.")
     }
 
     return home_tool_dict
@@ -114,14 +124,17 @@ def format_prompt(prompt: str, source: MessageSource, user_id: str) -> str:
     """
 
 
-def search_memories_internal(config: RunnableConfig):
+def search_memories_internal(config: RunnableConfig, query: str = ""):
     user_id = config.get("metadata").get("user_id")
-    search_result = store.search((user_id, "memories"), 30)
-    summaries = {}
-    for _, summary_dict in search_result:
-        for key, summary in summary_dict.items():
-            summaries[key] = summary
-    json_summaries = json.dumps(summaries)
+    memory_writer.flush()  # Make sure memories still waiting to be written show up
+    search_result = []
+    if query:
+        # Only the memories that mention the query, most relevant first
+        search_result = [(key, value) for key, value, _ in
+                         store.search_text(get_memory_namespace(user_id), query, MEMORY_SEARCH_LIMIT)]
+    if not search_result:
+        search_result = store.search(get_memory_namespace(user_id), MEMORY_SEARCH_LIMIT)
+    json_summaries = format_memories(search_result)
     print(json_summaries)
     return json_summaries
 
@@ -135,7 +148,9 @@ def play_wordle(word: str, game_number: int):
     word: The word to guess.
     game_number: The game number.
     """
-    return play_wordle_internal(word, game_number)
+    solver = fritters_utils.get_key_from_json_config_file(fritters_utils.WORDLE_SOLVER_KEY) or \
+        wordle_integration.DQN_SOLVER
+    return wordle_integration.play_wordle_internal(word, game_number, solver)
 
 
 @tool(parse_docstring=True)
@@ -199,7 +214,7 @@ def search_web(text_to_search: str):
     Returns:
     list: A list of dictionaries, each containing string keys and string values representing the search results.
     """
-    results = DDGS().text(text_to_search, max_results=5)
+    results = duckduckgo_search.DDGS().text(text_to_search, max_results=5)
     print(results)
     return results
 
@@ -261,32 +276,59 @@ def deck_draw_cards(number_of_cards: int, config: RunnableConfig) -> str:
 
 
 @tool(parse_docstring=True)
-def search_memories(config: RunnableConfig):
+def search_memories(config: RunnableConfig, query: str = ""):
     """ This function returns memories in JSON format.
 
     Args:
         config: The RunnableConfig.
+        query (str): Optional words to look for, like "favorite pie". Leave empty to get all memories.
     """
     print("TOOL CALLED")
-    return search_memories_internal(config)
+    return search_memories_internal(config, query)
 
 
-def add_memory(user_id: str, memory_key: str, memory_to_store: str):
-    """ This function stores a memory. Only use this if the user has asked you to.
+@tool(parse_docstring=True)
+def add_memory(config: RunnableConfig, memory_key: str, memory_to_store: str):
+    """ This function stores a memory. Only use this if the user has asked you to remember something.
 
     Args:
-        user_id (str): The id of the user to store the memory.
-        memory_key (str): A unique identifier for the memory.
+        config: The RunnableConfig.
+        memory_key (str): A short name for the memory, like memory_of_pie. A memory with the same name is replaced.
         memory_to_store (str): The memory you wish to store.
     """
-    memory_dict = {memory_key: memory_to_store}
-    store.put((user_id, "memories"), str(uuid.uuid4()), memory_dict)
+    user_id = config.get("metadata").get("user_id")
+    memory_writer.add(user_id, memory_key, memory_to_store)
     return "Added memory for {}: {}".format(memory_key, memory_to_store)
 
 
 # ===== MAIN FUNCTION =====
 def ask_stuff(base_prompt: str, source: MessageSource, user_id: str) -> str:
     """Process user input and return the chatbot's response."""
+    inputs, config = get_ask_inputs(base_prompt, source, user_id)
+    return print_stream(app.stream(inputs, config=config, stream_mode="values"))
+
+
+def ask_stuff_stream(base_prompt: str, source: MessageSource, user_id: str):
+    """Process user input and yield the chatbot's response in pieces while it is still being generated."""
+    inputs, config = get_ask_inputs(base_prompt, source, user_id)
+    streamed = False
+    final_message = None
+    for mode, chunk in app.stream(inputs, config=config, stream_mode=["messages", "values"]):
+        if mode == "values":
+            final_message = chunk["messages"][-1]
+            continue
+        message, metadata = chunk
+        if get_streaming_node(metadata) in RESPONSE_NODES and isinstance(message, AIMessageChunk) and message.content:
+            streamed = True
+            yield message.content
+
+    # Tools that return directly never stream any tokens, so fall back to the final message
+    if not streamed and final_message is not None:
+        yield final_message.content
+
+
+def get_ask_inputs(base_prompt: str, source: MessageSource, user_id: str):
+    """Build the graph inputs and config for a user's prompt."""
     user_id_clean = re.sub(r'[^a-zA-Z0-9]', '', user_id)  # Clean special characters
     full_prompt = format_prompt(base_prompt, source, user_id_clean)
 
@@ -296,8 +338,13 @@ def ask_stuff(base_prompt: str, source: MessageSource, user_id: str) -> str:
 
     config = {"configurable": {"user_id": user_id_clean, "thread_id": user_id_clean}}
     inputs = {"messages": [("user", full_prompt)]}
+    return inputs, config
 
-    return print_stream(app.stream(inputs, config=config, stream_mode="values"))
+
+def get_streaming_node(metadata: dict) -> str:
+    """Return the top-level graph node a streamed token came from, even if it came from a nested react agent."""
+    checkpoint_ns = metadata.get("langgraph_checkpoint_ns", "")
+    return checkpoint_ns.split("|")[0].split(":")[0] or metadata.get("langgraph_node", "")
 
 
 def print_stream(stream):
@@ -319,9 +366,12 @@ print(conversation_tools)
 home_tools = [tool_info[0] for tool_info in get_home_management_tools_description().values()]
 print(home_tools)
 
-store = SQLiteStore(DB_NAME)
+store = get_store(get_memory_db_path())
+memory_writer = MemoryWriter(store)
+atexit.register(memory_writer.close)  # Flush queued memories on shutdown
 exit_stack = ExitStack()
-checkpointer = exit_stack.enter_context(SqliteSaver.from_conn_string(DB_NAME))
+# Its own connection instead of SqliteSaver.from_conn_string, so it waits out the store's locks instead of failing
+checkpointer = SqliteSaver(exit_stack.enter_context(closing(connect(get_history_db_path(), check_same_thread=False))))
 llama_instance = ChatOllama(model=LLAMA_MODEL)
 
 MISTRAL_MODEL = "mistral"
@@ -407,10 +457,8 @@ def supervisor_routing(state: MessagesState, config: RunnableConfig):
 
 
 def should_continue(state: MessagesState) -> Literal["summarize_conversation", END]:
-    #messages = state["messages"]
-    #print(f"Messages: {messages}")
-    """Decide whether to summarize or end the conversation."""
-    return SUMMARIZE_CONVERSATION_NODE if len(state["messages"]) > 15 else END
+    """Decide whether to summarize or end the conversation, based on how many tokens the history takes up."""
+    return SUMMARIZE_CONVERSATION_NODE if context_budget.should_summarize(state["messages"], LLAMA_MODEL) else END
 
 
 def tell_a_story(state: MessagesState, config: RunnableConfig):
@@ -440,7 +488,8 @@ def summarize_conversation(state: MessagesState, config: RunnableConfig):
     print("In: summarize_conversation")
     user_id = config.get("metadata").get("user_id")
     summary_message_prompt = "Please summarize the conversation above:"
-    messages = state["messages"]
+    # Keep the summary prompt inside the model's context, even if a huge message got pasted in
+    messages = context_budget.trim_to_budget(state["messages"], context_budget.get_prompt_budget(LLAMA_MODEL))
     # messages[-1].content = messages[-1].content + "\r\n I am wrapping up this conversation and starting a new one :)"
     messages = messages + [HumanMessage(content=summary_message_prompt)]
     summary_response = llama_instance.invoke(messages)
@@ -453,9 +502,11 @@ def summarize_conversation(state: MessagesState, config: RunnableConfig):
         ("user", summary)]
     summary_response_key = llama_instance.invoke(response_key_inputs, config=get_config_values(config))
     print(f"Summary Key: {summary_response_key.content}")
-    add_memory(user_id, summary_response_key.content, summary)
+    memory_writer.add(user_id, summary_response_key.content, summary)
     # Remove all but the last message
     delete_messages = [RemoveMessage(id=m.id) for m in state["messages"][:-1]]
+    context_budget.context_stats.record_summary(context_budget.count_tokens(state["messages"]),
+                                                context_budget.count_tokens(state["messages"][-1:]))
 
     return {"messages": delete_messages}
 
@@ -0,0 +1,288 @@
+import json
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import types
+
+try:
+    import resource  # Not available on Windows, where only the wall clock limit applies
+except ImportError:
+    resource = None
+
+POOL_SIZE = 2  # Warm sandboxes kept waiting for code
+MAX_JOBS_PER_SANDBOX = 1  # Jobs a sandbox runs before it is replaced, 1 gives every job a clean interpreter
+TIME_LIMIT = 5.0  # Wall clock seconds a job gets
+CPU_LIMIT = 5  # CPU seconds a job gets
+MEMORY_LIMIT = 512 * 1024 * 1024  # Address space a sandbox gets, in bytes
+READ_SIZE = 65536
+
+
+class SandboxResult:
+    def __init__(self, stdout: str, stderr: str, duration: float, overhead: float, error: str | None = None):
+        """
+        Output of a job. duration is how long the code itself ran, overhead is everything else the caller waited on.
+        """
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.overhead = overhead
+        self.error = error
+
+    def get_output(self) -> str:
+        """
+        stdout, or stderr if there wasn't any, the same as a plain subprocess.run of the code would show.
+        """
+        return self.error or self.stdout or self.stderr
+
+    def get_all_output(self) -> str:
+        """
+        stdout followed by stderr, for when both matter, like unittest's results after the code's own prints.
+        """
+        return self.error or self.stdout + self.stderr
+
+
+class Sandbox:
+    def __init__(self, cpu_limit: int, memory_limit: int):
+        """
+        A Python interpreter started ahead of time, waiting for code on its stdin.
+        """
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), str(cpu_limit), str(memory_limit)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self.jobs = 0
+        self.results = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def run(self, code: str, time_limit: float) -> dict:
+        self.jobs += 1
+        self.process.stdin.write(json.dumps({"code": code}) + "\n")
+        self.process.stdin.flush()
+        try:
+            result = self.results.get(timeout=time_limit)
+        except queue.Empty:
+            self.kill()
+            return {"error": f"Timed out after {time_limit} seconds"}
+        if result is None:
+            return {"error": f"Sandbox was killed ({self.describe_exit()})"}
+        return result
+
+    def describe_exit(self) -> str:
+        return_code = self.process.wait()
+        if return_code == -getattr(signal, "SIGXCPU", 0):
+            return "CPU time limit exceeded"
+        return f"exit code {return_code}"
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+    def _read(self):
+        for line in self.process.stdout:
+            self.results.put(json.loads(line))
+        self.results.put(None)  # The sandbox exited
+
+
+class SandboxPool:
+    def __init__(self, size: int = POOL_SIZE, max_jobs: int = MAX_JOBS_PER_SANDBOX, time_limit: float = TIME_LIMIT,
+                 cpu_limit: int = CPU_LIMIT, memory_limit: int = MEMORY_LIMIT):
+        """
+        Pool of warm sandboxes for running generated code, so a run doesn't pay for starting Python and writing a
+        temp file. Each job runs with CPU, memory and wall clock limits, and sandboxes are replaced in the background
+        after max_jobs jobs (or right away if a job times out or crashes).
+        """
+        self.max_jobs = max_jobs
+        self.time_limit = time_limit
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.jobs = 0
+        self.total_duration = 0.0
+        self.total_overhead = 0.0
+        self.closed = False
+        for _ in range(size):
+            self.idle.put(self._start_sandbox())
+
+    def run(self, code: str) -> SandboxResult:
+        """
+        Runs code in a warm sandbox and returns what it printed.
+        """
+        start = time.perf_counter()
+        sandbox = self.idle.get()
+        result = sandbox.run(code, self.time_limit)
+        elapsed = time.perf_counter() - start
+
+        if result.get("error") or sandbox.jobs >= self.max_jobs:
+            threading.Thread(target=self._replace, args=(sandbox,), daemon=True).start()
+        else:
+            self.idle.put(sandbox)
+
+        duration = result.get("duration", elapsed)
+        sandbox_result = SandboxResult(result.get("stdout", ""), result.get("stderr", ""), duration,
+                                       elapsed - duration, result.get("error"))
+        with self.lock:
+            self.jobs += 1
+            self.total_duration += sandbox_result.duration
+            self.total_overhead += sandbox_result.overhead
+        return sandbox_result
+
+    def get_stats(self) -> str:
+        with self.lock:
+            if not self.jobs:
+                return "No code has been run yet."
+            return (f"{self.jobs} runs, {self.total_duration / self.jobs * 1000:.1f}ms average run time, "
+                    f"{self.total_overhead / self.jobs * 1000:.1f}ms average overhead per run")
+
+    def close(self):
+        self.closed = True
+        while not self.idle.empty():
+            self.idle.get().close()
+
+    def _start_sandbox(self) -> Sandbox:
+        return Sandbox(self.cpu_limit, self.memory_limit)
+
+    def _replace(self, sandbox: Sandbox):
+        if not self.closed:
+            self.idle.put(self._start_sandbox())
+        sandbox.close()
+
+
+def set_limits(cpu_limit: int, memory_limit: int):
+    """
+    Applies the job's CPU and memory limits to the sandbox. CPU time adds up over the life of a process, so the limit
+    is set relative to what has been used so far.
+    """
+    if resource is None:
+        return
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    _, cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)
+    cpu_soft = int(used.ru_utime + used.ru_stime) + cpu_limit
+    if cpu_hard != resource.RLIM_INFINITY:
+        cpu_soft = min(cpu_soft, cpu_hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_soft, cpu_hard))
+    _, memory_hard = resource.getrlimit(resource.RLIMIT_AS)
+    if memory_hard == resource.RLIM_INFINITY or memory_limit < memory_hard:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_hard))
+
+
+def capture_fd(fd: int, chunks: list):
+    """
+    Points fd at a new pipe and collects what is written to it, including output from child processes.
+    Returns the saved original fd and the reader thread.
+    """
+    read_fd, write_fd = os.pipe()
+    saved_fd = os.dup(fd)
+    os.dup2(write_fd, fd)
+    os.close(write_fd)
+
+    def read():
+        while data := os.read(read_fd, READ_SIZE):
+            chunks.append(data)
+        os.close(read_fd)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    return saved_fd, reader
+
+
+def run_job(code: str, cpu_limit: int, memory_limit: int) -> dict:
+    """
+    Runs code as if it were its own script, so `if __name__ == "__main__"` and unittest.main() work.
+    """
+    stdout_chunks, stderr_chunks = [], []
+    saved_stdout, stdout_reader = capture_fd(1, stdout_chunks)
+    saved_stderr, stderr_reader = capture_fd(2, stderr_chunks)
+    sys.stdout = os.fdopen(os.dup(1), "w")
+    sys.stderr = os.fdopen(os.dup(2), "w")
+    module = types.ModuleType("__main__")
+    module.__file__ = "<sandbox>"
+    sys.modules["__main__"] = module
+    sys.argv = ["<sandbox>"]
+
+    start = time.perf_counter()
+    set_limits(cpu_limit, memory_limit)
+    try:
+        exec(compile(code, "<sandbox>", "exec"), module.__dict__)
+    except SystemExit:
+        pass
+    except BaseException:
+        exception_type, exception, trace = sys.exc_info()
+        traceback.print_exception(exception_type, exception, trace.tb_next)  # Leave out run_job's own frame
+    duration = time.perf_counter() - start
+
+    sys.stdout.close()
+    sys.stderr.close()
+    os.dup2(saved_stdout, 1)
+    os.dup2(saved_stderr, 2)
+    stdout_reader.join()
+    stderr_reader.join()
+    return {
+        "stdout": b"".join(stdout_chunks).decode(errors="replace"),
+        "stderr": b"".join(stderr_chunks).decode(errors="replace"),
+        "duration": duration,
+    }
+
+
+def run_sandbox(cpu_limit: int, memory_limit: int):
+    """
+    Entry point of a sandbox process. Reads jobs from stdin and writes results to stdout, one JSON line each.
+    The code itself gets an empty stdin and its own stdout and stderr.
+    """
+    job_input = os.fdopen(os.dup(0), "r")
+    job_output = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+
+    for line in job_input:
+        result = run_job(json.loads(line)["code"], cpu_limit, memory_limit)
+        job_output.write(json.dumps(result) + "\n")
+        job_output.flush()
+
+
+def benchmark(runs: int = 20, pause: float = 0.2):
+    """
+    Compares running a snippet the old way, a new interpreter and a temp file per run, against the pool.
+    Runs are spaced out by pause, like they are while the model generates the next snippet, which is when
+    used sandboxes get replaced.
+    """
+    import tempfile
+    code = "print(sum(range(1000)))"
+
+    cold = 0.0
+    for _ in range(runs):
+        start = time.perf_counter()
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".py") as temp_file:
+            temp_file.write(code.encode())
+        subprocess.run([sys.executable, temp_file.name], capture_output=True, text=True, timeout=TIME_LIMIT)
+        os.remove(temp_file.name)
+        cold += time.perf_counter() - start
+
+    pool = SandboxPool()
+    warm = 0.0
+    for _ in range(runs):
+        time.sleep(pause)
+        start = time.perf_counter()
+        pool.run(code)
+        warm += time.perf_counter() - start
+    print(f"New interpreter per run: {cold / runs * 1000:.1f}ms per run")
+    print(f"Sandbox pool: {warm / runs * 1000:.1f}ms per run ({pool.get_stats()})")
+    pool.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        run_sandbox(int(sys.argv[1]), int(sys.argv[2]))
+    else:
+        benchmark()
@@ -1,18 +1,236 @@
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import queue
+import re
 import sqlite3
 import json
+import tempfile
+import threading
+import time
 
+import fritters_utils
 from langchain_core.stores import BaseStore
 from typing import List, Tuple, Optional, Union, Iterator, Dict, Any
 from typing_extensions import Literal
 
+DEFAULT_DB_PATH = "chat_history.db"
+BUSY_TIMEOUT = 30.0  # Seconds a connection waits for another one's lock before giving up
+IO_QUEUE_SIZE = 1000  # Most writes waiting on the writer thread before callers have to wait to add more
+READ_THREADS = 4  # Threads async reads run on
+MAX_WRITE_BATCH = 500  # Most queued writes committed together in one transaction
+DEFAULT_BATCH_SIZE = 1000  # Rows fetched or committed at a time when streaming
+SNIPPET_WORDS = 16  # Words of context in a text search snippet
+SNIPPET_LENGTH = 100  # Characters of the value used as the snippet when FTS5 isn't available
+
+
+def get_history_db_path() -> str:
+    """
+    The database conversation checkpoints are kept in.
+    """
+    return fritters_utils.get_key_from_json_config_file(fritters_utils.HISTORY_DB_KEY) or DEFAULT_DB_PATH
+
+
+def get_memory_db_path() -> str:
+    """
+    The database the store is kept in, the same one as the checkpoints unless memory_db is set in config.json.
+    """
+    return fritters_utils.get_key_from_json_config_file(fritters_utils.MEMORY_DB_KEY) or get_history_db_path()
+
+
+def connect(db_path: str, **kwargs) -> sqlite3.Connection:
+    """
+    Opens a connection that waits for locks held by other connections, instead of failing with "database is locked".
+    """
+    return sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, **kwargs)
+
+
+class StoreIOExecutor:
+    def __init__(self, db_path: str, queue_size: int = IO_QUEUE_SIZE, max_write_batch: int = MAX_WRITE_BATCH,
+                 read_threads: int = READ_THREADS):
+        """
+        The store's single writer. Every write in this process goes through its one thread and connection, so they
+        never fight each other for the database lock, and writes queued back to back are committed together in a
+        single transaction. Writes are committed in the order they were queued. Async reads run on a few reader
+        threads, but first wait for the writes queued before them, so a read always sees the writes it came after.
+        Sync reads don't go through the executor, so they only see writes that have been committed.
+        """
+        self.db_path = db_path
+        self.max_write_batch = max_write_batch
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.readers = concurrent.futures.ThreadPoolExecutor(read_threads, thread_name_prefix="store_reader")
+        self.stats_lock = threading.Lock()
+        self.writes = 0
+        self.transactions = 0
+        self.lock_wait = 0.0  # Total seconds spent waiting for the database's write lock
+        self.max_lock_wait = 0.0
+        self.queue_wait = 0.0  # Total seconds writes spent queued before their transaction started
+        self.max_queue_wait = 0.0
+        self.last_write = None  # Future of the most recently queued write
+        self.failure = None  # What stopped the writer thread, if something did
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    async def run(self, function, *args, write: bool = False):
+        """
+        Runs function(*args) without blocking the event loop. Write functions are run on the writer thread and are
+        given a cursor as their first argument, so they can share a transaction.
+        """
+        if not write:
+            await self._wait_for_queued_writes()
+            return await asyncio.wrap_future(self.readers.submit(function, *args))
+        job = self._make_job(function, args)
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            # Wait for room on a helper thread, so a full queue slows callers down without blocking the loop
+            await asyncio.to_thread(self.queue.put, job)
+        self._check_queued()
+        return await asyncio.wrap_future(job[0])
+
+    def write(self, function, *args):
+        """
+        Runs a write function on the writer thread, blocking until it is committed.
+        """
+        job = self._make_job(function, args)
+        self.queue.put(job)
+        self._check_queued()
+        return job[0].result()
+
+    def _make_job(self, function, args) -> tuple:
+        if self.failure is not None:
+            raise RuntimeError(f"The store writer stopped: {self.failure!r}") from self.failure
+        job = (concurrent.futures.Future(), function, args, time.perf_counter())
+        self.last_write = job[0]
+        return job
+
+    def _check_queued(self):
+        """
+        Fails the queued writes if the writer thread stopped while they were being queued, instead of leaving their
+        callers waiting forever.
+        """
+        if self.failure is not None:
+            self._fail_queued(self.failure)
+
+    async def _wait_for_queued_writes(self):
+        last_write = self.last_write
+        if last_write is not None and not last_write.done():
+            # Writes are committed in order, so once the last one is done every one before it is too
+            try:
+                await asyncio.wrap_future(last_write)
+            except Exception:
+                pass  # Its caller hears about it, the read goes ahead either way
+
+    def get_stats(self) -> str:
+        with self.stats_lock:
+            transactions = max(self.transactions, 1)
+            return (f"{self.writes} writes in {self.transactions} transactions "
+                    f"({self.writes / transactions:.1f} per transaction), "
+                    f"lock wait {self.lock_wait / transactions * 1000:.1f}ms average, "
+                    f"{self.max_lock_wait * 1000:.0f}ms max, "
+                    f"queue wait {self.queue_wait / max(self.writes, 1) * 1000:.1f}ms average, "
+                    f"{self.max_queue_wait * 1000:.0f}ms max")
+
+    def _run(self):
+        conn = None
+        while True:
+            writes = [self.queue.get()]
+            while len(writes) < self.max_write_batch:
+                try:
+                    writes.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if conn is None:
+                    conn = connect(self.db_path)  # Tried again with the next batch if the database can't be opened
+                self._run_writes(conn, writes)
+            except BaseException as e:
+                # Whatever happens, nobody is left waiting on a write that will never be committed
+                self._fail_jobs(writes, e)
+                if not isinstance(e, Exception):
+                    self.failure = e
+                    self._fail_queued(e)
+                    raise
+                print(f"Error writing to the store: {type(e).__name__}: {e}")
+
+    def _fail_queued(self, error: BaseException):
+        jobs = []
+        while True:
+            try:
+                jobs.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        self._fail_jobs(jobs, error)
+
+    @staticmethod
+    def _fail_jobs(jobs, error: BaseException):
+        for job in jobs:
+            try:
+                job[0].set_exception(error)
+            except concurrent.futures.InvalidStateError:
+                pass  # Already done or cancelled
+
+    def _run_writes(self, conn: sqlite3.Connection, writes):
+        writes = [job for job in writes if job[0].set_running_or_notify_cancel()]
+        if len(writes) > 1:
+            try:
+                results = self._commit(conn, writes)
+            except Exception:
+                pass  # One bad write shouldn't fail the others, so they are retried one at a time
+            else:
+                for job, result in zip(writes, results):
+                    job[0].set_result(result)
+                return
+        for job in writes:
+            try:
+                job[0].set_result(self._commit(conn, [job])[0])
+            except Exception as e:
+                job[0].set_exception(e)
+
+    def _commit(self, conn: sqlite3.Connection, writes) -> list:
+        start = time.perf_counter()
+        with conn:
+            # Take the write lock up front, so how long other connections made us wait for it can be measured
+            conn.execute("BEGIN IMMEDIATE")
+            lock_wait = time.perf_counter() - start
+            cursor = conn.cursor()
+            results = [function(cursor, *args) for _, function, args, _ in writes]
+        with self.stats_lock:
+            self.writes += len(writes)
+            self.transactions += 1
+            self.lock_wait += lock_wait
+            self.max_lock_wait = max(self.max_lock_wait, lock_wait)
+            for _, _, _, queued in writes:
+                self.queue_wait += start - queued
+                self.max_queue_wait = max(self.max_queue_wait, start - queued)
+        return results
+
 
 class SQLiteStore(BaseStore[str, Union[str, bytes]]):
     def __init__(self, db_path: str = ":memory:"):
         self.db_path = db_path
+        self._io_executor = None
+        self._io_executor_lock = threading.Lock()
         self._initialize_db()
 
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Opens a connection that commits on success and rolls back on errors. It is closed right away, instead of
+        whenever it gets garbage collected, so it can't hold on to the database.
+        """
+        conn = connect(self.db_path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
     def _initialize_db(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
+            # Readers don't block the writer and the writer doesn't block readers. Stays set in the database file.
+            conn.execute("PRAGMA journal_mode = WAL")
             cursor = conn.cursor()
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS store (
@@ -22,10 +240,53 @@ class SQLiteStore(BaseStore[str, Union[str, bytes]]):
                     PRIMARY KEY (namespace, key)
                 )
             """)
+            self.has_text_search = self._initialize_text_search(cursor)
             conn.commit()
 
+    def _initialize_text_search(self, cursor: sqlite3.Cursor) -> bool:
+        """
+        Sets up a full text index of the values, kept up to date by triggers. Returns False if this SQLite doesn't
+        have FTS5, in which case search_text falls back to a slower LIKE scan.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'store_fts'")
+        exists = cursor.fetchone() is not None
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS store_fts
+                USING fts5(namespace UNINDEXED, key UNINDEXED, text, tokenize = 'porter unicode61')
+            """)
+        except sqlite3.OperationalError as e:
+            print(f"Full text search isn't available, searching text will be slow: {e}")
+            return False
+
+        # The text indexed is the value's keys and strings, decoded, so escapes like \n and \u00e9 don't get in the way
+        text = """
+            CASE WHEN json_valid(new.value)
+                THEN (SELECT group_concat(COALESCE(key, '') || ' ' || value, ' ') FROM json_each(new.value))
+                ELSE new.value END
+        """
+        cursor.executescript(f"""
+            CREATE TRIGGER IF NOT EXISTS store_fts_insert AFTER INSERT ON store BEGIN
+                INSERT INTO store_fts (rowid, namespace, key, text) VALUES (new.rowid, new.namespace, new.key, {text});
+            END;
+            CREATE TRIGGER IF NOT EXISTS store_fts_delete AFTER DELETE ON store BEGIN
+                DELETE FROM store_fts WHERE rowid = old.rowid;
+            END;
+            CREATE TRIGGER IF NOT EXISTS store_fts_update AFTER UPDATE ON store BEGIN
+                DELETE FROM store_fts WHERE rowid = old.rowid;
+                INSERT INTO store_fts (rowid, namespace, key, text) VALUES (new.rowid, new.namespace, new.key, {text});
+            END;
+        """)
+        if not exists:
+            # Index what was stored before there was an index
+            cursor.execute(f"""
+                INSERT INTO store_fts (rowid, namespace, key, text)
+                SELECT new.rowid, new.namespace, new.key, {text} FROM store AS new
+            """)
+        return True
+
     def _execute_query(self, query: str, params: Tuple = ()):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute(query, params)
             conn.commit()
@@ -49,30 +310,355 @@ class SQLiteStore(BaseStore[str, Union[str, bytes]]):
         self.mset([(namespace_str, key, value_str)])
 
     def mset(self, key_value_pairs: List[Tuple[str, str, str]]) -> None:
-        query = "REPLACE INTO store (namespace, key, value) VALUES (?, ?, ?)"
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.executemany(query, key_value_pairs)
-            conn.commit()
+        self._get_io_executor().write(self._write_rows, key_value_pairs)
+
+    def _write_rows(self, cursor: sqlite3.Cursor, key_value_pairs: List[Tuple[str, str, str]]):
+        # An upsert rather than REPLACE, since the rows REPLACE deletes don't fire the text index's delete trigger
+        cursor.executemany("""
+            INSERT INTO store (namespace, key, value) VALUES (?, ?, ?)
+            ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value
+        """, key_value_pairs)
 
     def delete(self, key: str) -> None:
         self.mdelete([key])
 
     def mdelete(self, keys: List[str]) -> None:
+        self._get_io_executor().write(self._delete_keys, keys)
+
+    def _delete_keys(self, cursor: sqlite3.Cursor, keys: List[str]):
         placeholders = ','.join(['?'] * len(keys))
-        query = f"DELETE FROM store WHERE key IN ({placeholders})"
-        self._execute_query(query, tuple(keys))
+        cursor.execute(f"DELETE FROM store WHERE key IN ({placeholders})", tuple(keys))
+
+    def _yield_rows(self, columns: str, condition: str, params: Tuple, batch_size: int) -> Iterator[Tuple]:
+        """
+        Runs a query a page at a time in (namespace, key) order, each page picking up after the last row of the one
+        before. Only one page is ever in memory, and no lock is held on the database between pages.
+        - columns: What to select after namespace and key, like ", value", or "" for just those two.
+        """
+        after = ()
+        while True:
+            page_condition = condition + (" AND (namespace, key) > (?, ?)" if after else "")
+            rows = self._execute_query(f"SELECT namespace, key{columns} FROM store WHERE {page_condition} "
+                                       f"ORDER BY namespace, key LIMIT ?", params + after + (batch_size,))
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][:2]
+
+    def yield_keys(self, prefix: Optional[str] = "", batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[str]:
+        for _, key in self._yield_rows("", "key LIKE ?", (f"{prefix}%",), batch_size):
+            yield key
+
+    def yield_values(self, namespace: Tuple[str, ...], batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[
+        Tuple[str, Dict[str, Any]]]:
+        """
+        Yields every (key, value) in a namespace, like search without a limit, but a page at a time.
+        """
+        for _, key, value in self._yield_rows(", value", "namespace = ?", ("/".join(namespace),), batch_size):
+            yield key, json.loads(value)
+
+    def yield_namespaces(self, prefix: str = "", suffix: str = "", batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[
+        str]:
+        after = ()
+        while True:
+            condition = "namespace LIKE ?" + (" AND namespace > ?" if after else "")
+            query = f"SELECT DISTINCT namespace FROM store WHERE {condition} ORDER BY namespace LIMIT ?"
+            rows = self._execute_query(query, (f"{prefix}%{suffix}",) + after + (batch_size,))
+            for row in rows:
+                yield row[0]
+            if len(rows) < batch_size:
+                return
+            after = rows[-1]
+
+    def list_namespaces(self, suffix: str = "") -> List[str]:
+        return list(self.yield_namespaces(suffix=suffix))
+
+    def export_ndjson(self, path: str, namespace_prefix: str = "", batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """
+        Writes every row, or those in namespaces starting with namespace_prefix, to a newline delimited JSON file,
+        one {"namespace", "key", "value"} object per line. Returns how many rows were written.
+        """
+        count = 0
+        with open(path, "w", encoding="utf-8") as file:
+            for namespace, key, value in self._yield_rows(", value", "namespace LIKE ?", (f"{namespace_prefix}%",),
+                                                          batch_size):
+                # Values are already JSON, so they are written as they are instead of being decoded and encoded again
+                file.write(f'{{"namespace": {json.dumps(namespace)}, "key": {json.dumps(key)}, "value": {value}}}\n')
+                count += 1
+        return count
+
+    def import_ndjson(self, path: str, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """
+        Stores every row of a file written by export_ndjson, replacing rows with the same namespace and key.
+        Commits every batch_size rows, so a big file never has to fit in memory, and returns how many were stored.
+        If a line is bad, the batches before it stay stored.
+        """
+        count = 0
+        batch = []
+        with open(path, encoding="utf-8") as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                    batch.append((row["namespace"], row["key"], json.dumps(row["value"])))
+                except (ValueError, KeyError) as e:
+                    raise ValueError(f"Bad row on line {line_number} of {path}: {e}") from e
+                if len(batch) >= batch_size:
+                    self.mset(batch)
+                    count += len(batch)
+                    batch = []
+        self.mset(batch)
+        return count + len(batch)
 
-    def yield_keys(self, prefix: Optional[str] = "") -> Iterator[str]:
-        query = "SELECT key FROM store WHERE key LIKE ?"
-        for row in self._execute_query(query, (f"{prefix}%",)):
-            yield row[0]
+    def get_namespace_size(self, namespace: Tuple[str, ...]) -> Tuple[int, int]:
+        """
+        Returns how many rows a namespace has and how many bytes their keys and values take up.
+        """
+        query = "SELECT COUNT(*), COALESCE(SUM(LENGTH(key) + LENGTH(value)), 0) FROM store WHERE namespace = ?"
+        return self._execute_query(query, ("/".join(namespace),))[0]
 
     def search(self, namespace: Tuple[str, ...], limit: int) -> List[
         Tuple[str, Dict[str, Any]]]:
         namespace_str = "/".join(namespace)
         sql_query = "SELECT key, value FROM store WHERE namespace = ? LIMIT ?"
-        print(sql_query)
         results = self._execute_query(sql_query, (namespace_str, limit))
 
         return [(key, json.loads(value)) for key, value in results]
+
+    def search_text(self, namespace: Tuple[str, ...], query: str, limit: int) -> List[
+        Tuple[str, Dict[str, Any], str]]:
+        """
+        Returns the values in a namespace that contain any of the query's words, best matches first, as (key, value,
+        snippet) with the matched words in the snippet in [brackets].
+        """
+        words = re.findall(r"\w+", query)
+        if not words:
+            return []
+        namespace_str = "/".join(namespace)
+        if not self.has_text_search:
+            conditions = " OR ".join(["value LIKE ?"] * len(words))
+            sql_query = f"SELECT key, value FROM store WHERE namespace = ? AND ({conditions}) LIMIT ?"
+            results = self._execute_query(sql_query, (namespace_str, *(f"%{word}%" for word in words), limit))
+            return [(key, json.loads(value), value[:SNIPPET_LENGTH]) for key, value in results]
+
+        # Each word is quoted, so nothing the user typed is read as FTS5 query syntax
+        text_query = " OR ".join(f'"{word}"' for word in words)
+        sql_query = f"""
+            SELECT store.key, store.value, snippet(store_fts, 2, '[', ']', '...', {SNIPPET_WORDS})
+            FROM store_fts JOIN store ON store.rowid = store_fts.rowid
+            WHERE store_fts MATCH ? AND store_fts.namespace = ?
+            ORDER BY bm25(store_fts)
+            LIMIT ?
+        """
+        results = self._execute_query(sql_query, (text_query, namespace_str, limit))
+        return [(key, json.loads(value), snippet) for key, value, snippet in results]
+
+    def _get_io_executor(self) -> StoreIOExecutor:
+        if self._io_executor is None:
+            with self._io_executor_lock:
+                if self._io_executor is None:
+                    self._io_executor = StoreIOExecutor(self.db_path)
+        return self._io_executor
+
+    def get_stats(self) -> str:
+        return self._io_executor.get_stats() if self._io_executor else "No writes yet"
+
+    # Async versions of the above, safe to call from an event loop. They behave the same, but reads run on the store's
+    # reader threads and writes on its writer thread, where writes made at about the same time share a transaction.
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        return await self._get_io_executor().run(self.get, key)
+
+    async def amget(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        return await self._get_io_executor().run(self.mget, keys)
+
+    async def aput(self, namespace: Tuple[str, ...], key: str, value: Dict[str, Any],
+                   index: Literal[False] | List[str] | None = None) -> None:
+        await self.amset([("/".join(namespace), key, json.dumps(value))])
+
+    async def amset(self, key_value_pairs: List[Tuple[str, str, str]]) -> None:
+        await self._get_io_executor().run(self._write_rows, key_value_pairs, write=True)
+
+    async def adelete(self, key: str) -> None:
+        await self.amdelete([key])
+
+    async def amdelete(self, keys: List[str]) -> None:
+        await self._get_io_executor().run(self._delete_keys, keys, write=True)
+
+    async def asearch(self, namespace: Tuple[str, ...], limit: int) -> List[Tuple[str, Dict[str, Any]]]:
+        return await self._get_io_executor().run(self.search, namespace, limit)
+
+    async def asearch_text(self, namespace: Tuple[str, ...], query: str, limit: int) -> List[
+        Tuple[str, Dict[str, Any], str]]:
+        return await self._get_io_executor().run(self.search_text, namespace, query, limit)
+
+
+async def run_benchmark_client(store: SQLiteStore, mode: str, client: int, operations: int):
+    namespace = (f"benchmark_{client}", "memories")
+    for i in range(operations):
+        value = {f"memory_{i}": "The user likes pie. " * 10}
+        if mode == "sync":
+            store.put(namespace, str(i), value)
+            store.search(namespace, 10)
+        elif mode == "thread":
+            await asyncio.to_thread(store.put, namespace, str(i), value)
+            await asyncio.to_thread(store.search, namespace, 10)
+        else:
+            await store.aput(namespace, str(i), value)
+            await store.asearch(namespace, 10)
+
+
+async def run_benchmark(db_path: str, mode: str, clients: int, operations: int) -> tuple[float, float, str]:
+    """
+    Returns how long the clients took, the longest the event loop was blocked and the I/O thread's stats.
+    """
+    store = SQLiteStore(db_path)
+    lags = []
+    stop = asyncio.Event()
+
+    async def monitor_loop_lag():
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - start - 0.01)
+
+    monitor = asyncio.create_task(monitor_loop_lag())
+    start = time.perf_counter()
+    await asyncio.gather(*(run_benchmark_client(store, mode, client, operations) for client in range(clients)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+    return elapsed, max(lags, default=0.0), store._io_executor.get_stats() if store._io_executor else ""
+
+
+def benchmark(clients: int = 50, operations: int = 20):
+    """
+    Compares blocking calls, a thread per call and the async API with concurrent clients that each write and search.
+    """
+    for mode in ("sync", "thread", "async"):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            elapsed, max_lag, stats = asyncio.run(run_benchmark(f"{temp_dir}/benchmark.db", mode, clients, operations))
+        print(f"{mode}: {clients * operations * 2 / elapsed:.0f} calls/s, longest loop stall {max_lag * 1000:.0f}ms"
+              + (f" ({stats})" if stats else ""))
+
+
+def run_contention(db_path: str, single_writer: bool, seconds: float, writers: int = 4, readers: int = 2) -> str:
+    """
+    Has a checkpointer, store writers and store readers all hit one database at once, like the agent does.
+    Without single_writer, it is set up the old way: a rollback journal, default lock timeouts and a connection per
+    write.
+    """
+    store = SQLiteStore(db_path)
+    with contextlib.closing(connect(db_path)) as conn, conn:
+        if not single_writer:
+            conn.execute("PRAGMA journal_mode = DELETE")
+        conn.execute("CREATE TABLE checkpoints (id INTEGER PRIMARY KEY, data BLOB)")
+    stop = threading.Event()
+    lock = threading.Lock()
+    counts = {"checkpoints": 0, "store writes": 0, "reads": 0, "errors": 0}
+    checkpoint_waits = []
+    read_times = []
+
+    def count(name: str):
+        with lock:
+            counts[name] += 1
+
+    def checkpointer():
+        # The old checkpointer connection had the default 5 second lock timeout
+        conn = (connect if single_writer else sqlite3.connect)(db_path, isolation_level=None)
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                checkpoint_waits.append(time.perf_counter() - start)
+                conn.execute("INSERT INTO checkpoints (data) VALUES (?)", (b"x" * 4096,))
+                conn.execute("COMMIT")
+                count("checkpoints")
+            except sqlite3.OperationalError:
+                count("errors")
+
+    def store_writer(writer: int):
+        i = 0
+        while not stop.is_set():
+            rows = [(f"writer_{writer}/memories", str(i), json.dumps({f"memory_{i}": "The user likes pie. " * 10}))]
+            i += 1
+            try:
+                if single_writer:
+                    store.mset(rows)
+                else:
+                    with contextlib.closing(sqlite3.connect(db_path)) as conn, conn:
+                        store._write_rows(conn.cursor(), rows)
+                count("store writes")
+            except sqlite3.OperationalError:
+                count("errors")
+
+    def reader(reader_index: int):
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                store.search((f"writer_{reader_index}", "memories"), 10)
+                read_times.append(time.perf_counter() - start)
+                count("reads")
+            except sqlite3.OperationalError:
+                count("errors")
+
+    threads = ([threading.Thread(target=checkpointer)]
+               + [threading.Thread(target=store_writer, args=(i,)) for i in range(writers)]
+               + [threading.Thread(target=reader, args=(i,)) for i in range(readers)])
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    rates = ", ".join(f"{value / seconds:.0f} {name}/s" for name, value in counts.items() if name != "errors")
+    report = (f"{rates}, {counts['errors']} errors, checkpoint lock wait p99 {get_p99(checkpoint_waits):.0f}ms, "
+              f"read p99 {get_p99(read_times):.0f}ms")
+    return report + (f"\n  Store writer: {store.get_stats()}" if single_writer else "")
+
+
+def get_p99(seconds: list[float]) -> float:
+    return sorted(seconds)[int(len(seconds) * 0.99)] * 1000 if seconds else 0.0
+
+
+def benchmark_contention(seconds: float = 5.0):
+    """
+    Compares the old locking setup with WAL, busy timeouts and the single writer.
+    """
+    for name, single_writer in (("Rollback journal", False), ("WAL and single writer", True)):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            print(f"{name}: {run_contention(f'{temp_dir}/contention.db', single_writer, seconds)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark, back up or restore a store.")
+    parser.add_argument("command", nargs="?", choices=["benchmark", "contention", "export", "import"],
+                        default="benchmark")
+    parser.add_argument("--db", default=get_memory_db_path(), help="Database to export from or import into.")
+    parser.add_argument("--file", help="Newline delimited JSON file to export to or import from.")
+    parser.add_argument("--namespace", default="", help="Only export namespaces starting with this.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per page or transaction.")
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        benchmark()
+        return
+    if args.command == "contention":
+        benchmark_contention()
+        return
+    if not args.file:
+        parser.error(f"{args.command} needs --file")
+    store = SQLiteStore(args.db)
+    start = time.perf_counter()
+    if args.command == "export":
+        count = store.export_ndjson(args.file, args.namespace, args.batch_size)
+        print(f"Exported {count} rows from {args.db} to {args.file} in {time.perf_counter() - start:.1f}s")
+    else:
+        count = store.import_ndjson(args.file, args.batch_size)
+        print(f"Imported {count} rows from {args.file} into {args.db} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
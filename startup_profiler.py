@@ -0,0 +1,161 @@
+"""
+Startup profiler and benchmark for the frontends.
+
+Shows how long each package takes to import for an entry point, including the packages it only imports on first use,
+and how long main_cli takes to show its first prompt. Deferred imports are timed separately, so moving a heavy import
+behind a lazy module still shows up as a regression instead of just disappearing from the startup time.
+Save a baseline with --save-baseline, then use --check to fail (exit code 1) if startup gets noticeably slower.
+
+Usage: python startup_profiler.py [main_cli miss_fritters main_discord] [--runs 3] [--check | --save-baseline]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from main_cli import FIRST_PROMPT
+
+DEFAULT_ENTRY_POINTS = ["main_cli", "miss_fritters", "main_discord"]
+FIRST_PROMPT_SCRIPTS = {"main_cli": ("main_cli.py", FIRST_PROMPT)}  # Entry points that show a prompt when ready
+BASELINE_PATH = "startup_baseline.json"
+REGRESSION_TOLERANCE = 1.25  # How much slower than the baseline startup can get before --check fails
+REGRESSION_SLACK = 0.05  # Seconds ignored when checking, so tiny timings don't fail on noise
+FIRST_PROMPT_TIMEOUT = 300.0
+TOP_PACKAGES = 15
+
+
+def profile_imports(module_name: str) -> tuple[float, float, dict[str, float]]:
+    """
+    Imports a module in a fresh interpreter with -X importtime, then forces every lazy module it registered to load.
+    Returns the import time, the time the deferred imports took, and the time spent importing each top-level package,
+    deferred ones included, in seconds.
+    """
+    code = f"import {module_name}; import lazy_modules; lazy_modules.load_now(*lazy_modules.lazy_modules.values())"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module_name} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    package_seconds = defaultdict(float)
+    total_seconds = 0.0
+    deferred_seconds = 0.0
+    imported = False
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        package_seconds[name.split(".")[0]] += int(self_us) / 1e6
+        if imported:
+            deferred_seconds += int(self_us) / 1e6  # Lines come as imports finish, so these came after the module
+        elif name == module_name:
+            total_seconds = int(cumulative_us) / 1e6
+            imported = True
+    return total_seconds, deferred_seconds, dict(package_seconds)
+
+
+def time_to_first_prompt(script: str, prompt: str) -> float:
+    """
+    Starts a frontend and times how long it takes to ask for input.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-u", script], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        output = ""
+        while prompt not in output:
+            character = process.stdout.read(1)
+            if not character:
+                raise RuntimeError(f"{script} exited before showing its prompt.")
+            output += character
+            if time.perf_counter() - start > FIRST_PROMPT_TIMEOUT:
+                raise RuntimeError(f"{script} didn't show its prompt within {FIRST_PROMPT_TIMEOUT}s.")
+        return time.perf_counter() - start
+    finally:
+        process.kill()
+        process.wait()
+
+
+def measure(entry_point: str, runs: int) -> dict:
+    """
+    Returns the median import time, deferred import time and time to first prompt (if it has one) over a number of
+    runs.
+    """
+    import_times = []
+    deferred_times = []
+    packages = {}
+    for _ in range(runs):
+        total_seconds, deferred_seconds, packages = profile_imports(entry_point)
+        import_times.append(total_seconds)
+        deferred_times.append(deferred_seconds)
+    result = {"import_seconds": statistics.median(import_times),
+              "deferred_import_seconds": statistics.median(deferred_times), "packages": packages}
+    if entry_point in FIRST_PROMPT_SCRIPTS:
+        script, prompt = FIRST_PROMPT_SCRIPTS[entry_point]
+        result["first_prompt_seconds"] = statistics.median(time_to_first_prompt(script, prompt) for _ in range(runs))
+    return result
+
+
+def print_report(entry_point: str, result: dict):
+    print(f"\n{entry_point}: {result['import_seconds']:.2f}s to import, "
+          f"{result['deferred_import_seconds']:.2f}s more for the modules it loads on first use")
+    if "first_prompt_seconds" in result:
+        print(f"  Time to first prompt: {result['first_prompt_seconds']:.2f}s")
+    slowest = sorted(result["packages"].items(), key=lambda item: item[1], reverse=True)[:TOP_PACKAGES]
+    for package, seconds in slowest:
+        print(f"  {seconds * 1000:8.1f}ms  {package}")
+
+
+def check_regressions(results: dict, baseline: dict) -> list[str]:
+    regressions = []
+    for entry_point, result in results.items():
+        for metric in ("import_seconds", "deferred_import_seconds", "first_prompt_seconds"):
+            baseline_seconds = baseline.get(entry_point, {}).get(metric)
+            if baseline_seconds is None or metric not in result:
+                continue
+            if result[metric] > baseline_seconds * REGRESSION_TOLERANCE + REGRESSION_SLACK:
+                regressions.append(f"{entry_point} {metric}: {result[metric]:.2f}s, baseline {baseline_seconds:.2f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile and benchmark startup time.")
+    parser.add_argument("entry_points", nargs="*", default=DEFAULT_ENTRY_POINTS)
+    parser.add_argument("--runs", type=int, default=3, help="Runs per measurement, the median is used.")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Save the results to {BASELINE_PATH}.")
+    parser.add_argument("--check", action="store_true", help="Fail if startup is slower than the baseline.")
+    args = parser.parse_args()
+
+    results = {}
+    for entry_point in args.entry_points:
+        try:
+            results[entry_point] = measure(entry_point, args.runs)
+        except RuntimeError as e:
+            print(f"\nSkipping {entry_point}: {e}")
+            continue
+        print_report(entry_point, results[entry_point])
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as file:
+            json.dump({entry_point: {key: value for key, value in result.items() if key != "packages"}
+                       for entry_point, result in results.items()}, file, indent=2)
+        print(f"\nSaved baseline to {BASELINE_PATH}")
+    if args.check:
+        if not os.path.exists(BASELINE_PATH):
+            print("\nNo baseline to check against, save one first with --save-baseline.")
+            sys.exit(1)
+        with open(BASELINE_PATH, "r") as file:
+            regressions = check_regressions(results, json.load(file))
+        if regressions:
+            print("\nStartup got slower:\n" + "\n".join(regressions))
+            sys.exit(1)
+        print("\nStartup is within the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import fritters_utils
+from sqlite_store import SQLiteStore
+
+MAX_ENTRIES = 10000  # Most values and search results kept
+MAX_BYTES = 32 * 1024 * 1024  # Most bytes of JSON the cached values and search results add up to
+MAX_AGE = 300  # Seconds before an entry is read again, so writes made by other processes show up eventually
+
+
+class LRUCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES, max_age: float = MAX_AGE):
+        """
+        Least recently used cache bounded by entry count and size. Each entry belongs to a namespace, or to none, so
+        all the entries for a namespace can be dropped at once.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # Cache key -> (value, size, namespace, time stored)
+        self.namespaces = {}  # Namespace -> cache keys of its entries
+        self.size = 0
+        self.generation = 0  # Goes up on every invalidation, so reads that raced a write aren't cached
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, cache_key):
+        """
+        Returns (True, value) if the key is cached, otherwise (False, None).
+        """
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None and time.monotonic() - entry[3] > self.max_age:
+                self._remove(cache_key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(cache_key)
+            self.hits += 1
+            return True, entry[0]
+
+    def put(self, cache_key, value, namespace: str | None, generation: int):
+        """
+        Caches a value read when the cache was at the given generation. It is dropped if anything was invalidated
+        since, because it might be from before that write.
+        """
+        size = len(json.dumps(value))
+        with self.lock:
+            if generation != self.generation or size > self.max_bytes:
+                return
+            if cache_key in self.entries:
+                self._remove(cache_key)
+            self.entries[cache_key] = (value, size, namespace, time.monotonic())
+            self.size += size
+            if namespace is not None:
+                self.namespaces.setdefault(namespace, set()).add(cache_key)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, cache_keys=(), namespaces=(), everything_in_namespaces: bool = False):
+        """
+        Drops the given entries and every entry in the given namespaces, or every namespaced entry at all.
+        """
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            if everything_in_namespaces:
+                namespaces = list(self.namespaces)
+            for namespace in namespaces:
+                for cache_key in self.namespaces.get(namespace, set()).copy():
+                    self._remove(cache_key)
+            for cache_key in cache_keys:
+                if cache_key in self.entries:
+                    self._remove(cache_key)
+
+    def _remove(self, cache_key):
+        _, size, namespace, _ = self.entries.pop(cache_key)
+        self.size -= size
+        if namespace is not None:
+            keys = self.namespaces[namespace]
+            keys.discard(cache_key)
+            if not keys:
+                del self.namespaces[namespace]
+
+    def get_stats(self) -> str:
+        with self.lock:
+            lookups = self.hits + self.misses
+            hit_ratio = self.hits / lookups if lookups else 0.0
+            return (f"{self.hits} hits, {self.misses} misses ({hit_ratio:.0%} hit ratio), {len(self.entries)} entries, "
+                    f"{self.size / 1024:.1f}KB, {self.evictions} evictions, {self.invalidations} invalidations")
+
+
+class CachedSQLiteStore(SQLiteStore):
+    def __init__(self, db_path: str = ":memory:", max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES,
+                 max_age: float = MAX_AGE):
+        """
+        SQLiteStore that keeps decoded values and search results in memory, so looking up the same memories again
+        doesn't touch the disk. Writes made through it drop whatever they could have changed. Writes made by other
+        processes show up once the entries they change are max_age seconds old.
+        Cached values are shared between callers, so they shouldn't be changed.
+        """
+        self.cache = LRUCache(max_entries, max_bytes, max_age)
+        super().__init__(db_path)
+
+    def _read_through(self, cache_key, namespace: str | None, load):
+        found, value = self.cache.get(cache_key)
+        if found:
+            return value
+        generation = self.cache.generation
+        value = load()
+        self.cache.put(cache_key, value, namespace, generation)
+        return value
+
+    async def _aread_through(self, cache_key, namespace: str | None, aload):
+        found, value = self.cache.get(cache_key)
+        if found:
+            return value  # Straight from memory, without a trip to a reader thread
+        generation = self.cache.generation
+        value = await aload()
+        self.cache.put(cache_key, value, namespace, generation)
+        return value
+
+    def get(self, key: str):
+        return self._read_through(("get", key), None, lambda: SQLiteStore.get(self, key))
+
+    def mget(self, keys: list[str]):
+        values, missing, generation = self._get_cached_values(keys)
+        if missing:
+            self._cache_values(values, missing, SQLiteStore.mget(self, missing), generation)
+        return [values[key] for key in keys]
+
+    def _get_cached_values(self, keys: list[str]) -> tuple[dict, list[str], int]:
+        """
+        Returns the cached values, the keys that weren't cached, and the generation to cache those under once read.
+        """
+        generation = self.cache.generation
+        values = {}
+        missing = []
+        for key in keys:
+            found, value = self.cache.get(("get", key))
+            if found:
+                values[key] = value
+            else:
+                missing.append(key)
+        return values, missing, generation
+
+    def _cache_values(self, values: dict, keys: list[str], loaded: list, generation: int):
+        for key, value in zip(keys, loaded):
+            values[key] = value
+            self.cache.put(("get", key), value, None, generation)
+
+    def search(self, namespace: tuple[str, ...], limit: int):
+        namespace_str = "/".join(namespace)
+        return self._read_through(("search", namespace_str, limit), namespace_str,
+                                  lambda: SQLiteStore.search(self, namespace, limit))
+
+    def search_text(self, namespace: tuple[str, ...], query: str, limit: int):
+        namespace_str = "/".join(namespace)
+        return self._read_through(("search_text", namespace_str, query, limit), namespace_str,
+                                  lambda: SQLiteStore.search_text(self, namespace, query, limit))
+
+    def _read_uncached(self, function, *args):
+        """
+        Runs one of SQLiteStore's own read methods on a reader thread, skipping the cache.
+        """
+        return self._get_io_executor().run(function, self, *args)
+
+    async def aget(self, key: str):
+        return await self._aread_through(("get", key), None, lambda: self._read_uncached(SQLiteStore.get, key))
+
+    async def amget(self, keys: list[str]):
+        values, missing, generation = self._get_cached_values(keys)
+        if missing:
+            self._cache_values(values, missing, await self._read_uncached(SQLiteStore.mget, missing), generation)
+        return [values[key] for key in keys]
+
+    async def asearch(self, namespace: tuple[str, ...], limit: int):
+        namespace_str = "/".join(namespace)
+        return await self._aread_through(("search", namespace_str, limit), namespace_str,
+                                         lambda: self._read_uncached(SQLiteStore.search, namespace, limit))
+
+    async def asearch_text(self, namespace: tuple[str, ...], query: str, limit: int):
+        namespace_str = "/".join(namespace)
+        return await self._aread_through(("search_text", namespace_str, query, limit), namespace_str,
+                                         lambda: self._read_uncached(SQLiteStore.search_text, namespace, query, limit))
+
+    # Writes drop the cached values for their keys and every search of their namespaces. Deletes only know the keys,
+    # so they drop every cached search. They are invalidated after the write too, so a read that started before the
+    # write finished can't be cached.
+
+    def invalidate_rows(self, key_value_pairs):
+        self.cache.invalidate([("get", key) for _, key, _ in key_value_pairs],
+                              {namespace for namespace, _, _ in key_value_pairs})
+
+    def invalidate_keys(self, keys):
+        self.cache.invalidate([("get", key) for key in keys], everything_in_namespaces=True)
+
+    def mset(self, key_value_pairs):
+        try:
+            super().mset(key_value_pairs)
+        finally:
+            self.invalidate_rows(key_value_pairs)
+
+    def mdelete(self, keys):
+        try:
+            super().mdelete(keys)
+        finally:
+            self.invalidate_keys(keys)
+
+    async def amset(self, key_value_pairs):
+        try:
+            await super().amset(key_value_pairs)
+        finally:
+            self.invalidate_rows(key_value_pairs)
+
+    async def amdelete(self, keys):
+        try:
+            await super().amdelete(keys)
+        finally:
+            self.invalidate_keys(keys)
+
+    def get_stats(self) -> str:
+        return f"{super().get_stats()}. Cache: {self.cache.get_stats()}"
+
+
+def get_store(db_path: str) -> SQLiteStore:
+    """
+    Returns a store with a cache of store_cache_mb megabytes (from config.json, 32 by default), or without a cache if
+    it is 0.
+    """
+    cache_mb = fritters_utils.get_key_from_json_config_file(fritters_utils.STORE_CACHE_MB_KEY)
+    if cache_mb is None:
+        return CachedSQLiteStore(db_path)
+    if float(cache_mb) <= 0:
+        return SQLiteStore(db_path)
+    return CachedSQLiteStore(db_path, max_bytes=int(float(cache_mb) * 1024 * 1024))
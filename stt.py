@@ -1,55 +1,288 @@
+import json
+import time
+import wave
+from abc import ABC, abstractmethod
+
+import numpy as np
 import speech_recognition as sr
 
+import fritters_utils
+
+# Audio parameters
+SAMPLE_RATE = 16000  # Both engines work best with 16 kHz mono audio
+SAMPLE_WIDTH = 2  # 16-bit PCM
+FRAME_DURATION_MS = 30  # Audio is handed to the VAD and recognizer in 30 ms frames
+NOISE_MARGIN = 1.5  # How much louder than the background noise speech has to be
+NOISE_SMOOTHING = 0.02  # Weight of the newest quiet frame in the background noise level
+
+
+def get_frame_size(sample_rate: int) -> int:
+    """
+    Number of samples in a single frame at the given sample rate.
+    """
+    return sample_rate * FRAME_DURATION_MS // 1000
+
+
+class SpeechRecognizer(ABC):
+    """
+    Interface for speech-to-text engines.
+    Frames of 16-bit mono PCM are streamed in while the user is still talking,
+    so an engine can decode incrementally and only has a little work left once speech ends.
+    """
+
+    @abstractmethod
+    def start(self, sample_rate: int):
+        """
+        Prepares for a new utterance.
+        """
+
+    @abstractmethod
+    def accept_frame(self, frame: bytes):
+        """
+        Feeds a single frame of speech to the engine.
+        """
+
+    @abstractmethod
+    def finish(self) -> str | None:
+        """
+        Returns the recognized text for the utterance, or None if nothing was understood.
+        """
+
+
+class GoogleSpeechRecognizer(SpeechRecognizer):
+    """
+    Uses Google Speech Recognition. Needs the network and can only recognize once the whole phrase is in.
+    """
 
-class StuffHearer:
     def __init__(self):
-        # Initialize the recognizer in the constructor for better flexibility
         self.recognizer = sr.Recognizer()
+        self.sample_rate = SAMPLE_RATE
+        self.frames = []
 
-    def hear_stuff(self):
+    def start(self, sample_rate: int):
+        self.sample_rate = sample_rate
+        self.frames = []
+
+    def accept_frame(self, frame: bytes):
+        self.frames.append(frame)
+
+    def finish(self) -> str | None:
+        audio = sr.AudioData(b"".join(self.frames), self.sample_rate, SAMPLE_WIDTH)
+        try:
+            return self.recognizer.recognize_google(audio)
+        except sr.UnknownValueError:
+            print("Google Speech Recognition could not understand the audio.")
+        except sr.RequestError:
+            print("Could not request results from Google Speech Recognition service.")
+        return None
+
+
+class VoskSpeechRecognizer(SpeechRecognizer):
+    """
+    Uses a local Vosk model, so it works offline and decodes each frame as it arrives.
+    Models can be downloaded from https://alphacephei.com/vosk/models
+    """
+
+    def __init__(self, model_path: str):
+        # Only imported when the offline engine is used, so the Google engine doesn't need it installed
+        from vosk import Model, KaldiRecognizer, SetLogLevel
+        SetLogLevel(-1)
+        self.model = Model(model_path)
+        self.recognizer_class = KaldiRecognizer
+        self.recognizer = None
+
+    def start(self, sample_rate: int):
+        self.recognizer = self.recognizer_class(self.model, sample_rate)
+
+    def accept_frame(self, frame: bytes):
+        self.recognizer.AcceptWaveform(frame)
+
+    def finish(self) -> str | None:
+        result = json.loads(self.recognizer.FinalResult()).get("text", "")
+        return result or None
+
+
+class EnergyVAD:
+    def __init__(self, threshold: float = 500.0, silence_ms: int = 800, speech_ms: int = 90, padding_ms: int = 300):
+        """
+        Energy based voice-activity detection over fixed size frames.
+        - threshold: RMS level above which a frame counts as speech.
+        - silence_ms: How long the audio has to stay quiet before the utterance is over.
+        - speech_ms: How long the audio has to be loud before it counts as the start of speech.
+        - padding_ms: How much audio from before the start of speech is kept, so the first word isn't clipped.
+        """
+        self.threshold = threshold
+        self.min_threshold = threshold
+        self.noise_level = None  # Running average level of the frames that weren't speech
+        self.silence_frames = silence_ms // FRAME_DURATION_MS
+        self.speech_frames = max(1, speech_ms // FRAME_DURATION_MS)
+        self.padding_frames = padding_ms // FRAME_DURATION_MS
+
+    def calibrate(self, frames):
+        """
+        Sets the threshold from a sample of ambient noise, similar to Recognizer.adjust_for_ambient_noise.
+        """
+        self.noise_level = max((get_rms(frame) for frame in frames), default=0.0)
+        self.threshold = max(self.min_threshold, self.noise_level * NOISE_MARGIN)
+        print(f"VAD threshold set to {self.threshold:.0f}")
+
+    def update_noise(self, frame: bytes):
+        """
+        Follows the level of the quiet frames between utterances, so the threshold comes back down when the room
+        gets quieter after calibrating.
+        """
+        level = get_rms(frame)
+        self.noise_level = level if self.noise_level is None else \
+            self.noise_level + NOISE_SMOOTHING * (level - self.noise_level)
+        self.threshold = max(self.min_threshold, self.noise_level * NOISE_MARGIN)
+
+    def is_speech(self, frame: bytes) -> bool:
+        return get_rms(frame) > self.threshold
+
+
+def get_rms(frame: bytes) -> float:
+    """
+    Root mean square level of a frame of 16-bit PCM audio.
+    """
+    samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+    return float(np.sqrt(np.mean(samples ** 2))) if len(samples) else 0.0
+
+
+def read_wav_frames(filename: str):
+    """
+    Reads a 16-bit mono WAV file, returning (sample_rate, frames).
+    Lets the whole pipeline be exercised from recordings instead of a microphone.
+    """
+    with wave.open(filename, 'rb') as wf:
+        if wf.getsampwidth() != SAMPLE_WIDTH or wf.getnchannels() != 1:
+            raise ValueError(f"{filename} must be 16-bit mono audio.")
+        sample_rate = wf.getframerate()
+        frame_size = get_frame_size(sample_rate)
+        frames = []
+        data = wf.readframes(frame_size)
+        while len(data) == frame_size * SAMPLE_WIDTH:
+            frames.append(data)
+            data = wf.readframes(frame_size)
+    return sample_rate, frames
+
+
+def get_default_recognizer() -> SpeechRecognizer:
+    """
+    Uses the offline Vosk engine if a model is configured (vosk_model_path in config.json), otherwise Google.
+    """
+    model_path = fritters_utils.get_key_from_json_config_file(fritters_utils.VOSK_MODEL_PATH_KEY)
+    if model_path:
+        return VoskSpeechRecognizer(model_path)
+    return GoogleSpeechRecognizer()
+
+
+class StuffHearer:
+    def __init__(self, recognizer: SpeechRecognizer | None = None, vad: EnergyVAD | None = None):
+        self.recognizer = recognizer or get_default_recognizer()
+        self.vad = vad or EnergyVAD()
+        self.last_speech_end = None
+        self.stream_ended = False
+
+    def hear_stuff(self, timeout: float = 10.0):
         """
         Listens to the microphone and recognizes speech.
         Returns the recognized text if successful, otherwise None.
         """
-        with sr.Microphone() as source:
-            self._adjust_for_noise(source)
+        frame_size = get_frame_size(SAMPLE_RATE)
+        with sr.Microphone(sample_rate=SAMPLE_RATE, chunk_size=frame_size) as source:
+            frames = iter(lambda: source.stream.read(frame_size), b"")
+            self._adjust_for_noise(frames)
             print("Speak your truth!")
-            audio = self._listen_to_audio(source)
+            return self.hear_frames(frames, SAMPLE_RATE, timeout)
 
-        if audio:
-            result = self._recognize_audio(audio)
-            return result
-        return None
+    def hear_stuff_continuously(self, on_speech_start=None):
+        """
+        Keeps the microphone open and yields each recognized utterance.
+        on_speech_start is called as soon as the user starts talking, before anything is recognized.
+        """
+        frame_size = get_frame_size(SAMPLE_RATE)
+        with sr.Microphone(sample_rate=SAMPLE_RATE, chunk_size=frame_size) as source:
+            frames = iter(lambda: source.stream.read(frame_size), b"")
+            self._adjust_for_noise(frames)
+            print("Speak your truth!")
+            while True:
+                result = self.hear_frames(frames, SAMPLE_RATE, on_speech_start=on_speech_start)
+                if result:
+                    yield result
+                if self.stream_ended:
+                    print("The microphone stopped sending audio.")
+                    return
 
-    def _adjust_for_noise(self, source):
+    def hear_stuff_from_wav(self, filename: str):
         """
-        Adjust the recognizer for ambient noise in the environment.
+        Recognizes speech from a WAV file through the same VAD and streaming path as the microphone.
         """
-        self.recognizer.adjust_for_ambient_noise(source, duration=1)
+        sample_rate, frames = read_wav_frames(filename)
+        return self.hear_frames(iter(frames), sample_rate, timeout=None)
 
-    def _listen_to_audio(self, source):
+    def hear_frames(self, frames, sample_rate: int, timeout: float | None = None, on_speech_start=None):
         """
-        Listens to audio from the microphone and returns the audio data.
+        Waits for speech in the frames, streams it into the recognizer as it arrives and
+        returns the recognized text once the speaker goes quiet.
+        The time the speaker went quiet is kept in last_speech_end, and whether the frames ran out in stream_ended.
         """
-        try:
-            return self.recognizer.listen(source)
-        except sr.WaitTimeoutError:
-            print("Timeout: No speech detected.")
-            return None
-        except Exception as e:
-            print(f"Error listening to audio: {e}")
+        self.stream_ended = False
+        max_waiting_frames = None if timeout is None else int(timeout * 1000 / FRAME_DURATION_MS)
+        padding = []
+        loud_frames = 0
+        waited = 0
+
+        # Wait for the start of speech, keeping a little audio from before it
+        for frame in frames:
+            padding = (padding + [frame])[-(self.vad.padding_frames + self.vad.speech_frames):]
+            if self.vad.is_speech(frame):
+                loud_frames += 1
+            else:
+                loud_frames = 0
+                self.vad.update_noise(frame)
+            if loud_frames >= self.vad.speech_frames:
+                break
+            waited += 1
+            if max_waiting_frames is not None and waited >= max_waiting_frames:
+                print("Timeout: No speech detected.")
+                return None
+        else:
+            print("No speech detected.")
+            self.stream_ended = True
             return None
 
-    def _recognize_audio(self, audio):
+        if on_speech_start is not None:
+            on_speech_start()
+        self.recognizer.start(sample_rate)
+        for frame in padding:
+            self.recognizer.accept_frame(frame)
+
+        # Stream speech into the recognizer until it has been quiet for long enough
+        quiet_frames = 0
+        last_speech = time.perf_counter()
+        for frame in frames:
+            self.recognizer.accept_frame(frame)
+            if self.vad.is_speech(frame):
+                quiet_frames = 0
+                last_speech = time.perf_counter()
+            else:
+                quiet_frames += 1
+            if quiet_frames >= self.vad.silence_frames:
+                break
+        else:
+            self.stream_ended = True
+
+        # When the speaker actually went quiet, not when the silence after it was long enough to be sure
+        self.last_speech_end = last_speech
+        result = self.recognizer.finish()
+        print(f"Speech-end to text latency: {(time.perf_counter() - self.last_speech_end) * 1000:.0f} ms")
+        if result:
+            print(f"Here's what you said: {result}")
+        return result
+
+    def _adjust_for_noise(self, frames, duration: float = 1.0):
         """
-        Recognizes speech from the audio and returns the result as text.
+        Adjust the VAD for ambient noise in the environment.
         """
-        try:
-            result = self.recognizer.recognize_google(audio)
-            print(f"Here's what you said: {result}")
-            return result
-        except sr.UnknownValueError:
-            print("Google Speech Recognition could not understand the audio.")
-        except sr.RequestError:
-            print("Could not request results from Google Speech Recognition service.")
-        return None
+        num_frames = int(duration * 1000 / FRAME_DURATION_MS)
+        self.vad.calibrate([next(frames) for _ in range(num_frames)])
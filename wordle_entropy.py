@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+TREE_PATH = "wordle_decision_tree.json"  # Path to save/load the precomputed decision tree
+SOLVED_CODE = 242  # Pattern code for (2, 2, 2, 2, 2)
+NUM_PATTERNS = 243  # 3 ** 5 possible feedback patterns
+GUESS_BLOCK_SIZE = 256  # Number of guesses scored at once, keeps memory bounded on the full word list
+CANDIDATE_BONUS = 0.5  # Score credit for guessing a word that could still be the answer
+POWERS_OF_THREE = np.array([1, 3, 9, 27, 81], dtype=np.uint8)
+
+
+def feedback_code(feedback) -> int:
+    """
+    Packs a feedback tuple (as returned by get_feedback) into a single base-3 integer.
+    """
+    return sum(int(f) * 3 ** i for i, f in enumerate(feedback))
+
+
+def get_word_list_hash(words) -> str:
+    """
+    Generate a hash of the word list so a stale tree can be detected when the word list changes.
+    """
+    return hashlib.md5("\n".join(words).encode("utf-8")).hexdigest()
+
+
+def compute_feedback_codes(guesses: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    Computes the feedback pattern code for every (guess, target) pair of the given letter arrays.
+    Follows the same rules as wordle_integration.get_feedback:
+    - 2: Letter is correct and in the correct position.
+    - 1: Letter appears anywhere else in the target.
+    - 0: Letter is not in the target word.
+    """
+    # Lookup table of which targets contain each character, indexed by character code
+    contains = np.zeros((256, len(targets)), dtype=bool)
+    contains[targets, np.arange(len(targets))[:, None]] = True
+
+    codes = np.zeros((len(guesses), len(targets)), dtype=np.uint8)
+    for i in range(5):
+        # A correct letter in the correct position is also in the target, so 2 = present + green
+        feedback = contains[guesses[:, i]].view(np.uint8) + (guesses[:, i, None] == targets[None, :, i])
+        codes += feedback * POWERS_OF_THREE[i]
+    return codes
+
+
+def words_to_letters(words) -> np.ndarray:
+    """
+    Converts a list of 5-letter words into an (n, 5) array of character codes.
+    """
+    return np.array([[ord(c) for c in word] for word in words], dtype=np.uint8)
+
+
+def build_feedback_matrix(words) -> np.ndarray:
+    """
+    Computes the feedback pattern code for every (guess, target) pair in the word list.
+    """
+    letters = words_to_letters(words)
+    matrix = np.empty((len(words), len(words)), dtype=np.uint8)
+    for start in range(0, len(words), GUESS_BLOCK_SIZE):
+        matrix[start:start + GUESS_BLOCK_SIZE] = compute_feedback_codes(letters[start:start + GUESS_BLOCK_SIZE],
+                                                                        letters)
+    return matrix
+
+
+def best_guess(matrix: np.ndarray, candidates: np.ndarray) -> int:
+    """
+    Picks the guess with the highest expected information gain over the candidate set.
+    Any word in the list may be guessed, but a remaining candidate wins ties since it might be the answer.
+    Maximizing the entropy of the feedback distribution is the same as minimizing sum(c * log2(c))
+    over the pattern counts, so that is what gets scored.
+    """
+    if len(candidates) <= 2:
+        return int(candidates[0])
+
+    is_candidate = np.zeros(len(matrix), dtype=bool)
+    is_candidate[candidates] = True
+    best_index = candidates[0]
+    best_score = np.inf
+    for start in range(0, len(matrix), GUESS_BLOCK_SIZE):
+        block = np.arange(start, min(start + GUESS_BLOCK_SIZE, len(matrix)))
+        codes = matrix[start:start + GUESS_BLOCK_SIZE, candidates].astype(np.int64)
+        codes += np.arange(len(block))[:, None] * NUM_PATTERNS
+        counts = np.bincount(codes.ravel(), minlength=len(block) * NUM_PATTERNS).reshape(len(block), NUM_PATTERNS)
+        scores = (counts * np.log2(np.maximum(counts, 1))).sum(axis=1) - is_candidate[block] * CANDIDATE_BONUS
+        block_best = int(np.argmin(scores))
+        if scores[block_best] < best_score:
+            best_score = scores[block_best]
+            best_index = block[block_best]
+    return int(best_index)
+
+
+def _build_node(words, matrix: np.ndarray, candidates: np.ndarray) -> dict:
+    """
+    Recursively builds the decision tree node for the given candidate set.
+    Each node stores the guess to make and a child per feedback pattern that still has candidates.
+    """
+    if len(candidates) == 1:
+        return {"guess": words[candidates[0]], "children": {}}
+
+    guess_index = best_guess(matrix, candidates)
+    codes = matrix[guess_index, candidates]
+    children = {}
+    for code in np.unique(codes):
+        if code == SOLVED_CODE:
+            continue
+        children[str(int(code))] = _build_node(words, matrix, candidates[codes == code])
+    return {"guess": words[guess_index], "children": children}
+
+
+def build_decision_tree(words) -> dict:
+    """
+    Builds the full decision tree for every word in the word list.
+    """
+    start = time.perf_counter()
+    matrix = build_feedback_matrix(words)
+    print(f"Feedback matrix built in {time.perf_counter() - start:.1f}s.")
+    root = _build_node(words, matrix, np.arange(len(words)))
+    print(f"Decision tree built in {time.perf_counter() - start:.1f}s.")
+    return {"word_list_hash": get_word_list_hash(words), "root": root}
+
+
+def load_or_build_tree(words, tree_path: str = TREE_PATH) -> dict:
+    """
+    Loads the persisted decision tree, rebuilding and saving it if it is missing or the word list changed.
+    """
+    if os.path.exists(tree_path):
+        with open(tree_path, "r") as f:
+            tree = json.load(f)
+        if tree.get("word_list_hash") == get_word_list_hash(words):
+            print("Precomputed decision tree loaded successfully!")
+            return tree
+        print("Word list changed since the decision tree was built, rebuilding...")
+    else:
+        print("No saved decision tree found. Building a new one...")
+
+    tree = build_decision_tree(words)
+    with open(tree_path, "w") as f:
+        json.dump(tree, f, separators=(",", ":"))
+    print(f"Decision tree saved to {tree_path}.")
+    return tree
+
+
+class EntropySolver:
+    def __init__(self, words, tree_path: str = TREE_PATH):
+        """
+        Solves Wordle by walking a precomputed entropy-maximizing decision tree.
+        - words: The word list the tree covers.
+        - tree_path: Where the tree is persisted.
+        """
+        self.tree = load_or_build_tree(words, tree_path)
+
+    def play(self, target_word, feedback_fn, max_attempts: int = 6):
+        """
+        Plays a game against the target word, returning the list of (guess, feedback) pairs.
+        Each step is a dictionary lookup, so serving a game does no search at all.
+        """
+        node = self.tree["root"]
+        turns = []
+        for _ in range(max_attempts):
+            guess = node["guess"]
+            feedback = feedback_fn(guess, target_word)
+            turns.append((guess, feedback))
+            code = feedback_code(feedback)
+            if code == SOLVED_CODE:
+                break
+            node = node["children"].get(str(code))
+            if node is None:
+                print(f"{target_word} is not covered by the decision tree, giving up.")
+                break
+        return turns
+
+
+# Precompute the tree ahead of time by running this module directly
+if __name__ == "__main__":
+    with open("wordle_words.txt", "r") as f:
+        word_list = [line.strip() for line in f.readlines() if len(line.strip()) == 5]
+    load_or_build_tree(word_list)
@@ -1,12 +1,15 @@
 import numpy as np
 import random
+import time
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from collections import deque
 from sklearn.feature_extraction.text import CountVectorizer
 import os
 
+from wordle_entropy import EntropySolver
+from wordle_training import VectorizedWordleEnv, ReplayMemory
+
 # Load the full Wordle dataset from file
 with open("wordle_words.txt", "r") as f:
     word_list = [line.strip() for line in f.readlines() if len(line.strip()) == 5]  # Ensure only 5-letter words
@@ -77,11 +80,16 @@ epsilon = 1.0  # Exploration rate (starts high and decays)
 epsilon_decay = 0.999  # Decay rate for epsilon to encourage exploitation
 epsilon_min = 0.1  # Minimum epsilon value
 batch_size = 64  # Number of experiences per training step
+num_envs = 64  # Number of games stepped at once during training
 memory_size = 5000  # Size of experience replay memory
 num_episodes = 5000  # Total number of training episodes
 save_interval = 1000  # Save model every 1000 episodes
 model_path = "wordle_dqn_model.pth"  # Path to save/load the model
 
+# Available solver engines
+DQN_SOLVER = "dqn"
+ENTROPY_SOLVER = "entropy"
+
 # Initialize DQN
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # Use GPU if available
 dqn = DQN(input_dim=5, output_dim=len(word_list)).to(device)
@@ -89,61 +97,43 @@ optimizer = optim.Adam(dqn.parameters(), lr=learning_rate)
 loss_fn = nn.MSELoss()
 
 # Experience Replay Memory
-memory = deque(maxlen=memory_size)
+memory = ReplayMemory(memory_size)
 
-# Load pre-trained model if it exists
-if os.path.exists(model_path):
-    dqn.load_state_dict(torch.load(model_path))
-    dqn.eval()  # Set to evaluation mode
-    print("Pretrained model loaded successfully!")
-else:
-    print("No saved model found. Training a new model...")
+# Entropy solver, loaded lazily since building its decision tree takes a while the first time
+entropy_solver = None
+
+
+def train_dqn():
+    """
+    Trains the DQN on num_envs games at a time and reports throughput in episodes/sec.
+    """
+    global epsilon
+    env = VectorizedWordleEnv(word_list, num_envs)
+    start_time = time.perf_counter()
+    episodes_done = 0
+
+    while episodes_done < num_episodes:
+        state = env.reset()
+        done = False
+
+        while not done:
+            # Choose actions using an epsilon-greedy strategy, one per game
+            explore = np.random.random(num_envs) < epsilon
+            random_actions = (np.random.random(num_envs) * env.possible_counts()).astype(np.int64)  # Explore
+            with torch.no_grad():
+                state_tensor = torch.from_numpy(state).to(device)
+                best_actions = torch.argmax(dqn(state_tensor), dim=1).cpu().numpy()  # Exploit
+            actions = np.where(explore, random_actions, best_actions)
 
-    # Training loop
-    for episode in range(num_episodes):
-        target_word = random.choice(word_list)  # Select a random target word
-        guesses = []
-        feedbacks = []
-        possible_words = word_list.copy()
-        attempts = 0
-        state = np.zeros(5)  # Initialize state representation
-
-        while attempts < 6:  # Wordle allows up to 6 attempts
-            # Ensure there's a valid word list to choose from
-            if len(possible_words) == 0:
-                possible_words = word_list.copy()  # Reset if empty
-                print("Possible words list is empty, resetting.")
-
-            # Choose action using epsilon-greedy strategy
-            if random.uniform(0, 1) < epsilon:
-                action_index = random.randint(0, len(possible_words) - 1)  # Random choice (explore)
-            else:
-                state_tensor = torch.tensor(state, dtype=torch.float32, device=device).unsqueeze(0)
-                action_index = torch.argmax(dqn(state_tensor)).item()  # Choose best action (exploit)
-
-            # Ensure action index is valid
-            action_index = min(action_index, len(possible_words) - 1)
-
-            guess = possible_words[action_index]
-            feedback = get_feedback(guess, target_word)
-            reward = feedback.count(2)  # Reward = count of correct letters
-
-            # Update possible words based on feedback
-            possible_words = get_possible_words(guesses + [guess], feedbacks + [feedback])
-            next_state = np.array([f for f in feedback])  # Convert feedback to state
-
-            # Store experience in replay memory
-            memory.append((state, action_index, reward, next_state))
+            next_state, rewards, done = env.step(actions)
+
+            # Store experiences in replay memory
+            memory.push_batch(state, actions, rewards, next_state)
 
             # Train on minibatch if enough data is available
             if len(memory) >= batch_size:
-                minibatch = random.sample(memory, batch_size)
-                states, actions, rewards, next_states = zip(*minibatch)
-
-                states = torch.tensor(states, dtype=torch.float32, device=device)
-                actions = torch.tensor(actions, dtype=torch.long, device=device)
-                rewards = torch.tensor(rewards, dtype=torch.float32, device=device)
-                next_states = torch.tensor(next_states, dtype=torch.float32, device=device)
+                states, actions, rewards, next_states = (torch.from_numpy(a).to(device)
+                                                         for a in memory.sample(batch_size))
 
                 current_Q = dqn(states).gather(1, actions.unsqueeze(1)).squeeze()
                 next_Q = dqn(next_states).max(1)[0].detach()
@@ -155,33 +145,80 @@ else:
                 optimizer.step()
 
             state = next_state
-            guesses.append(guess)
-            feedbacks.append(feedback)
-            attempts += 1
 
-        # Decay epsilon after each episode
-        if epsilon > epsilon_min:
-            epsilon *= epsilon_decay
+        # Decay epsilon once per finished episode
+        epsilon = max(epsilon * epsilon_decay ** num_envs, epsilon_min)
 
         # Save model periodically
-        if (episode + 1) % save_interval == 0:
+        previous_episodes = episodes_done
+        episodes_done += num_envs
+        if episodes_done // save_interval > previous_episodes // save_interval:
             torch.save(dqn.state_dict(), model_path)
-            print(f"Checkpoint saved at episode {episode + 1}.")
+            elapsed = time.perf_counter() - start_time
+            print(f"Checkpoint saved at episode {episodes_done} ({episodes_done / elapsed:.1f} episodes/sec).")
 
     # Save final trained model
     torch.save(dqn.state_dict(), model_path)
-    print("Training completed! Model saved.")
+    elapsed = time.perf_counter() - start_time
+    print(f"Training completed in {elapsed:.1f}s ({episodes_done / elapsed:.1f} episodes/sec)! Model saved.")
+
+
+# Load pre-trained model if it exists
+if os.path.exists(model_path):
+    dqn.load_state_dict(torch.load(model_path))
+    dqn.eval()  # Set to evaluation mode
+    print("Pretrained model loaded successfully!")
+else:
+    print("No saved model found. Training a new model...")
+    train_dqn()
+    dqn.eval()
+
+
+def play_wordle_internal(target_word, game_number=1345, solver=DQN_SOLVER):
+    """
+    Plays a game of Wordle against the target word with the selected solver engine.
+    - DQN_SOLVER: Picks guesses with the trained DQN.
+    - ENTROPY_SOLVER: Walks the precomputed entropy-maximizing decision tree.
+    """
+    if solver == ENTROPY_SOLVER:
+        turns = get_entropy_solver().play(target_word, get_feedback)
+    else:
+        turns = play_wordle_dqn(target_word)
+    return format_wordle_result(turns, game_number)
 
 
-def play_wordle_internal(target_word, game_number=1345):
+def get_entropy_solver():
+    """
+    Returns the shared entropy solver, loading (or building) its decision tree on first use.
+    """
+    global entropy_solver
+    if entropy_solver is None:
+        entropy_solver = EntropySolver(word_list)
+    return entropy_solver
+
+
+def format_wordle_result(turns, game_number):
+    """
+    Formats a list of (guess, feedback) pairs as a shareable Wordle result.
+    """
+    result_body = ""
+    for guess, feedback in turns:
+        print(f"Guess: {guess}")
+        # Convert feedback to colored emojis
+        emoji_feedback = "".join(["🟩" if f == 2 else "🟨" if f == 1 else "⬛" for f in feedback])
+        result_body += f"\n{emoji_feedback}"
+
+    # Add number of attempts at the end, or indicate failure with X/6
+    if turns and turns[-1][1] == (2, 2, 2, 2, 2):
+        return f"Wordle {game_number}  {len(turns)}/6\r\n{result_body.strip()} "
+    return f"Wordle {game_number}  X/6\r\n{result_body.strip()}"
+
+
+def play_wordle_dqn(target_word):
     state = np.zeros(5)  # Initial state (no feedback yet)
     guesses = []
     feedbacks = []
 
-    # Start with the formatted header
-    result_header = f"Wordle {game_number} "
-    result_body = ""
-
     # Keep track of possible words based on feedback
     possible_words = word_list.copy()
 
@@ -195,38 +232,26 @@ def play_wordle_internal(target_word, game_number=1345):
         action_index = min(action_index, len(possible_words) - 1)
 
         guess = possible_words[action_index]
-        print(f"Guess: {guess}")
-
         feedback = get_feedback(guess, target_word)
 
-        # Convert feedback to colored emojis
-        emoji_feedback = "".join(["🟩" if f == 2 else "🟨" if f == 1 else "⬛" for f in feedback])
-
-        # Append guess with emoji feedback to the result string
-        result_body += f"\n{emoji_feedback}"
+        # Keep track of guesses and feedbacks for future decisions
+        guesses.append(guess)
+        feedbacks.append(feedback)
 
         # Check if the guess is correct
         if feedback == (2, 2, 2, 2, 2):  # All letters are correct
-            result_header = result_header + f" {attempt + 1}/6"
-            result = result_header + f"\r\n{result_body.strip()} "  # Add number of attempts at the end
-            return result
+            break
 
         # Update the possible words list based on feedback
-        possible_words = get_possible_words(guesses + [guess], feedbacks + [feedback])
+        possible_words = get_possible_words(guesses, feedbacks)
 
         # Update state with the feedback of the current guess
         state = np.array([f for f in feedback])
 
-        # Keep track of guesses and feedbacks for future decisions
-        guesses.append(guess)
-        feedbacks.append(feedback)
-
-    # If the AI fails to guess in 6 attempts
-    result_header = result_header + " X/6"
-    result = result_header + f"\r\n{result_body.strip()}"  # Indicate failure with X/6
-    return result
+    return list(zip(guesses, feedbacks))
 
 # Test the trained model
 # test_word = random.choice(word_list)
 # print(f"Target Word: {test_word}")
 # print(play_wordle_internal(test_word))
+# print(play_wordle_internal(test_word, solver=ENTROPY_SOLVER))
@@ -0,0 +1,98 @@
+import numpy as np
+
+from wordle_entropy import compute_feedback_codes, words_to_letters
+
+STATE_SIZE = 5  # One feedback value per letter
+MAX_ATTEMPTS = 6  # Wordle allows up to 6 attempts
+
+
+class VectorizedWordleEnv:
+    def __init__(self, word_list, num_envs: int, seed=None):
+        """
+        Steps many games of Wordle at once using NumPy arrays instead of per-game Python lists.
+        - word_list: The words that can be guessed and picked as targets.
+        - num_envs: Number of games played in lockstep.
+        """
+        self.letters = words_to_letters(word_list)
+        self.num_words = len(word_list)
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+        self.env_range = np.arange(num_envs)
+        self.targets = np.zeros(num_envs, dtype=np.int64)
+        self.possible = np.ones((num_envs, self.num_words), dtype=bool)  # Possible words mask per game
+        self.states = np.zeros((num_envs, STATE_SIZE), dtype=np.float32)
+        self.attempts = 0
+
+    def reset(self) -> np.ndarray:
+        """
+        Starts a new game in every environment with a random target word.
+        """
+        self.targets = self.rng.integers(0, self.num_words, size=self.num_envs)
+        self.possible.fill(True)
+        self.states.fill(0)
+        self.attempts = 0
+        return self.states.copy()
+
+    def possible_counts(self) -> np.ndarray:
+        """
+        Returns how many possible words are left in each game.
+        """
+        return self.possible.sum(axis=1)
+
+    def step(self, actions: np.ndarray):
+        """
+        Makes one guess in every game.
+        Actions index into each game's possible words, clamped the same way the single-game loop does.
+        Returns (next_states, rewards, done).
+        """
+        actions = np.minimum(actions, self.possible_counts() - 1)
+        # Index of the action-th possible word in each row
+        guesses = np.argmax(np.cumsum(self.possible, axis=1) > actions[:, None], axis=1)
+
+        codes = compute_feedback_codes(self.letters[guesses], self.letters)
+        target_codes = codes[self.env_range, self.targets]
+        self.possible &= codes == target_codes[:, None]
+
+        feedback = (target_codes[:, None] // 3 ** np.arange(STATE_SIZE)) % 3
+        self.states = feedback.astype(np.float32)
+        rewards = (feedback == 2).sum(axis=1).astype(np.float32)  # Reward = count of correct letters
+
+        self.attempts += 1
+        return self.states.copy(), rewards, self.attempts >= MAX_ATTEMPTS
+
+
+class ReplayMemory:
+    def __init__(self, capacity: int, state_size: int = STATE_SIZE, seed=None):
+        """
+        Experience replay memory backed by preallocated NumPy arrays used as a ring buffer.
+        """
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+        self.states = np.zeros((capacity, state_size), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros((capacity, state_size), dtype=np.float32)
+        self.position = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push_batch(self, states, actions, rewards, next_states):
+        """
+        Stores a batch of transitions, overwriting the oldest ones once the buffer is full.
+        """
+        indices = (self.position + np.arange(len(actions))) % self.capacity
+        self.states[indices] = states
+        self.actions[indices] = actions
+        self.rewards[indices] = rewards
+        self.next_states[indices] = next_states
+        self.position = (self.position + len(actions)) % self.capacity
+        self.size = min(self.size + len(actions), self.capacity)
+
+    def sample(self, batch_size: int):
+        """
+        Returns a random minibatch as (states, actions, rewards, next_states) arrays.
+        """
+        indices = self.rng.integers(0, self.size, size=batch_size)
+        return self.states[indices], self.actions[indices], self.rewards[indices], self.next_states[indices]
@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import itertools
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client
+
+AUTHKEY_ENV = "FRITTERS_WORKER_AUTHKEY"
+HEARTBEAT_INTERVAL = 1.0  # How often workers report in
+HEARTBEAT_TIMEOUT = 30.0  # A worker that hasn't reported in this long is considered hung
+STARTUP_TIMEOUT = 120.0  # How long a worker gets to connect back after being started
+REQUEST_TIMEOUT = 300.0  # How long a worker gets to answer a request it started, heartbeats or not
+HEALTH_CHECK_INTERVAL = 5.0
+SHUTDOWN_TIMEOUT = 10.0
+
+
+def get_shard(user_id: str, num_workers: int) -> int:
+    """
+    Picks the worker for a user. Uses md5 rather than hash() so the mapping is the same across processes and restarts.
+    """
+    return int(hashlib.md5(user_id.encode("utf-8")).hexdigest(), 16) % num_workers
+
+
+class WorkerHandle:
+    def __init__(self, index: int, authkey: bytes, on_message):
+        """
+        Starts a worker process and keeps the connection to it.
+        Requests sent before the worker connects back are held in the outbox until it does.
+        """
+        self.index = index
+        self.on_message = on_message
+        self.listener = Listener(family="AF_UNIX", authkey=authkey)
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), self.listener.address, str(index)],
+                                        env=dict(os.environ, **{AUTHKEY_ENV: authkey.hex()}))
+        self.connection = None
+        self.connected = threading.Event()
+        self.outbox = queue.Queue()
+        self.started_at = time.monotonic()
+        self.last_heartbeat = None
+        self.request_started = None  # When the worker started on the request it is working on, None if it is idle
+        self.ready = False
+        threading.Thread(target=self._read, daemon=True).start()
+        threading.Thread(target=self._write, daemon=True).start()
+
+    def send(self, message: tuple):
+        self.outbox.put(message)
+
+    def is_healthy(self) -> bool:
+        """
+        A worker is healthy if its process is running, it has reported in recently enough and it isn't stuck on a
+        request. Heartbeats come from their own thread, so they keep coming while a request hangs.
+        """
+        if self.process.poll() is not None:
+            return False
+        if self.is_timed_out():
+            return False
+        if self.last_heartbeat is None:
+            return time.monotonic() - self.started_at < STARTUP_TIMEOUT
+        return time.monotonic() - self.last_heartbeat < HEARTBEAT_TIMEOUT
+
+    def is_timed_out(self) -> bool:
+        request_started = self.request_started
+        return request_started is not None and time.monotonic() - request_started > REQUEST_TIMEOUT
+
+    def kill(self):
+        self.process.kill()
+        self.listener.close()  # Unblocks a reader still waiting for the worker to connect
+        if self.connection is not None:
+            self.connection.close()
+
+    def _read(self):
+        try:
+            self.connection = self.listener.accept()
+            self.connected.set()
+            while True:
+                message = self.connection.recv()
+                self.last_heartbeat = time.monotonic()
+                if message[0] == "ready":
+                    self.ready = True
+                    print(f"Worker {self.index} (pid {self.process.pid}) is ready.")
+                elif message[0] == "started":
+                    self.request_started = time.monotonic()
+                elif message[0] == "result":
+                    self.request_started = None
+                    self.on_message(self, message)
+        except (EOFError, OSError):
+            pass
+
+    def _write(self):
+        self.connected.wait()
+        try:
+            while True:
+                self.connection.send(self.outbox.get())
+        except (EOFError, OSError):
+            pass
+
+
+class WorkerPool:
+    def __init__(self, num_workers: int, health_check_interval: float = HEALTH_CHECK_INTERVAL):
+        """
+        Runs ask_stuff in separate worker processes, each with its own agent stack, sharded by user id.
+        A user always lands on the same worker, so their requests run in order and in-memory state like their
+        deck of cards stays consistent. Crashed or hung workers are restarted by a background health check.
+        """
+        self.num_workers = num_workers
+        self.health_check_interval = health_check_interval
+        self.authkey = os.urandom(32)
+        self.lock = threading.Lock()
+        self.pending = {}  # request_id -> (worker index, Future)
+        self.request_ids = itertools.count()
+        self.restarts = [0] * num_workers
+        self.workers = [WorkerHandle(i, self.authkey, self._on_message) for i in range(num_workers)]
+        self.closed = False
+        threading.Thread(target=self._monitor, daemon=True).start()
+
+    def submit(self, prompt: str, source, user_id: str) -> Future:
+        """
+        Sends a prompt to the user's worker, returning a Future for the response.
+        """
+        future = Future()
+        index = get_shard(user_id, self.num_workers)
+        with self.lock:
+            request_id = next(self.request_ids)
+            self.pending[request_id] = (index, future)
+            self.workers[index].send(("ask", request_id, prompt, source, user_id))
+        return future
+
+    def ask_stuff(self, prompt: str, source, user_id: str) -> str:
+        """
+        Same as miss_fritters.ask_stuff, run on the user's worker.
+        """
+        return self.submit(prompt, source, user_id).result()
+
+    async def ask_stuff_async(self, prompt: str, source, user_id: str) -> str:
+        """
+        Same as miss_fritters.ask_stuff, run on the user's worker without blocking the event loop.
+        """
+        return await asyncio.wrap_future(self.submit(prompt, source, user_id))
+
+    def health(self) -> list[dict]:
+        """
+        Returns the status of each worker.
+        """
+        now = time.monotonic()
+        with self.lock:
+            pending_counts = [sum(1 for index, _ in self.pending.values() if index == i)
+                              for i in range(self.num_workers)]
+            return [{
+                "worker": worker.index,
+                "pid": worker.process.pid,
+                "ready": worker.ready,
+                "healthy": worker.is_healthy(),
+                "heartbeat_age": None if worker.last_heartbeat is None else round(now - worker.last_heartbeat, 1),
+                "request_age": None if worker.request_started is None else round(now - worker.request_started, 1),
+                "pending": pending_counts[worker.index],
+                "restarts": self.restarts[worker.index],
+            } for worker in self.workers]
+
+    def close(self):
+        """
+        Stops every worker, giving them a chance to finish up (and flush their memory writes) first.
+        """
+        self.closed = True
+        for worker in self.workers:
+            worker.send(("stop",))
+        for worker in self.workers:
+            try:
+                worker.process.wait(timeout=SHUTDOWN_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+
+    def _on_message(self, worker: WorkerHandle, message: tuple):
+        _, request_id, ok, value = message
+        with self.lock:
+            _, future = self.pending.pop(request_id, (None, None))
+        if future is None:
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(RuntimeError(f"Worker {worker.index} failed: {value}"))
+
+    def _monitor(self):
+        while not self.closed:
+            time.sleep(self.health_check_interval)
+            for index, worker in enumerate(self.workers):
+                if not self.closed and not worker.is_healthy():
+                    self._restart(index)
+
+    def _restart(self, index: int):
+        """
+        Replaces a crashed or hung worker, failing whatever it was working on.
+        """
+        old_worker = self.workers[index]
+        if old_worker.is_timed_out():
+            print(f"Worker {index} (pid {old_worker.process.pid}) took over {REQUEST_TIMEOUT:.0f}s on a request, "
+                  f"restarting it.")
+        else:
+            print(f"Worker {index} (pid {old_worker.process.pid}) is unhealthy, restarting it.")
+        old_worker.kill()
+        with self.lock:
+            failed = [request_id for request_id, (worker_index, _) in self.pending.items() if worker_index == index]
+            futures = [self.pending.pop(request_id)[1] for request_id in failed]
+            self.workers[index] = WorkerHandle(index, self.authkey, self._on_message)
+            self.restarts[index] += 1
+        for future in futures:
+            future.set_exception(RuntimeError(f"Worker {index} crashed or hung while handling the request."))
+
+
+def run_worker(address: str, index: int):
+    """
+    Entry point of a worker process. Connects back to the pool and answers requests one at a time.
+    """
+    connection = Client(address, family="AF_UNIX", authkey=bytes.fromhex(os.environ[AUTHKEY_ENV]))
+    send_lock = threading.Lock()
+
+    def send(message: tuple):
+        with send_lock:
+            connection.send(message)
+
+    def heartbeat():
+        while True:
+            send(("heartbeat",))
+            time.sleep(HEARTBEAT_INTERVAL)
+
+    # Heartbeats start before the agent stack loads, so a slow startup isn't mistaken for a hang
+    threading.Thread(target=heartbeat, daemon=True).start()
+    from miss_fritters import ask_stuff
+    send(("ready",))
+    print(f"Worker {index} started.")
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break  # The pool went away
+        if message[0] == "stop":
+            break
+        _, request_id, prompt, source, user_id = message
+        send(("started", request_id))  # Starts the pool's clock on this request
+        try:
+            send(("result", request_id, True, ask_stuff(prompt, source, user_id)))
+        except Exception as e:
+            send(("result", request_id, False, f"{type(e).__name__}: {e}"))
+
+
+if __name__ == "__main__":
+    run_worker(sys.argv[1], int(sys.argv[2]))